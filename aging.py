@@ -0,0 +1,162 @@
+"""Due dates, overdue invoices and the aging report.
+
+Every invoice gets a due date when it is saved: its invoice date plus the
+client's payment_days (net days), or PAYMENT_DAYS for clients without
+structured terms.  The due date is stored, so new terms for a client do not
+move the due dates of invoices already issued; the form and the API can set
+one by hand.  Invoices saved through the ORM get theirs from a flush hook,
+bulk inserts (imports, recurring invoices) compute them with payment_days().
+
+mark_overdue() is the periodic job (flask --app wsgi mark-overdue): sent
+invoices past their due date become Overdue, overdue ones whose due date was
+moved into the future are Sent again.  Each is a set-based UPDATE over the
+(state, due_date) index, about BATCH_SIZE invoices per transaction, that bumps
+version_id (an edit form opened before gets a conflict instead of writing
+the old state back) and moves the amounts between the state buckets of the
+report summary (reports.restate()) without recomputing them.
+
+aging_report() sums the open invoices per client and currency into days past
+due columns in one GROUP BY.
+"""
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import database
+import reports
+from models import db, utcnow, Client, Invoice
+
+PAYMENT_DAYS = 30  # Net days for clients without payment_days
+SENT, OVERDUE = 'Sent', 'Overdue'
+OPEN_STATES = [SENT, OVERDUE]  # Issued and not paid yet
+BATCH_SIZE = 10000
+# Aging columns: (key, heading, first day past due); each runs up to the next one
+BUCKETS = [
+    ('not_due', 'Not Due', None),
+    ('days_0_30', '0-30', 0),
+    ('days_31_60', '31-60', 31),
+    ('days_61_90', '61-90', 61),
+    ('days_over_90', '90+', 91),
+]
+invoices = Invoice.__table__
+
+
+def due_date(invoice_date, payment_days=None):
+    return invoice_date + timedelta(days=PAYMENT_DAYS if payment_days is None else payment_days)
+
+
+def payment_days(client_ids=None):
+    """{client id: net days} for the given clients, or for all of them."""
+    query = sa.select(Client.id, sa.func.coalesce(Client.payment_days, PAYMENT_DAYS))
+    if client_ids is not None:
+        query = query.where(Client.id.in_(set(client_ids)))
+    return dict(db.session.execute(query).all())
+
+
+def _add_days(day, days, dialect_name):
+    if dialect_name == 'sqlite':
+        return sa.func.date(day, sa.func.printf('+%d days', days))
+    return day + days
+
+
+def fill_due_dates(connection=None):
+    """Give the invoices without a due date one from their client's terms; returns how many."""
+    conn = connection or db.session.connection()
+    days = (sa.select(sa.func.coalesce(Client.payment_days, PAYMENT_DAYS))
+            .where(Client.id == invoices.c.client_id).scalar_subquery())
+    return conn.execute(invoices.update().where(invoices.c.due_date.is_(None)).values(
+        due_date=_add_days(invoices.c.invoice_date, days, conn.dialect.name),
+        version_id=invoices.c.version_id + 1, updated_at=utcnow())).rowcount
+
+
+def _due_date_ranges(criterion, batch_size):
+    """Consecutive (first, last) due dates holding about `batch_size` of the matching invoices each."""
+    counts = db.session.execute(sa.select(invoices.c.due_date, sa.func.count()).where(criterion)
+                                .group_by(invoices.c.due_date).order_by(invoices.c.due_date)).all()
+    ranges, first, size = [], None, 0
+    for day, count in counts:
+        first, size = first or day, size + count
+        if size >= batch_size:
+            ranges.append((first, day))
+            first, size = None, 0
+    if first:
+        ranges.append((first, counts[-1][0]))
+    return ranges
+
+
+def _change_state(old_state, new_state, criterion, batch_size):
+    """Move the invoices in `old_state` matching `criterion` to `new_state`, one batch per transaction.
+
+    A batch is a range of due dates, so every statement of it selects the
+    same invoices through the (state, due_date) index without a list of ids.
+    """
+    changed = 0
+    for first, last in _due_date_ranges(sa.and_(invoices.c.state == old_state, criterion), batch_size):
+        database.begin_write(db.session)
+        batch = sa.and_(invoices.c.state == old_state, criterion, invoices.c.due_date.between(first, last))
+        # Set-based UPDATEs bypass the flush hooks of the report summary
+        reports.restate(batch, old_state, new_state)
+        changed += db.session.execute(invoices.update().where(batch).values(
+            state=new_state, version_id=invoices.c.version_id + 1, updated_at=utcnow())).rowcount
+        db.session.commit()
+    return changed
+
+
+def mark_overdue(today=None, batch_size=BATCH_SIZE):
+    """Flip Sent invoices past their due date to Overdue and back; returns (overdue, no longer overdue)."""
+    today = today or date.today()
+    database.begin_write(db.session)
+    fill_due_dates()  # Invoices written by older code or by hand
+    db.session.commit()
+    overdue = _change_state(SENT, OVERDUE, invoices.c.due_date < today, batch_size)
+    extended = _change_state(OVERDUE, SENT, invoices.c.due_date >= today, batch_size)
+    return overdue, extended
+
+
+def aging_report(today=None, client_id=None, currency=None, per_client=True):
+    """Open invoice totals per client and currency, split by days past the due date.
+
+    Every row is for one currency; without `per_client` there is one row per
+    currency over all clients.  Invoices without a due date count as not due.
+    """
+    today = today or date.today()
+    columns = []
+    for i, (key, _, first_day) in enumerate(BUCKETS):
+        following = BUCKETS[i + 1][2] if i + 1 < len(BUCKETS) else None
+        conditions = []
+        if first_day is None:
+            conditions.append(sa.or_(Invoice.due_date > today, Invoice.due_date.is_(None)))
+        else:
+            conditions.append(Invoice.due_date <= today - timedelta(days=first_day))
+        if following is not None and first_day is not None:
+            conditions.append(Invoice.due_date > today - timedelta(days=following))
+        columns.append(sa.func.sum(sa.case((sa.and_(*conditions), Invoice.total), else_=0)).label(key))
+    invoice_currency = sa.func.coalesce(Invoice.currency, '')
+    group_by = [Invoice.client_id, Client.company_name, Client.first_name, Client.last_name] if per_client else []
+    query = (
+        sa.select(*group_by, invoice_currency.label('currency'), sa.func.count().label('invoice_count'), *columns,
+                  sa.func.sum(Invoice.total).label('total'), sa.func.min(Invoice.due_date).label('oldest_due_date'))
+        .where(Invoice.state.in_(OPEN_STATES))
+        .group_by(*group_by, invoice_currency)
+        .order_by(*group_by[1:], *group_by[:1], invoice_currency)
+    )
+    if per_client:
+        query = query.join(Client, Invoice.client_id == Client.id)
+    if client_id:
+        query = query.where(Invoice.client_id == client_id)
+    if currency is not None:
+        query = query.where(invoice_currency == currency)
+    return db.session.execute(query).all()
+
+
+@event.listens_for(Session, 'before_flush')
+def _set_due_dates(session, flush_context, instances):
+    # A due date left empty comes from the client's terms, also when it was cleared in the form
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Invoice) and obj.due_date is None and obj.invoice_date is not None \
+                and obj.client_id is not None:
+            with session.no_autoflush:
+                client = session.get(Client, obj.client_id)
+            obj.due_date = due_date(obj.invoice_date, client.payment_days if client else None)
@@ -0,0 +1,405 @@
+"""Versioned JSON API for clients, invoices and their service lines (/api/v1).
+
+Lists are paginated with an opaque cursor (keyset on id) and return only the
+columns named in ?fields=; service lines are added with ?include=services
+and fetched with one IN query per page.  Invoices can be created and updated
+in batches: every item is validated with validation.clean_invoice, and the
+batch is written in a single transaction only if all items are valid.  An update may send
+the version_id it read; if the invoice has changed since, the item fails
+instead of overwriting the other change.
+
+Amounts are decimal strings ("1234.50"), dates ISO 8601.  The blueprint has
+no authentication of its own; app.py puts it behind the basic auth.
+"""
+import base64
+import binascii
+from datetime import date, datetime
+
+from flask import Blueprint, abort, request
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.exc import StaleDataError
+from werkzeug.exceptions import HTTPException
+
+from line_items import sync_services
+from models import db, utcnow, Client, Invoice, InvoiceService
+from pricing import price_invoice
+from validation import ValidationError, clean_client, clean_invoice
+
+blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+MAX_BATCH = 1000
+
+CLIENT_COLUMNS = [column.name for column in Client.__table__.columns]
+INVOICE_COLUMNS = [column.name for column in Invoice.__table__.columns]
+SERVICE_COLUMNS = [column.name for column in InvoiceService.__table__.columns]
+# Keys accepted in invoice payloads; the amounts are computed by pricing.price_invoice()
+INVOICE_INPUT = ['invoice_id', 'invoice_number', 'invoice_date', 'client_id', 'state', 'due_date',
+                 'discount', 'apply_vat', 'vat_percentage', 'currency', 'services']
+
+
+@blueprint.errorhandler(HTTPException)
+def json_error(e):
+    return {'error': e.description}, e.code
+
+
+@blueprint.errorhandler(StaleDataError)
+def edit_conflict(e):
+    # Another request updated or deleted the invoice between our read and our write
+    db.session.rollback()
+    return {'error': 'The invoice was changed by another request; read it again and retry.'}, 409
+
+
+def _json_value(value):
+    # Flask would format dates as HTTP dates; Decimals become strings already
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def _encode_cursor(last_id):
+    return base64.urlsafe_b64encode(f'id:{last_id}'.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        kind, _, value = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode().partition(':')
+        if kind != 'id':
+            raise ValueError(cursor)
+        return int(value)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400, 'Invalid cursor.')
+
+
+def _fields(available):
+    """Column names from ?fields=a,b (default: all); id is always included."""
+    requested = request.args.get('fields')
+    if not requested:
+        return list(available)
+    names = [name.strip() for name in requested.split(',') if name.strip()]
+    unknown = set(names) - set(available)
+    if unknown:
+        abort(400, f"Unknown fields: {', '.join(sorted(unknown))}.")
+    return ['id'] + [name for name in dict.fromkeys(names) if name != 'id']
+
+
+def _include_services():
+    return 'services' in request.args.get('include', '').split(',')
+
+
+def _rows(model, fields, *criteria, order_by=None, limit=None):
+    """Selected columns of `model` as JSON-ready dicts, without loading ORM objects."""
+    query = db.select(*[getattr(model, name) for name in fields]).where(*criteria)
+    query = query.order_by(order_by if order_by is not None else model.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [{name: _json_value(value) for name, value in zip(fields, row)}
+            for row in db.session.execute(query)]
+
+
+def _attach_services(items):
+    """Add the service lines of the listed invoices with one query."""
+    services = {item['id']: [] for item in items}
+    if services:
+        for line in _rows(InvoiceService, SERVICE_COLUMNS, InvoiceService.invoice_id.in_(list(services))):
+            services[line['invoice_id']].append(line)
+    for item in items:
+        item['services'] = services[item['id']]
+    return items
+
+
+def _page(model, fields, *criteria):
+    """One page of `model` rows after ?cursor=, at most ?limit= long."""
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+    cursor = request.args.get('cursor')
+    if cursor:
+        criteria += (model.id > _decode_cursor(cursor),)
+    items = _rows(model, fields, *criteria, limit=limit + 1)
+    next_cursor = _encode_cursor(items[limit - 1]['id']) if len(items) > limit else None
+    return items[:limit], next_cursor
+
+
+def _invoices_by_id(ids, fields=INVOICE_COLUMNS):
+    """Serialized invoices with their services, in the order of `ids`."""
+    items = {item['id']: item for item in _attach_services(_rows(Invoice, fields, Invoice.id.in_(ids)))}
+    return [items[invoice_id] for invoice_id in ids]
+
+
+def _json_body():
+    data = request.get_json(silent=True)
+    if data is None:
+        abort(400, 'The request body must be JSON.')
+    return data
+
+
+def _batch_body():
+    items = _json_body()
+    if isinstance(items, dict):
+        items = items.get('data')
+    if not isinstance(items, list) or not items:
+        abort(400, 'Send a non-empty list of invoices, or {"data": [...]}.')
+    if len(items) > MAX_BATCH:
+        abort(400, f'At most {MAX_BATCH} invoices per request.')
+    return items
+
+
+def _parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value) if 'T' in value else datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        abort(400, f'{name} must be an ISO date (YYYY-MM-DD) or date-time.')
+
+
+# Clients
+
+@blueprint.route('/clients')
+def list_clients():
+    criteria = []
+    updated_since = _parse_date_arg('updated_since')
+    if updated_since:
+        criteria.append(Client.updated_at >= updated_since)
+    items, next_cursor = _page(Client, _fields(CLIENT_COLUMNS), *criteria)
+    return {'data': items, 'next_cursor': next_cursor}
+
+
+@blueprint.route('/clients/<int:client_id>')
+def get_client(client_id):
+    items = _rows(Client, _fields(CLIENT_COLUMNS), Client.id == client_id)
+    if not items:
+        abort(404, f'Client {client_id} not found.')
+    return items[0]
+
+
+@blueprint.route('/clients', methods=['POST'])
+def create_client():
+    try:
+        fields = clean_client(_json_body())
+    except ValidationError as e:
+        return {'error': str(e)}, 422
+    client = Client(**fields)
+    db.session.add(client)
+    db.session.flush()
+    client_id = client.id  # Read before the commit expires the object
+    db.session.commit()
+    return _rows(Client, CLIENT_COLUMNS, Client.id == client_id)[0], 201
+
+
+@blueprint.route('/clients/<int:client_id>', methods=['PATCH'])
+def update_client(client_id):
+    client = db.session.get(Client, client_id)
+    if client is None:
+        abort(404, f'Client {client_id} not found.')
+    try:
+        fields = clean_client(_json_body())
+    except ValidationError as e:
+        return {'error': str(e)}, 422
+    for name, value in fields.items():
+        setattr(client, name, value)
+    db.session.commit()
+    return _rows(Client, CLIENT_COLUMNS, Client.id == client_id)[0]
+
+
+# Invoices
+
+@blueprint.route('/invoices')
+def list_invoices():
+    """Invoices, filtered by client_id, state, currency, date_from, date_to and updated_since."""
+    args = request.args
+    criteria = []
+    if args.get('client_id'):
+        criteria.append(Invoice.client_id == args.get('client_id', type=int))
+    if args.get('state'):
+        criteria.append(Invoice.state == args['state'])
+    if args.get('currency'):
+        criteria.append(Invoice.currency == args['currency'])
+    date_from, date_to = _parse_date_arg('date_from'), _parse_date_arg('date_to')
+    updated_since = _parse_date_arg('updated_since')
+    if date_from:
+        criteria.append(Invoice.invoice_date >= date_from)
+    if date_to:
+        criteria.append(Invoice.invoice_date <= date_to)
+    if updated_since:
+        criteria.append(Invoice.updated_at >= updated_since)
+    items, next_cursor = _page(Invoice, _fields(INVOICE_COLUMNS), *criteria)
+    if _include_services():
+        _attach_services(items)
+    return {'data': items, 'next_cursor': next_cursor}
+
+
+@blueprint.route('/invoices/<int:invoice_id>')
+def get_invoice(invoice_id):
+    items = _rows(Invoice, _fields(INVOICE_COLUMNS), Invoice.id == invoice_id)
+    if not items:
+        abort(404, f'Invoice {invoice_id} not found.')
+    if _include_services():
+        _attach_services(items)
+    return items[0]
+
+
+@blueprint.route('/invoices/<int:invoice_id>/services')
+def list_services(invoice_id):
+    if not db.session.query(Invoice.query.filter_by(id=invoice_id).exists()).scalar():
+        abort(404, f'Invoice {invoice_id} not found.')
+    return {'data': _rows(InvoiceService, _fields(SERVICE_COLUMNS), InvoiceService.invoice_id == invoice_id)}
+
+
+def _check_payload(item, allowed):
+    """Reject non-objects and unknown or read-only keys; returns the service lines."""
+    if not isinstance(item, dict):
+        raise ValidationError("Each invoice must be a JSON object.")
+    unknown = set(item) - set(allowed)
+    if unknown:
+        raise ValidationError(f"Unknown or read-only fields: {', '.join(sorted(unknown))}.")
+    lines = item.get('services', [])
+    if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+        raise ValidationError("services must be a list of objects.")
+    return lines
+
+
+def _item_id(value):
+    """An id from a payload: a JSON integer, or None for anything else (lists, booleans, ...)."""
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def _known_client_ids(items):
+    # Checked before hashing: a JSON list or object cannot go into a set
+    client_ids = {value for value in (item.get('client_id') for item in items if isinstance(item, dict))
+                  if isinstance(value, (int, str)) and not isinstance(value, bool)}
+    client_ids = {int(value) for value in client_ids if str(value).isdigit()}
+    return set(db.session.scalars(db.select(Client.id).where(Client.id.in_(client_ids))))
+
+
+def _create_invoices(items):
+    """Validate every item, then insert them all; returns (ids, errors)."""
+    client_ids = _known_client_ids(items)
+    invoice_ids = [item.get('invoice_id') for item in items if isinstance(item, dict)]
+    existing = set(db.session.scalars(db.select(Invoice.invoice_id).where(
+        Invoice.invoice_id.in_([str(value).strip() for value in invoice_ids if value is not None]))))
+    invoices, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            fields, lines = clean_invoice(item, _check_payload(item, INVOICE_INPUT))
+            if fields['client_id'] not in client_ids:
+                raise ValidationError(f"Unknown client {fields['client_id']}.")
+            if fields['invoice_id'] in existing:
+                raise ValidationError(f"Invoice {fields['invoice_id']} already exists.")
+        except ValidationError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        existing.add(fields['invoice_id'])  # Also catches duplicates within the batch
+        invoice = Invoice(**fields, services=[InvoiceService(**line) for line in lines])
+        price_invoice(invoice)
+        invoices.append(invoice)
+    if errors:
+        return [], errors
+    db.session.add_all(invoices)
+    db.session.flush()
+    ids = [invoice.id for invoice in invoices]  # Read before the commit expires the objects
+    db.session.commit()
+    return ids, []
+
+
+def _update_invoices(items):
+    """Apply partial updates ({"id": ..., changed fields}) to invoices; returns (ids, errors).
+
+    Missing fields keep their current value; "services", when present,
+    becomes the invoice's list of service lines.  Lines with the "id" of an
+    existing line update that line, other lines reuse or add rows (see
+    line_items.sync_services).  An optional "version_id" must match the
+    invoice's current one.
+    """
+    ids = [_item_id(item.get('id')) for item in items if isinstance(item, dict)]
+    current = {invoice.id: invoice for invoice in Invoice.query.options(selectinload(Invoice.services))
+               .filter(Invoice.id.in_([value for value in ids if value is not None]))}
+    client_ids = _known_client_ids(items)
+    updates, errors = [], []
+    for index, item in enumerate(items):
+        try:
+            lines = _check_payload(item, INVOICE_INPUT + ['id', 'version_id'])
+            invoice = current.get(_item_id(item.get('id')))
+            if invoice is None:
+                raise ValidationError(f"Invoice {item.get('id')} not found.")
+            if 'invoice_id' in item and str(item['invoice_id']).strip() != invoice.invoice_id:
+                raise ValidationError("invoice_id cannot be changed.")
+            if 'version_id' in item and item['version_id'] != invoice.version_id:
+                raise ValidationError(f"Invoice {invoice.id} has changed (version {invoice.version_id}); "
+                                      "read it again and retry.")
+            data = {name: getattr(invoice, name) for name in INVOICE_INPUT if name != 'services'}
+            data.update(item)
+            if 'services' not in item:
+                lines = [{'service': s.service, 'unit_cost': s.unit_cost, 'quantity': s.quantity}
+                         for s in invoice.services]
+            line_ids = [line.get('id') for line in lines]
+            fields, lines = clean_invoice(data, lines)
+            if fields['client_id'] != invoice.client_id and fields['client_id'] not in client_ids:
+                raise ValidationError(f"Unknown client {fields['client_id']}.")
+            if 'services' in item:
+                sync_services(invoice, lines, line_ids)
+        except ValidationError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+        updates.append((invoice, fields))
+    if errors:
+        db.session.rollback()  # Drop the service lines already synced for the valid items
+        return [], errors
+    for invoice, fields in updates:
+        for name, value in fields.items():
+            setattr(invoice, name, value)
+        price_invoice(invoice)
+        invoice.updated_at = utcnow()  # Service-only changes do not touch the invoice row otherwise
+    ids = [invoice.id for invoice, _ in updates]
+    db.session.commit()
+    return ids, []
+
+
+@blueprint.route('/invoices', methods=['POST'])
+def create_invoice():
+    ids, errors = _create_invoices([_json_body()])
+    if errors:
+        return {'error': errors[0]['error']}, 422
+    return _invoices_by_id(ids)[0], 201
+
+
+@blueprint.route('/invoices/<int:invoice_id>', methods=['PATCH'])
+def update_invoice(invoice_id):
+    if db.session.get(Invoice, invoice_id) is None:
+        abort(404, f'Invoice {invoice_id} not found.')
+    item = _json_body()
+    if not isinstance(item, dict):
+        abort(400, 'The request body must be a JSON object.')
+    ids, errors = _update_invoices([dict(item, id=invoice_id)])
+    if errors:
+        return {'error': errors[0]['error']}, 422
+    return _invoices_by_id(ids)[0]
+
+
+@blueprint.route('/invoices/<int:invoice_id>', methods=['DELETE'])
+def delete_invoice(invoice_id):
+    invoice = db.session.get(Invoice, invoice_id)
+    if invoice is None:
+        abort(404, f'Invoice {invoice_id} not found.')
+    db.session.delete(invoice)
+    db.session.commit()
+    return '', 204
+
+
+@blueprint.route('/invoices/batch', methods=['POST'])
+def create_invoices():
+    """Create up to MAX_BATCH invoices in one transaction; nothing is written if any item is invalid."""
+    ids, errors = _create_invoices(_batch_body())
+    if errors:
+        return {'errors': errors}, 422
+    return {'data': _invoices_by_id(ids)}, 201
+
+
+@blueprint.route('/invoices/batch', methods=['PATCH'])
+def update_invoices():
+    """Update up to MAX_BATCH invoices in one transaction; nothing is written if any item is invalid."""
+    ids, errors = _update_invoices(_batch_body())
+    if errors:
+        return {'errors': errors}, 422
+    return {'data': _invoices_by_id(ids)}
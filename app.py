@@ -1,52 +1,85 @@
 # app.py
-from flask import Flask, render_template, request, redirect, session, url_for, flash, make_response
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from flask import Flask, render_template, request, redirect, session, url_for, flash, make_response, abort, Response, stream_with_context
+from datetime import date, datetime, timedelta
 import logging
-import pdb
-import json
 from flask_httpauth import HTTPBasicAuth
 from config import Config  # Import the Config class
 from flask_migrate import Migrate
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+from sqlalchemy import func, or_
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.exc import StaleDataError
+import os
+import re
+from email.utils import formataddr
+from urllib.parse import urljoin
+from models import db, utcnow, Client, Delivery, Invoice, InvoiceService, RecurringInvoice
+from pricing import format_amount, price_invoice
+from render_cache import RenderCache, cache_key_digest
+from werkzeug.http import is_resource_modified
+from streaming import iter_zip
+import aging
+import api
+import archive
+import assets
+import click
+import client_lookup
+import database
+import delivery
+import exports
+import imports
+import metrics
+from line_items import sync_services
+import numbering
+import pdf
+import recurring
+import reports
+from registry import DEFAULT_LANGUAGE, DEFAULT_PERSONA, Registry
+import search
+from validation import ValidationError, clean_invoice
 
 app = Flask(__name__, static_folder='static')  
 auth = HTTPBasicAuth()
 app.config.from_object(Config)  # Load the configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///invoicing.db'
+# DATABASE_URL overrides config.py; pool options and SQLite pragmas are in database.py
+app.config['SQLALCHEMY_DATABASE_URI'] = database.database_uri(os.environ, app.config)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'], app.config.get('SQLALCHEMY_ENGINE_OPTIONS'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # Set a secret key for session management
 app.secret_key = app.config['SECRET_KEY']  # Replace with a strong secret key
 
-db = SQLAlchemy(app)
+db.init_app(app)
 migrate = Migrate(app, db)
+metrics.init_app(app)  # Latency, SQL and render time per route, see /metrics
+
+# Set up by create_app(): rendered print_invoice pages (see render_cache.py),
+# translations and personas, whose edits are picked up without a restart (see registry.py),
+# and the built static files (see assets.py)
+render_cache = None
+registry = None
+static_assets = None
 
 # Custom filter to format numbers with a space as a thousand separator
 @app.template_filter('thousands_separator')
 def thousands_separator(value):
     """Format a number with a space as a thousand separator."""
-    if isinstance(value, (int, float)):
-        return f"{value:,.0f}".replace(',', ' ')
-    return value
-
-# Load persona information
-try:
-    with open('personas.json', encoding='utf-8') as f:
-        PERSONAS = json.load(f)
-except json.JSONDecodeError as e:
-    logging.error(f"Error loading personas.json: {e}")
-    PERSONAS = {}
-
-# Load translations
-try:
-    with open('translations.json', encoding='utf-8') as f:
-        LANGUAGES = json.load(f)
-except json.JSONDecodeError as e:
-    logging.error(f"Error loading translations.json: {e}")
-    LANGUAGES = {}
+    return format_amount(value)
+
+@app.template_global()
+def asset_url(path):
+    """URL of a file under static/: its content-hashed build if there is one."""
+    return static_assets.url(path)
+
+@app.template_filter('highlight')
+def highlight(snippet):
+    """Escape a search snippet and mark the matched words."""
+    return search.snippet_html(snippet)
+
+@app.template_filter('client_label')
+def client_label(client):
+    """A client as the invoice form shows it."""
+    return client_lookup.label(client)
 
 # Define the authentication logic
 @auth.verify_password
@@ -55,63 +88,153 @@ def verify_password(username, password):
         return True
     return False
 
-# Define the Client model
-class Client(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    company_name = db.Column(db.String(100), nullable=True)
-    vat_number = db.Column(db.String(50), nullable=True)  # VAT identification number
-    vat_percentage = db.Column(db.Float, nullable=True)  # VAT percentage
-    street = db.Column(db.String(200), nullable=True)
-    city = db.Column(db.String(100), nullable=True)
-    state = db.Column(db.String(100), nullable=True)
-    postal_code = db.Column(db.String(20), nullable=True)
-    country = db.Column(db.String(100), nullable=True)
-    first_name = db.Column(db.String(100), nullable=True)
-    last_name = db.Column(db.String(100), nullable=True)
-    email = db.Column(db.String(100), nullable=True)
-    phone = db.Column(db.String(20), nullable=True)
-    currency = db.Column(db.String(10), nullable=True)  # Currency field
-    language = db.Column(db.String(10), nullable=True)
-    payment_terms = db.Column(db.String(300), nullable=True)
-    invoices = db.relationship('Invoice', backref='client', lazy=True)
-
-# Define the Invoice model
-class Invoice(db.Model):
-    id = db.Column(db.Integer, primary_key=True)  # Primary key
-    invoice_id = db.Column(db.String(50), unique=True, nullable=False)  # Unique invoice ID
-    invoice_number = db.Column(db.String(50), nullable=False)
-    invoice_date = db.Column(db.Date, nullable=False)
-    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
-    total = db.Column(db.Float, nullable=False)
-    state = db.Column(db.String(20), nullable=False)
-    apply_vat = db.Column(db.Boolean, default=False)
-    vat_percentage = db.Column(db.Float, nullable=True)
-    currency = db.Column(db.String(10), nullable=True)  # Currency field
-    discount = db.Column(db.Float, default=0)  # Add discount field
-    services = db.relationship('InvoiceService', backref='invoice', lazy=True, cascade="all, delete-orphan")
-
-class InvoiceService(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False)
-    service = db.Column(db.String(100), nullable=True)
-    unit_cost = db.Column(db.Float, nullable=True)
-    quantity = db.Column(db.Integer, nullable=True)
-    line_total = db.Column(db.Float, nullable=True)
-
-# Create the database and tables
-with app.app_context():
-    db.create_all()
+# JSON API, see api.py; behind the same basic auth as the pages
+@api.blueprint.before_request
+@auth.login_required
+def require_api_login():
+    pass
+
+app.register_blueprint(api.blueprint)
+
+def create_app():
+    """Finish setting up the app and return it; later calls return it unchanged.
+
+    Importing this module only declares the routes.  Logging, the
+    translations and personas, the render cache, the asset manifest, the
+    engine settings and the archive database are set up here, once per
+    process: by wsgi.py in the server's master process before it forks the
+    workers, by run.py, or by `flask --app wsgi`.  The schema is managed with
+    the migrations (`flask --app wsgi db upgrade`).
+    """
+    global render_cache, registry, static_assets
+    if registry is not None:
+        return app
+    logging.basicConfig(level=app.config.get('LOG_LEVEL', 'INFO'))
+    render_cache = RenderCache(maxsize=app.config.get('RENDER_CACHE_SIZE', 256),
+                               directory=app.config.get('RENDER_CACHE_DIR'))
+    registry = Registry(os.path.join(app.root_path, 'translations.json'),
+                        os.path.join(app.root_path, 'personas.json'))
+    static_assets = assets.Assets(app.static_folder)
+    with app.app_context():
+        database.configure_engine(db.engine, app.config.get('SQLITE_PRAGMAS'))
+        archive.configure(db.engine, app.config.get('ARCHIVE_DATABASE'))
+        metrics.instrument_engine(db.engine)
+    return app
+
+# Form views without @auth.login_required; their posts write without credentials
+OPEN_WRITE_ENDPOINTS = {'create_client', 'edit_client', 'add_invoice', 'edit_invoice', 'delete_client',
+                        'delete_invoice'}
+
+@app.before_request
+def begin_write_transaction():
+    # Form posts and API writes; take the write lock when their transaction starts.
+    # This runs before @auth.login_required, so check the credentials first: a
+    # request that will be turned away must not queue behind the writers for the lock
+    if request.method in ('POST', 'PUT', 'PATCH', 'DELETE') and (
+            request.endpoint in OPEN_WRITE_ENDPOINTS or auth.authenticate(auth.get_auth(), None)):
+        database.begin_write(db.session)
 
 # Define the routes
 @app.route('/')
 @auth.login_required
 def index():
-    clients = Client.query.all()
-    invoices = Invoice.query.all()  # Fetch all invoices
-    response = make_response(render_template('index.html', clients=clients, invoices=invoices, PERSONAS=PERSONAS, LANGUAGES=LANGUAGES))
+    # The invoice rows are fetched page by page from invoices_data()
+    catalog = registry.current()
+    response = make_response(render_template('index.html', PERSONAS=catalog.personas, LANGUAGES=catalog.language_names))
     response.headers['Content-Type'] = 'text/html; charset=utf-8'
     return response
 
+# Sortable columns of the invoice list, keyed by the DataTables column name
+INVOICE_LIST_COLUMNS = {
+    'client_name': (Client.first_name, Client.last_name),
+    'invoice_date': (Invoice.invoice_date,),
+    'due_date': (Invoice.due_date,),
+    'total': (Invoice.total,),
+    'state': (Invoice.state,),
+    'invoice_number': (Invoice.invoice_number,),
+}
+INVOICE_LIST_MAX_LENGTH = 100
+
+def _like_pattern(value):
+    """Escape LIKE wildcards so the search term is matched literally."""
+    value = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{value}%"
+
+def _invoice_list_ordering(args):
+    """Translate the DataTables order[i][...] parameters into ORDER BY clauses."""
+    ordering = []
+    i = 0
+    while f'order[{i}][column]' in args:
+        column_index = args.get(f'order[{i}][column]', type=int)
+        name = args.get(f'columns[{column_index}][data]')
+        direction = args.get(f'order[{i}][dir]', 'asc')
+        for column in INVOICE_LIST_COLUMNS.get(name, ()):
+            ordering.append(column.desc() if direction == 'desc' else column.asc())
+        i += 1
+    if not ordering:
+        ordering.append(Invoice.invoice_date.desc())
+    # Tie-breaker so that pages stay stable between requests
+    ordering.append(Invoice.id.desc())
+    return ordering
+
+@app.route('/invoices/data')
+@auth.login_required
+def invoices_data():
+    """Serve the invoice list using the DataTables server-side protocol."""
+    args = request.args
+    draw = args.get('draw', 0, type=int)
+    start = max(args.get('start', 0, type=int), 0)
+    length = args.get('length', 10, type=int)
+    if length < 0 or length > INVOICE_LIST_MAX_LENGTH:  # DataTables sends -1 for "All"
+        length = INVOICE_LIST_MAX_LENGTH
+    search = args.get('search[value]', '').strip()
+
+    query = db.session.query(
+        Invoice.id,
+        Invoice.invoice_date,
+        Invoice.due_date,
+        Invoice.total,
+        Invoice.state,
+        Invoice.invoice_number,
+        Invoice.currency,
+        Client.first_name,
+        Client.last_name,
+    ).join(Client, Invoice.client_id == Client.id)
+
+    records_total = db.session.query(func.count(Invoice.id)).scalar()
+    records_filtered = records_total
+    if search:
+        pattern = _like_pattern(search)
+        query = query.filter(or_(
+            Client.first_name.ilike(pattern, escape='\\'),
+            Client.last_name.ilike(pattern, escape='\\'),
+            Client.company_name.ilike(pattern, escape='\\'),
+            Invoice.invoice_number.ilike(pattern, escape='\\'),
+            Invoice.state.ilike(pattern, escape='\\'),
+        ))
+        records_filtered = query.order_by(None).count()
+
+    rows = query.order_by(*_invoice_list_ordering(args)).offset(start).limit(length).all()
+    data = [{
+        'client_name': f"{row.first_name or ''} {row.last_name or ''}".strip(),
+        'invoice_date': row.invoice_date.isoformat(),
+        'due_date': row.due_date.isoformat() if row.due_date else '',
+        'total': row.total,
+        'state': row.state,
+        'invoice_number': row.invoice_number,
+        'currency': row.currency,
+        'print_url': url_for('print_invoice', invoice_id=row.id),
+        'edit_url': url_for('edit_invoice', invoice_id=row.id),
+        'delete_url': url_for('delete_invoice', invoice_id=row.id),
+    } for row in rows]
+
+    return {
+        'draw': draw,
+        'recordsTotal': records_total,
+        'recordsFiltered': records_filtered,
+        'data': data,
+    }
+
 @app.route('/create_client', methods=['POST', 'GET'])
 def create_client():
     #pdb.set_trace()  # Set a breakpoint here
@@ -130,6 +253,7 @@ def create_client():
         currency = request.form['currency']
         language = request.form['language']
         payment_terms = request.form['payment_terms']
+        payment_days = request.form.get('payment_days', type=int)  # Empty: aging.PAYMENT_DAYS
         
         new_client = Client(
             company_name=company_name,
@@ -145,7 +269,8 @@ def create_client():
             phone=phone,
             currency=currency,
             language=language,
-            payment_terms=payment_terms
+            payment_terms=payment_terms,
+            payment_days=payment_days
         )
         db.session.add(new_client)
         db.session.commit()
@@ -174,8 +299,10 @@ def edit_client(client_id):
         client.currency = request.form['currency']
         client.language = request.form['language']
         client.payment_terms = request.form['payment_terms']
+        client.payment_days = request.form.get('payment_days', type=int)  # Due dates of new invoices only
         
         db.session.commit()
+        render_cache.invalidate(*invoice_ids_of_client(client_id))
         logging.debug("Client updated successfully.")  # Debugging line
         return redirect(url_for('index'))
     
@@ -184,102 +311,42 @@ def edit_client(client_id):
 @app.route('/add_invoice', methods=['GET', 'POST'])
 def add_invoice():
     if request.method == 'POST':
-        # Retrieve form data
-        invoice_id = request.form.get('invoice_id')
-        invoice_number = request.form.get('invoice_number')
-        invoice_date_str = request.form.get('invoice_date')
-        client_id = request.form.get('client_id')
-        state = request.form.get('state')
-        discount = float(request.form.get('discount', 0))
-        apply_vat = request.form.get('apply_vat') == 'on'
-        vat_percentage = float(request.form.get('vat_percentage', 0))  # Get VAT percentage from form
-        currency = request.form.get('currency')
-
-        # Check for required fields
-        if not invoice_id or not invoice_number or not invoice_date_str or not client_id or not state:
-            flash("Please fill in all required fields.", "error")
-            return redirect(url_for('add_invoice'))
+        # Collect the submitted service lines
+        line_count = int(request.form.get('line_count', 0))
+        lines = [{
+            'service': request.form.get(f'service_{i}'),
+            'unit_cost': request.form.get(f'unit_cost_{i}'),
+            'quantity': request.form.get(f'quantity_{i}'),
+        } for i in range(line_count)]
+
+        # The invoice ID, and the number unless one was typed in, come from the
+        # sequences in this write transaction, so two invoices saved at once cannot collide
+        form = dict(request.form.items(), invoice_id=numbering.next_invoice_id())
+        if not form.get('invoice_number', '').strip():
+            form['invoice_number'] = numbering.next_invoice_number()
 
-        # Convert date string to date object
+        # Check required fields, the date format and the numbers (same rules as the importers)
         try:
-            invoice_date = datetime.strptime(invoice_date_str, '%Y-%m-%d').date()
-        except ValueError:
-            flash("Invalid date format. Please use YYYY-MM-DD.", "error")
+            fields, lines = clean_invoice(form, lines)
+        except ValidationError as e:
+            db.session.rollback()  # Gives the reserved numbers back
+            flash(str(e), "error")
             return redirect(url_for('add_invoice'))
 
-        # Initialize subtotal
-        subtotal = 0
-        services = []  # List to hold service entries
-
-        # Collect services
-        line_count = int(request.form.get('line_count', 0))
-        for i in range(line_count):
-            service = request.form.get(f'service_{i}')
-            unit_cost = request.form.get(f'unit_cost_{i}')
-            quantity = request.form.get(f'quantity_{i}')
-
-            # Check for service details
-            if not service or not unit_cost or not quantity:
-                flash("Please fill in all service details.", "error")
-                return redirect(url_for('add_invoice'))
-
-            try:
-                unit_cost = float(unit_cost)
-                quantity = int(quantity)
-            except ValueError:
-                flash("Invalid unit cost or quantity. Please enter valid numbers.", "error")
-                return redirect(url_for('add_invoice'))
-
-            line_total = unit_cost * quantity
-            subtotal += line_total  # Accumulate subtotal
-
-            # Create a service entry to be added later
-            services.append(InvoiceService(service=service, unit_cost=unit_cost, quantity=quantity, line_total=line_total))
-
-        # Calculate discount amount
-        discount_amount = subtotal * (discount / 100)
-
-        # Calculate total after discount
-        total_after_discount = subtotal - discount_amount
-
-        # Calculate VAT amount if applicable
-        vat_amount = 0
-        if apply_vat:
-            vat_amount = total_after_discount * (vat_percentage / 100)
-
-        # Final total
-        total = total_after_discount + vat_amount
-
-        # Create a new invoice
-        new_invoice = Invoice(
-            invoice_id=invoice_id,
-            invoice_number=invoice_number,
-            invoice_date=invoice_date,
-            client_id=client_id,
-            total=total,
-            state=state,
-            apply_vat=apply_vat,
-            vat_percentage=vat_percentage, 
-            currency=currency,
-            discount=discount 
-        )
+        # Create a new invoice together with its services; line totals are filled in by price_invoice()
+        new_invoice = Invoice(**fields, services=[InvoiceService(**line) for line in lines])
+        price_invoice(new_invoice)  # Subtotal, discount, VAT and total
         db.session.add(new_invoice)
         db.session.commit()
-
-        # Now that the invoice ID is available, set it for each service
-        for service in services:
-            service.invoice_id = new_invoice.id  # Set the invoice_id for each service
-            db.session.add(service)
-
-        db.session.commit()
         flash("Invoice added successfully!", "success")
         return redirect(url_for('index'))
 
-    # For adding a new invoice, generate a unique invoice ID
-    invoice_id = datetime.now().strftime("%Y%m%d%H%M%S")
-    clients = Client.query.all()
+    # The invoice ID is assigned when the invoice is saved; the client is looked up as it is typed
     vat_percentage = 0  
-    return render_template('add_invoice.html', clients=clients, invoice=None, vat_percentage=vat_percentage, invoice_id=invoice_id)
+    return render_template('add_invoice.html', client=None, invoice=None, vat_percentage=vat_percentage, invoice_id=None)
+
+def invoice_ids_of_client(client_id):
+    return [row.id for row in db.session.query(Invoice.id).filter_by(client_id=client_id)]
 
 @app.route('/client_invoices/<int:client_id>')
 def client_invoices(client_id):
@@ -290,49 +357,48 @@ def client_invoices(client_id):
 @app.route('/print_invoice/<int:invoice_id>', methods=['GET', 'POST'])
 def print_invoice(invoice_id):
     if request.method == 'GET':
-        # Get the selected language from the query parameters
-        selected_language = request.args.get('language', 'en')  # Default to English if not provided
-        selected_persona = request.args.get('persona', 'persona1')  # Default to the first persona
+        catalog = registry.current()
+        selected_language, selected_persona = selected_language_and_persona(catalog)
 
-        language_dict = LANGUAGES.get(selected_language, LANGUAGES['en'])  # Fallback to English
-        persona_info = PERSONAS.get(selected_persona, PERSONAS['persona1'])  # Get persona info
+        # The page only changes when the invoice or its client does, or when the
+        # invoice is archived (without a new updated_at): then it loses the send form
+        source = 'live'
+        stamps = db.session.query(Invoice.updated_at, Client.updated_at).join(
+            Client, Invoice.client_id == Client.id).filter(Invoice.id == invoice_id).first()
+        if stamps is None and archive.enabled():
+            source = 'archive'
+            stamps = db.session.query(archive.ArchivedInvoice.updated_at, Client.updated_at).join(
+                Client, archive.ArchivedInvoice.client_id == Client.id).filter(
+                archive.ArchivedInvoice.id == invoice_id).first()
+        if stamps is None:
+            abort(404)
+        last_modified = max(stamps)
+        # The catalog version changes the key when translations or personas are edited,
+        # the assets version when a new build renames the static files the page links to
+        cache_key = (invoice_id, selected_persona, selected_language, source,
+                     '|'.join(s.isoformat() for s in stamps), catalog.version, static_assets.version)
+        etag = cache_key_digest(cache_key)
 
-        # Fetch the invoice and associated client
-        invoice = Invoice.query.get_or_404(invoice_id)
-        services = InvoiceService.query.filter_by(invoice_id=invoice.id).all()
-        
-        # Fetch the client associated with the invoice
-        client = Client.query.get(invoice.client_id)  # Assuming invoice has a client_id field
-
-        # Calculate subtotal and total
-        subtotal = sum(service.line_total for service in services)
-        discount = invoice.discount  # Use the discount from the invoice
-        discount_amount = subtotal * (discount / 100)  # Calculate discount amount
-        total_after_discount = subtotal - discount_amount  # Total after discount
-
-        # Check if VAT is applied
-        apply_vat = invoice.apply_vat
-        vat_percentage = invoice.vat_percentage
-        vat_amount = 0
-
-        if apply_vat:
-            vat_amount = total_after_discount * (vat_percentage / 100)  # Calculate VAT amount
-        total = total_after_discount + vat_amount  # Final total
-
-        # Pass all necessary data to the template
-        return render_template('print_invoice.html', 
-                               invoice=invoice, 
-                               services=services, 
-                               subtotal=subtotal, 
-                               discount=discount, 
-                               discount_amount=discount_amount,  # Pass discount amount
-                               vat_amount=vat_amount,  # Pass VAT amount
-                               total=total, 
-                               language_dict=language_dict, 
-                               persona_info=persona_info,
-                               client=client,  # Pass the client information to the template
-                               client_payment_terms=client.payment_terms,  # Pass payment terms to the template
-                               PERSONAS=PERSONAS)  # Include PERSONAS here
+        if '_flashes' in session:
+            # Flashed messages are rendered into the page: neither a 304 nor a cached
+            # page would show them, and the page must not be reused afterwards
+            response = make_response(render_print_invoice(invoice_id, catalog, selected_language, selected_persona))
+            response.cache_control.no_store = True
+            return response
+
+        if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            html = render_cache.get(cache_key)
+            if html is None:
+                html = render_print_invoice(invoice_id, catalog, selected_language, selected_persona)
+                render_cache.set(cache_key, html)
+            response = make_response(html)
+        else:
+            response = make_response('', 304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True  # Browsers revalidate and get a 304 while unchanged
+        return response
 
     elif request.method == 'POST':
         # Handle POST request logic here if needed
@@ -340,18 +406,666 @@ def print_invoice(invoice_id):
         # You can also redirect or render a different template if necessary
         return redirect(url_for('index'))  # Redirect to the index page or another appropriate action
 
+def selected_language_and_persona(catalog, default_language=DEFAULT_LANGUAGE):
+    """Language and persona keys from the query parameters, with fallbacks."""
+    selected_language = request.args.get('language', default_language)  # Default to English if not provided
+    selected_persona = request.args.get('persona', catalog.default_persona)
+    if selected_language not in catalog.languages:
+        selected_language = DEFAULT_LANGUAGE  # Fallback to English
+    if selected_persona not in catalog.personas:
+        selected_persona = catalog.default_persona
+    return selected_language, selected_persona
+
+def printable_invoices(model=Invoice):
+    """Invoice (or ArchivedInvoice) query loading the client (joined) and services (one IN query) up front."""
+    return db.session.query(model).options(
+        joinedload(model.client),
+        selectinload(model.services),
+    )
+
+def printable_invoice(invoice_id):
+    """The invoice for printing, read from the archive once it has been moved there; 404 if neither has it."""
+    invoice = printable_invoices().filter_by(id=invoice_id).first()
+    if invoice is None and archive.enabled():
+        invoice = printable_invoices(archive.ArchivedInvoice).filter_by(id=invoice_id).first()
+    if invoice is None:
+        abort(404)
+    return invoice
+
+def render_print_invoice(invoice_id, catalog, language, persona):
+    """Render print_invoice.html for an invoice."""
+    invoice = printable_invoice(invoice_id)
+    # Only live invoices can be queued for sending
+    return render_invoice_page(invoice, catalog, language, persona, send_form=isinstance(invoice, Invoice))
+
+def render_invoice_page(invoice, catalog, language, persona, send_form=False, template='print_invoice.html',
+                        **context):
+    """print_invoice.html (or `template`) for a loaded invoice; the form that e-mails it only on the web page."""
+    services = invoice.services
+    client = invoice.client
+
+    # Pass all necessary data to the template; the totals are stored on the invoice
+    return render_template(template,
+                           invoice=invoice, 
+                           services=services, 
+                           subtotal=invoice.subtotal, 
+                           discount=invoice.discount or 0, 
+                           discount_amount=invoice.discount_amount,  # Pass discount amount
+                           vat_amount=invoice.vat_amount,  # Pass VAT amount
+                           total=invoice.total, 
+                           language_dict=catalog.languages[language],
+                           persona_info=catalog.personas[persona],
+                           client=client,  # Pass the client information to the template
+                           client_payment_terms=client.payment_terms,  # Pass payment terms to the template
+                           PERSONAS=catalog.personas,  # Include PERSONAS here
+                           send_form=send_form,
+                           language=language,
+                           persona=persona,
+                           delivery_formats=delivery.FORMATS,
+                           **context)
+
+@app.route('/print_invoice/<int:invoice_id>/pdf')
+def invoice_pdf(invoice_id):
+    catalog = registry.current()
+    selected_language, selected_persona = selected_language_and_persona(catalog)
+    invoice = printable_invoice(invoice_id)
+    document = pdf.invoice_document(invoice, catalog.languages[selected_language], catalog.personas[selected_persona])
+    response = make_response(pdf.render_pdf(document, app.static_folder))
+    response.headers['Content-Type'] = 'application/pdf'
+    response.headers['Content-Disposition'] = f'inline; filename="{pdf.document_filename(document)}"'
+    return response
+
+def month_range(month):
+    """First day of a 'YYYY-MM' month and of the month after it; raises ValueError."""
+    first_day = datetime.strptime(month, '%Y-%m').date()
+    return first_day, date(first_day.year + first_day.month // 12, first_day.month % 12 + 1, 1)
+
+def invoices_for_pdf_export(month=None, client_id=None):
+    """Invoices of a month ('YYYY-MM') and/or a client, archived ones included, ready for invoice_document()."""
+    models = [Invoice] + ([archive.ArchivedInvoice] if archive.enabled() else [])
+    invoices = []
+    for model in models:
+        query = printable_invoices(model)
+        if month:
+            first_day, next_month = month_range(month)
+            query = query.filter(model.invoice_date >= first_day, model.invoice_date < next_month)
+        if client_id:
+            query = query.filter(model.client_id == client_id)
+        if model is not Invoice:
+            query = query.filter(archive.not_live())
+        invoices += query.order_by(model.invoice_date, model.id).all()
+    return sorted(invoices, key=lambda invoice: (invoice.invoice_date, invoice.id))
+
+def pdf_documents(invoices, language=None, persona=None):
+    """invoice_document() for each invoice, in the client's language unless one is given."""
+    catalog = registry.current()
+    persona_info = catalog.personas.get(persona) or catalog.personas[catalog.default_persona]
+    for invoice in invoices:
+        invoice_language = language or invoice.client.language
+        language_dict = catalog.languages.get(invoice_language) or catalog.languages[DEFAULT_LANGUAGE]
+        yield pdf.invoice_document(invoice, language_dict, persona_info)
+
+@app.route('/export/pdf')
+@auth.login_required
+def export_pdf():
+    """Stream a ZIP with the PDFs of a month's (?month=YYYY-MM) or a client's (?client_id=) invoices."""
+    month = request.args.get('month')
+    client_id = request.args.get('client_id', type=int)
+    if not month and not client_id:
+        abort(400, 'Pass month=YYYY-MM and/or client_id.')
+    try:
+        invoices = invoices_for_pdf_export(month, client_id)
+    except ValueError:
+        abort(400, 'month must be formatted as YYYY-MM.')
+    documents = list(pdf_documents(invoices, request.args.get('language'), request.args.get('persona')))
+    processes = app.config.get('PDF_PROCESSES')
+    static_folder = app.static_folder
+
+    def entries():
+        stats = {}
+        yield from pdf.render_many(documents, static_folder, processes=processes, stats=stats)
+        # Throughput of this run, for keeping an eye on month-end exports
+        yield 'export_summary.txt', (f"invoices: {stats['count']}\n"
+                                     f"seconds: {stats['seconds']:.2f}\n"
+                                     f"invoices_per_second: {stats['per_second']:.1f}\n").encode()
+
+    name = f"invoices_{month or ''}{'_' if month and client_id else ''}{f'client{client_id}' if client_id else ''}.zip"
+    response = Response(stream_with_context(iter_zip(entries())), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}"'
+    return response
+
+@app.cli.command('export-pdf')
+@click.option('--month', help='Export the invoices of this month (YYYY-MM).')
+@click.option('--client-id', type=int, help='Export the invoices of this client.')
+@click.option('--language', help='Language for all invoices (default: each client\'s language).')
+@click.option('--persona', default=DEFAULT_PERSONA, show_default=True)
+@click.option('--processes', type=int, help='Worker processes (default: one per CPU).')
+@click.option('--out', 'out_path', required=True, type=click.Path(dir_okay=False, writable=True))
+def export_pdf_command(month, client_id, language, persona, processes, out_path):
+    """Render invoices to PDF and write them into a ZIP file."""
+    if not month and not client_id:
+        raise click.UsageError('Pass --month and/or --client-id.')
+    invoices = invoices_for_pdf_export(month, client_id)
+    documents = list(pdf_documents(invoices, language, persona))
+    stats = {}
+    with open(out_path, 'wb') as f:
+        for chunk in iter_zip(pdf.render_many(documents, app.static_folder, processes=processes, stats=stats)):
+            f.write(chunk)
+    click.echo(f"{stats['count']} invoices in {stats['seconds']:.2f}s ({stats['per_second']:.1f} invoices/s) -> {out_path}")
+
+@app.route('/export/invoices.<fmt>')
+@auth.login_required
+def export_invoices(fmt):
+    """Stream invoices with their client and service lines as CSV or XLSX.
+
+    Filters: date_from, date_to (YYYY-MM-DD), state, client_id, currency.
+    """
+    if fmt not in exports.FORMATS:
+        abort(404)
+    try:
+        filters = exports.parse_filters(request.args)
+    except ValueError:
+        abort(400, 'Dates must be formatted as YYYY-MM-DD and client_id must be a number.')
+    generate, mimetype = exports.FORMATS[fmt]
+    response = Response(stream_with_context(generate(filters)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="invoices.{fmt}"'
+    return response
+
+@app.cli.command('export-invoices')
+@click.option('--format', 'fmt', type=click.Choice(sorted(exports.FORMATS)), default='csv', show_default=True)
+@click.option('--date-from', help='First invoice date (YYYY-MM-DD).')
+@click.option('--date-to', help='Last invoice date (YYYY-MM-DD).')
+@click.option('--state')
+@click.option('--client-id')
+@click.option('--currency')
+@click.option('--out', 'out_path', default='-', show_default=True, help='Output file, - for stdout.')
+def export_invoices_command(fmt, out_path, **options):
+    """Export invoices with their client and service lines."""
+    try:
+        filters = exports.parse_filters(options)
+    except ValueError:
+        raise click.BadParameter('Dates must be formatted as YYYY-MM-DD and --client-id must be a number.')
+    generate, _ = exports.FORMATS[fmt]
+    with click.open_file(out_path, 'wb') as f:
+        for chunk in generate(filters):
+            f.write(chunk)
+
+@app.route('/import', methods=['POST'])
+@auth.login_required
+def import_upload():
+    """Import invoices from an uploaded CSV or JSON file and answer with a JSON report."""
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return {'error': 'Upload a CSV or JSON file in the "file" field.'}, 400
+    fmt = request.form.get('format') or upload.filename.rsplit('.', 1)[-1].lower()
+    if fmt not in imports.READERS:
+        return {'error': f'Unsupported format {fmt!r}, use csv or json.'}, 400
+    try:
+        report = imports.import_invoices(imports.READERS[fmt](imports.open_text(upload.stream)))
+    except ValueError as e:  # Unreadable file (bad JSON, bad encoding)
+        return {'error': f'Could not read the file: {e}'}, 400
+    return report.as_dict()
+
+@app.cli.command('import-invoices')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(sorted(imports.READERS)), help='Default: from the file extension.')
+@click.option('--chunk-size', default=imports.CHUNK_SIZE, show_default=True, help='Invoices per transaction.')
+def import_invoices_command(path, fmt, chunk_size):
+    """Import invoices with their service lines from a CSV or JSON file."""
+    fmt = fmt or path.rsplit('.', 1)[-1].lower()
+    if fmt not in imports.READERS:
+        raise click.BadParameter('Cannot tell the format from the extension, pass --format.')
+    with open(path, 'rb') as f:
+        report = imports.import_invoices(imports.READERS[fmt](imports.open_text(f)), chunk_size=chunk_size)
+    for ref, message in report.errors:
+        click.echo(f"{ref}: {message}", err=True)
+    click.echo(f"{report.imported} invoices imported, {len(report.errors)} failed in {report.seconds:.1f}s")
+
+def report_filters(args):
+    """Filters for reports.breakdown() from the query string; aborts on malformed months."""
+    filters = {}
+    for name in ('period_from', 'period_to'):
+        value = args.get(name)
+        if value:
+            if not re.fullmatch(r'\d{4}-\d{2}', value):
+                abort(400, f'{name} must be formatted as YYYY-MM.')
+            filters[name] = value
+    if 'currency' in args and args['currency'] != '':
+        filters['currency'] = args['currency']
+    filters['state'] = args.get('state') or None
+    filters['client_id'] = args.get('client_id', type=int)
+    return filters
+
+@app.route('/reports')
+@auth.login_required
+def reports_dashboard():
+    """Revenue per month, client, currency and state from the summary table."""
+    filters = report_filters(request.args)
+    tables = {dimension: reports.breakdown(dimension, **filters) for dimension in reports.DIMENSIONS}
+    return render_template('reports.html', tables=tables, filters=request.args)
+
+@app.route('/reports/<dimension>.json')
+@auth.login_required
+def reports_data(dimension):
+    """One breakdown of the dashboard as JSON, e.g. /reports/period.json?period_from=2024-01."""
+    if dimension not in reports.DIMENSIONS:
+        abort(404)
+    rows = reports.breakdown(dimension, **report_filters(request.args))
+    return {'dimension': dimension, 'data': [row._asdict() for row in rows]}
+
+@app.cli.command('rebuild-reports')
+@click.option('--check-only', is_flag=True, help='Only compare the summary with the invoices.')
+def rebuild_reports_command(check_only):
+    """Recompute the report summary from the invoices and verify it."""
+    mismatches = reports.check()
+    for table, bucket, stored, live in mismatches:
+        click.echo(f"{table} {'/'.join(map(str, bucket))}: stored {stored}, live {live}", err=True)
+    click.echo(f"{len(mismatches)} summary rows differ from the invoices")
+    if check_only:
+        raise SystemExit(1 if mismatches else 0)
+    reports.rebuild()
+    db.session.commit()
+    mismatches = reports.check()
+    if mismatches:
+        raise click.ClickException(f"{len(mismatches)} summary rows still differ after the rebuild")
+    click.echo("Summary rebuilt and verified against the invoices")
+
+def aging_filters(args):
+    """Filters for aging.aging_report() from the query string."""
+    filters = {'client_id': args.get('client_id', type=int)}
+    if args.get('currency'):
+        filters['currency'] = args['currency']
+    return filters
+
+@app.route('/reports/aging')
+@auth.login_required
+def aging_dashboard():
+    """Open invoices per client and currency by days past their due date."""
+    filters = aging_filters(request.args)
+    today = date.today()
+    return render_template('aging.html', rows=aging.aging_report(today, **filters),
+                           totals=aging.aging_report(today, per_client=False, **filters),
+                           buckets=aging.BUCKETS, today=today, filters=request.args)
+
+@app.route('/reports/aging.json')
+@auth.login_required
+def aging_data():
+    """The aging report as JSON, e.g. /reports/aging.json?currency=EUR."""
+    rows = aging.aging_report(**aging_filters(request.args))
+    return {'date': date.today().isoformat(),
+            'data': [dict(row._asdict(), oldest_due_date=row.oldest_due_date and row.oldest_due_date.isoformat())
+                     for row in rows]}
+
+@app.cli.command('mark-overdue')
+@click.option('--date', 'day', help='Day to compare the due dates with, YYYY-MM-DD (default: today).')
+@click.option('--batch-size', default=aging.BATCH_SIZE, show_default=True, help='Invoices per transaction.')
+def mark_overdue_command(day, batch_size):
+    """Set sent invoices past their due date to Overdue, and back to Sent if it was moved later."""
+    try:
+        day = datetime.strptime(day, '%Y-%m-%d').date() if day else date.today()
+    except ValueError:
+        raise click.BadParameter("Use YYYY-MM-DD.", param_hint='--date')
+    overdue, extended = aging.mark_overdue(day, batch_size)
+    click.echo(f"{overdue} invoices overdue, {extended} no longer overdue on {day}")
+
+@app.cli.command('archive-invoices')
+@click.option('--before', help='Archive paid invoices dated before this day, YYYY-MM-DD '
+                               '(default: ARCHIVE_AFTER_DAYS in config.py, 730 days, ago).')
+@click.option('--batch-size', default=archive.BATCH_SIZE, show_default=True, help='Invoices per transaction.')
+def archive_invoices_command(before, batch_size):
+    """Move old paid invoices with their service lines to the archive database."""
+    if not archive.enabled():
+        raise click.ClickException("The archive needs a SQLite database file.")
+    try:
+        cutoff = (datetime.strptime(before, '%Y-%m-%d').date() if before
+                  else date.today() - timedelta(days=app.config.get('ARCHIVE_AFTER_DAYS', archive.AFTER_DAYS)))
+    except ValueError:
+        raise click.BadParameter("Use YYYY-MM-DD.", param_hint='--before')
+    count = archive.archive_invoices(cutoff, batch_size)
+    click.echo(f"{count} paid invoices dated before {cutoff} moved to {archive.path()}")
+
+@app.route('/recurring')
+@auth.login_required
+def recurring_invoices():
+    """The recurring invoices with their next date, and the form that generates a month's invoices."""
+    templates = (RecurringInvoice.query
+                 .options(joinedload(RecurringInvoice.client), selectinload(RecurringInvoice.services))
+                 .order_by(RecurringInvoice.client_id, RecurringInvoice.id).all())
+    today = date.today()
+    rows = [(template, recurring.next_due_date(template, today) if template.active else None, recurring.total(template))
+            for template in templates]
+    return render_template('recurring.html', rows=rows, intervals=recurring.INTERVALS, states=recurring.STATES,
+                           period=today.strftime('%Y-%m'))
+
+@app.route('/recurring/from_invoice/<int:invoice_id>', methods=['POST'])
+@auth.login_required
+def create_recurring_invoice(invoice_id):
+    """Repeat an invoice: a recurring invoice with its client, services and settings."""
+    invoice = Invoice.query.options(selectinload(Invoice.services)).filter_by(id=invoice_id).first_or_404()
+    interval_months = request.form.get('interval_months', type=int)
+    try:
+        start_date = datetime.strptime(request.form.get('start_date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        flash("Invalid date format. Please use YYYY-MM-DD.", "error")
+        return redirect(url_for('edit_invoice', invoice_id=invoice_id))
+    if interval_months not in recurring.INTERVALS:
+        flash("Please choose how often the invoice repeats.", "error")
+        return redirect(url_for('edit_invoice', invoice_id=invoice_id))
+    db.session.add(recurring.from_invoice(invoice, interval_months, start_date))
+    db.session.commit()
+    flash("Recurring invoice created.", "success")
+    return redirect(url_for('recurring_invoices'))
+
+@app.route('/recurring/<int:recurring_id>/toggle', methods=['POST'])
+@auth.login_required
+def toggle_recurring_invoice(recurring_id):
+    template = RecurringInvoice.query.get_or_404(recurring_id)
+    template.active = not template.active
+    db.session.commit()
+    return redirect(url_for('recurring_invoices'))
+
+@app.route('/recurring/<int:recurring_id>/delete', methods=['POST'])
+@auth.login_required
+def delete_recurring_invoice(recurring_id):
+    # The invoices generated from it stay
+    db.session.delete(RecurringInvoice.query.get_or_404(recurring_id))
+    db.session.commit()
+    flash("Recurring invoice deleted.", "success")
+    return redirect(url_for('recurring_invoices'))
+
+@app.route('/recurring/generate', methods=['POST'])
+@auth.login_required
+def generate_recurring_invoices():
+    """Create the invoices due in a month; months already generated are skipped."""
+    period = request.form.get('period', '')
+    state = request.form.get('state', 'Draft')
+    if state not in recurring.STATES:
+        abort(400)
+    try:
+        count = recurring.generate(period, state)
+    except ValueError:
+        flash("Invalid month. Please use YYYY-MM.", "error")
+        return redirect(url_for('recurring_invoices'))
+    flash(f"{count} invoices created for {period}.", "success")
+    return redirect(url_for('recurring_invoices'))
+
+@app.cli.command('generate-recurring')
+@click.option('--period', help='Month to invoice, YYYY-MM (default: the current month).')
+@click.option('--state', type=click.Choice(recurring.STATES), default='Draft', show_default=True,
+              help='State of the new invoices.')
+def generate_recurring_command(period, state):
+    """Create the invoices of every recurring invoice due in a month; safe to run again."""
+    period = period or date.today().strftime('%Y-%m')
+    try:
+        count = recurring.generate(period, state)
+    except ValueError:
+        raise click.BadParameter("Use YYYY-MM.", param_hint='--period')
+    click.echo(f"{count} invoices created for {period}")
+
+@app.route('/print_invoice/<int:invoice_id>/send', methods=['POST'])
+@auth.login_required
+def send_invoice(invoice_id):
+    """Queue the invoice for e-mailing to its client; the deliver-invoices worker sends it."""
+    invoice = Invoice.query.get_or_404(invoice_id)
+    fmt = request.form.get('format', 'pdf')
+    if fmt not in delivery.FORMATS:
+        abort(400, f"format must be one of {', '.join(delivery.FORMATS)}.")
+    language, persona = request.form.get('language') or None, request.form.get('persona') or None
+    if delivery.queue([Invoice.id == invoice_id], fmt, language, persona):
+        flash(f"The invoice will be sent to {invoice.client.email}.", "success")
+    elif not (invoice.client.email or '').strip():
+        flash("The client has no e-mail address.", "error")
+    else:
+        flash("The invoice is already waiting to be sent.", "error")
+    db.session.commit()
+    return redirect(url_for('print_invoice', invoice_id=invoice_id, language=language, persona=persona))
+
+def delivery_criteria(month=None, state=None, client_id=None):
+    """Invoice filters for queueing a mass delivery; raises ValueError on a malformed month."""
+    criteria = []
+    if month:
+        first_day, next_month = month_range(month)
+        criteria += [Invoice.invoice_date >= first_day, Invoice.invoice_date < next_month]
+    if state:
+        criteria.append(Invoice.state == state)
+    if client_id:
+        criteria.append(Invoice.client_id == client_id)
+    return criteria
+
+DELIVERY_PAGE_SIZE = 100
+
+@app.route('/deliveries')
+@auth.login_required
+def deliveries():
+    """Deliveries by status, the latest ones, and the form that queues a month's invoices."""
+    page = (db.session.query(Delivery, Invoice.invoice_number)
+            .outerjoin(Invoice, Invoice.id == Delivery.invoice_id)
+            .order_by(Delivery.id.desc()).limit(DELIVERY_PAGE_SIZE).all())
+    return render_template('deliveries.html', counts=delivery.status_counts(), statuses=delivery.STATUSES,
+                           deliveries=page, formats=delivery.FORMATS, page_size=DELIVERY_PAGE_SIZE,
+                           month=date.today().strftime('%Y-%m'))
+
+@app.route('/deliveries/queue', methods=['POST'])
+@auth.login_required
+def queue_deliveries():
+    """Queue every invoice of a month (optionally of one state) for e-mailing."""
+    fmt = request.form.get('format', 'pdf')
+    if fmt not in delivery.FORMATS:
+        abort(400, f"format must be one of {', '.join(delivery.FORMATS)}.")
+    try:
+        criteria = delivery_criteria(request.form.get('month', ''), request.form.get('state') or None)
+    except ValueError:
+        flash("Invalid month. Please use YYYY-MM.", "error")
+        return redirect(url_for('deliveries'))
+    count = delivery.queue(criteria, fmt)
+    db.session.commit()
+    flash(f"{count} invoices queued for sending.", "success")
+    return redirect(url_for('deliveries'))
+
+@app.cli.command('queue-deliveries')
+@click.option('--month', help='Send the invoices of this month (YYYY-MM).')
+@click.option('--state', help='Only invoices in this state, e.g. Sent.')
+@click.option('--client-id', type=int, help='Only the invoices of this client.')
+@click.option('--format', 'fmt', type=click.Choice(delivery.FORMATS), default='pdf', show_default=True,
+              help='pdf: attached to the e-mail; html: the invoice as an HTML e-mail.')
+@click.option('--language', help='Language for all invoices (default: each client\'s language).')
+@click.option('--persona', help='Sender persona (default: the default persona).')
+def queue_deliveries_command(month, state, client_id, fmt, language, persona):
+    """Queue invoices for e-mailing to their clients; deliver-invoices sends them."""
+    if not month and not client_id:
+        raise click.UsageError('Pass --month and/or --client-id.')
+    try:
+        criteria = delivery_criteria(month, state, client_id)
+    except ValueError:
+        raise click.BadParameter("Use YYYY-MM.", param_hint='--month')
+    database.begin_write(db.session)
+    count = delivery.queue(criteria, fmt, language, persona)
+    db.session.commit()
+    click.echo(f"{count} invoices queued")
+
+def delivery_messages(rows):
+    """E-mails for claimed deliveries, see delivery.work(): {delivery id: message or the error building it}."""
+    catalog = registry.current()
+    invoice_ids = {row.invoice_id for row in rows}
+    invoices = {invoice.id: invoice for invoice in printable_invoices().filter(Invoice.id.in_(invoice_ids))}
+    if archive.enabled() and invoice_ids - invoices.keys():
+        invoices.update((invoice.id, invoice) for invoice in printable_invoices(archive.ArchivedInvoice).filter(
+            archive.ArchivedInvoice.id.in_(invoice_ids - invoices.keys())))
+
+    messages, documents = {}, {}
+    for row in rows:
+        invoice = invoices.get(row.invoice_id)
+        if invoice is None:
+            continue  # Deleted since it was queued
+        language = row.language or invoice.client.language
+        language = language if language in catalog.languages else DEFAULT_LANGUAGE
+        persona = row.persona if row.persona in catalog.personas else catalog.default_persona
+        labels, persona_info = catalog.languages[language], catalog.personas[persona]
+        fields = {'invoice_number': invoice.invoice_number, 'invoice_date': invoice.invoice_date.strftime('%Y-%m-%d'),
+                  'due_date': invoice.due_date.strftime('%Y-%m-%d') if invoice.due_date else '',
+                  'total': format_amount(invoice.total), 'currency': invoice.currency or '',
+                  'sender': persona_info['company_name'] or f"{persona_info['first_name']} {persona_info['last_name']}"}
+        message = dict(
+            sender=app.config.get('MAIL_FROM') or formataddr((fields['sender'], persona_info['email'])),
+            recipient=row.recipient, subject=delivery.fill(labels['email_subject'], fields),
+            text=delivery.fill(labels['email_text'], fields))
+        try:
+            if row.format == 'html':
+                # Without the app's pages around it; the logo is fetched by the mail client, so from PUBLIC_URL
+                with app.test_request_context(base_url=app.config.get('PUBLIC_URL', 'http://localhost/')):
+                    logo_url = urljoin(request.host_url, asset_url(persona_info['logo']))
+                    message['html'] = render_invoice_page(invoice, catalog, language, persona,
+                                                          template='email_invoice.html', logo_url=logo_url)
+                messages[row.id] = delivery.build_message(**message)
+            else:
+                documents[row.id] = (pdf.invoice_document(invoice, labels, persona_info), message)
+        except Exception as e:
+            logging.exception("Cannot build the e-mail of delivery %d", row.id)
+            messages[row.id] = e
+
+    # The PDFs of a batch are rendered in the process pool; one that fails is retried alone
+    ids = list(documents)
+    try:
+        rendered = list(pdf.render_many([documents[i][0] for i in ids], app.static_folder,
+                                        processes=app.config.get('PDF_PROCESSES')))
+    except Exception:
+        logging.exception("Rendering a batch of PDFs failed; rendering them one by one")
+        rendered = []
+        for i in ids:
+            try:
+                rendered.append((pdf.document_filename(documents[i][0]), pdf.render_pdf(documents[i][0], app.static_folder)))
+            except Exception as e:
+                rendered.append(e)
+    for i, attachment in zip(ids, rendered):
+        messages[i] = attachment if isinstance(attachment, Exception) else delivery.build_message(
+            **documents[i][1], attachment=attachment)
+    return messages
+
+def smtp_pool():
+    """SMTP connections to the server set in config.py (SMTP_HOST, SMTP_PORT, ...)."""
+    return delivery.SMTPPool(
+        host=app.config.get('SMTP_HOST', 'localhost'), port=app.config.get('SMTP_PORT', 25),
+        username=app.config.get('SMTP_USERNAME'), password=app.config.get('SMTP_PASSWORD'),
+        starttls=app.config.get('SMTP_STARTTLS', False), timeout=app.config.get('SMTP_TIMEOUT', 30))
+
+@app.cli.command('deliver-invoices')
+@click.option('--threads', type=int, help=f'SMTP connections sending in parallel (default: {delivery.THREADS}).')
+@click.option('--batch-size', default=delivery.BATCH_SIZE, show_default=True, help='Deliveries claimed at a time.')
+@click.option('--once', is_flag=True, help='Stop when no delivery is due instead of waiting for new ones.')
+def deliver_invoices_command(threads, batch_size, once):
+    """Send the queued invoice e-mails; keeps running and polling unless --once."""
+    if hasattr(os, 'nice'):
+        os.nice(app.config.get('DELIVERY_NICE', delivery.NICE))  # Rendering PDFs must not slow down the pages
+    pool = smtp_pool()
+    try:
+        sent, retried, failed = delivery.work(
+            delivery_messages, pool, batch_size=batch_size, once=once,
+            threads=threads or app.config.get('DELIVERY_THREADS', delivery.THREADS),
+            max_attempts=app.config.get('DELIVERY_MAX_ATTEMPTS', delivery.MAX_ATTEMPTS))
+    finally:
+        pool.close()
+    click.echo(f"{sent} invoices sent, {retried} to retry, {failed} failed")
+
+def search_args(args):
+    """(query, kind, page) from the query string; aborts on an unknown kind."""
+    kind = args.get('kind') or None
+    if kind and kind not in search.KINDS:
+        abort(400, f"kind must be one of {', '.join(search.KINDS)}.")
+    return args.get('q', ''), kind, max(args.get('page', 1, type=int), 1)
+
+@app.route('/search')
+@auth.login_required
+def search_page():
+    """Ranked search over clients, invoice numbers and service descriptions."""
+    query, kind, page = search_args(request.args)
+    results, has_more = search.search(query, kind, page)
+    return render_template('search.html', query=query, kind=kind, page=page, results=results, has_more=has_more)
+
+@app.route('/search.json')
+@auth.login_required
+def search_data():
+    """The results of /search as JSON, e.g. /search.json?q=consulting&kind=service&page=2."""
+    query, kind, page = search_args(request.args)
+    results, has_more = search.search(query, kind, page)
+    for result in results:
+        result['snippet'] = search.snippet_text(result['snippet'])
+        if result['invoice_date']:
+            result['invoice_date'] = result['invoice_date'].isoformat()
+    return {'query': query, 'page': page, 'has_more': has_more, 'data': results}
+
+@app.route('/clients/lookup.json')
+@auth.login_required
+def client_lookup_data():
+    """Clients for the invoice form's client field, e.g. /clients/lookup.json?q=mül."""
+    limit = min(request.args.get('limit', client_lookup.LIMIT, type=int), 50)
+    return {'data': client_lookup.lookup(request.args.get('q', ''), max(limit, 1))}
+
+@app.route('/assets/<path:filename>')
+def built_asset(filename):
+    # Content-hashed names from build-assets: cached for a year, precompressed
+    return static_assets.send(filename, request.accept_encodings)
+
+@app.cli.command('vendor-assets')
+@click.option('--force', is_flag=True, help='Download every file again.')
+def vendor_assets_command(force):
+    """Download the pinned CSS and JavaScript libraries to static/vendor."""
+    try:
+        for path in assets.vendor(app.static_folder, force):
+            click.echo(f"Downloaded {path}")
+    except OSError as e:
+        raise click.ClickException(f"Download failed: {e}")
+    click.echo("Vendored files are up to date; commit them")
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Build static/dist: content-hashed names, optimized images, gzip and brotli copies."""
+    stats = assets.build(app.static_folder)
+    for item in stats:
+        compressed = ''.join(f"  {encoding} {item[encoding]:>8}" for encoding in ('gz', 'br') if encoding in item)
+        click.echo(f"{item['built']:60} {item['bytes']:>8} -> {item['built_bytes']:>8}{compressed}")
+    click.echo(f"{len(stats)} files built; restart the app to use them")
+
+@app.route('/metrics')
+@auth.login_required
+def metrics_endpoint():
+    """Request metrics in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Refill the full-text search index and the client lookup from the clients, invoices and service lines."""
+    search.rebuild()
+    client_lookup.rebuild()
+    db.session.commit()
+    click.echo("Search index and client lookup rebuilt")
+
 @app.route('/delete_client/<int:client_id>', methods=['POST'])
 def delete_client(client_id):
     client = Client.query.get_or_404(client_id)
+    if archive.has_invoices(client_id):
+        flash("The client has archived invoices and cannot be deleted.", "error")
+        return redirect(url_for('clients'))
+    invoice_ids = invoice_ids_of_client(client_id)
     db.session.delete(client)
     db.session.commit()
+    render_cache.invalidate(*invoice_ids)
     flash("Client deleted successfully!", "success")
     return redirect(url_for('clients'))  # Redirect to the clients page
 
 # Define the route for clients
 @app.route('/clients')
 def clients():
-    clients = Client.query.all()  # Fetch all clients from the database
+    # Count invoices and find the last invoice date in SQL instead of loading every invoice
+    invoice_stats = db.session.query(
+        Invoice.client_id,
+        func.count(Invoice.id).label('invoice_count'),
+        func.max(Invoice.invoice_date).label('last_invoice_date'),
+    ).group_by(Invoice.client_id).subquery()
+    clients = db.session.query(
+        Client,
+        func.coalesce(invoice_stats.c.invoice_count, 0).label('invoice_count'),
+        invoice_stats.c.last_invoice_date,
+    ).outerjoin(invoice_stats, invoice_stats.c.client_id == Client.id).all()
     return render_template('clients.html', clients=clients)  # Render the clients template
 
 @app.route('/delete_invoice/<int:invoice_id>', methods=['POST'])
@@ -359,71 +1073,68 @@ def delete_invoice(invoice_id):
     invoice = Invoice.query.get_or_404(invoice_id)
     db.session.delete(invoice)
     db.session.commit()
+    render_cache.invalidate(invoice_id)
     flash("Invoice deleted successfully!", "success")
     return redirect(url_for('index'))  # Redirect back to the invoices list
 
 
+EDIT_CONFLICT = "This invoice was changed by someone else while you were editing it. Please check the current version and make your changes again."
+
 @app.route('/edit_invoice/<int:invoice_id>', methods=['GET', 'POST'])
 def edit_invoice(invoice_id):
-    invoice = Invoice.query.get_or_404(invoice_id)  # Fetch the invoice by ID
+    # Fetch the invoice by ID, loading its services up front for the form
+    invoice = Invoice.query.options(selectinload(Invoice.services)).filter_by(id=invoice_id).first_or_404()
     logging.debug(f"fetched Invoice ID: {invoice_id}")
-    invoice = Invoice.query.get_or_404(invoice_id)
     if request.method == 'GET':
-        clients = Client.query.all()
-        return render_template('add_invoice.html', clients=clients, invoice=invoice, invoice_id=invoice.invoice_id)
+        return render_template('add_invoice.html', client=invoice.client, invoice=invoice, invoice_id=invoice.invoice_id,
+                               intervals=recurring.INTERVALS, repeat_from=recurring.month_after(invoice.invoice_date))
     if request.method == 'POST':
-        # Handle form submission
-        invoice_number = request.form.get('invoice_number')
-        invoice_date_str = request.form.get('invoice_date')
-        client_id = request.form.get('client_id')
-        state = request.form.get('state')
-        discount = float(request.form.get('discount', 0))
-        apply_vat = request.form.get('apply_vat') == 'on'
-        vat_percentage = float(request.form.get('vat_percentage', 0))
-        currency = request.form.get('currency')  # Get currency
-
-        # Update invoice fields
-        invoice.invoice_number = invoice_number
-        invoice.invoice_date = datetime.strptime(invoice_date_str, '%Y-%m-%d').date()
-        invoice.client_id = client_id
-        invoice.state = state
-        invoice.discount = discount
-        invoice.apply_vat = apply_vat
-        invoice.vat_percentage = vat_percentage
-        invoice.currency = currency
-
-        # Clear existing services and add updated ones
-        InvoiceService.query.filter_by(invoice_id=invoice.id).delete()  # Clear existing services
+        # Someone else saved the invoice since this form was loaded
+        if request.form.get('version_id', str(invoice.version_id)) != str(invoice.version_id):
+            flash(EDIT_CONFLICT, "error")
+            return redirect(url_for('edit_invoice', invoice_id=invoice_id))
+
         line_count = int(request.form.get('line_count', 0))
-        for i in range(line_count):
-            service = request.form.get(f'service_{i}')
-            unit_cost = request.form.get(f'unit_cost_{i}')
-            quantity = request.form.get(f'quantity_{i}')
-
-            # Create a new service entry
-            new_service = InvoiceService(
-                invoice_id=invoice.id,
-                service=service,
-                unit_cost=float(unit_cost),
-                quantity=int(quantity),
-                line_total=float(unit_cost) * int(quantity)
-            )
-            db.session.add(new_service)
-
-        db.session.commit()  # Commit changes to the database
+        lines = [{
+            'service': request.form.get(f'service_{i}'),
+            'unit_cost': request.form.get(f'unit_cost_{i}'),
+            'quantity': request.form.get(f'quantity_{i}'),
+        } for i in range(line_count)]
+        line_ids = [request.form.get(f'service_id_{i}') for i in range(line_count)]
+
+        # Same rules as a new invoice; the invoice ID itself cannot be changed
+        try:
+            fields, lines = clean_invoice(dict(request.form.items(), invoice_id=invoice.invoice_id), lines)
+            for name, value in fields.items():
+                setattr(invoice, name, value)
+            # Only the changed, added and removed lines are written
+            sync_services(invoice, lines, line_ids)
+        except ValidationError as e:
+            db.session.rollback()
+            flash(str(e), "error")
+            return redirect(url_for('edit_invoice', invoice_id=invoice_id))
+        price_invoice(invoice)  # Recompute the stored totals
+        invoice.updated_at = utcnow()  # Service-only edits do not touch the invoice row otherwise
+
+        try:
+            db.session.commit()
+        except StaleDataError:
+            db.session.rollback()
+            flash(EDIT_CONFLICT, "error")
+            return redirect(url_for('edit_invoice', invoice_id=invoice_id))
+        render_cache.invalidate(invoice.id)  # Its cached print pages show the old version
         flash("Invoice updated successfully!", "success")
         return redirect(url_for('index'))
 
     # For editing an existing invoice, pass the invoice data to the template
-    clients = Client.query.all()  # Fetch all clients for the dropdown
-    return render_template('add_invoice.html', clients=clients, invoice=invoice)
+    return render_template('add_invoice.html', client=invoice.client, invoice=invoice)
 
 
 
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
 
 
 
@@ -0,0 +1,254 @@
+"""Archive database: old paid invoices moved out of the live tables.
+
+On SQLite a second database file (ARCHIVE_DATABASE in config.py, by default
+next to the main one as <name>-archive.db) is attached to every connection as
+the schema "archive".  It holds copies of the invoice and invoice_service
+tables; their columns follow the live tables, so a migration that adds a
+column there adds it to the archive on the next connection.
+
+archive_invoices() moves paid invoices dated before a cutoff, batch by batch.
+The two files do not commit atomically together in WAL mode, so each batch
+is copied to the archive and committed first, then deleted from the live
+tables in a second transaction, and only where the live rows still equal the
+copies.  If the process dies in between, the rows are in both databases:
+reads below skip archived rows whose invoice is still live, and the next run
+copies them again.  Nothing is deleted that is not in the archive.  The
+invoice table uses AUTOINCREMENT, so SQLite never hands out the id of an
+archived (or deleted) invoice again.
+
+Archived invoices are read through ArchivedInvoice, which has the same
+attributes as Invoice: the print view, the PDFs, the exports and the report
+summary (see reports.py) include them.  The forms, the API and the search
+only see the live invoices.  Other databases have no archive.
+"""
+import logging
+import os
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.orm import foreign, relationship
+
+import database
+from models import db, Client, Invoice, InvoiceService
+
+SCHEMA = 'archive'
+BATCH_SIZE = 1000
+AFTER_DAYS = 730  # Default age of the invoices archive-invoices moves
+STATE = 'Paid'
+# Archive table -> its indexes, for the lookups of the print view, exports and reports
+TABLES = {
+    'invoice': {
+        'ix_invoice_invoice_date': 'invoice_date',
+        'ix_invoice_client_id_invoice_date': 'client_id, invoice_date',
+    },
+    'invoice_service': {'ix_invoice_service_invoice_id': 'invoice_id'},
+}
+
+_path = None
+
+
+def default_path(engine):
+    """<main database>-archive.db next to the main SQLite file, or None for other databases."""
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return None
+    stem, ext = os.path.splitext(engine.url.database)
+    return f"{stem}-archive{ext or '.db'}"
+
+
+def path():
+    """The attached archive file, or None if there is no archive."""
+    return _path
+
+
+def enabled():
+    return _path is not None
+
+
+def configure(engine, archive_path=None):
+    """Attach the archive to every new connection of `engine` (SQLite files only)."""
+    global _path
+    archive_path = archive_path or default_path(engine)
+    if engine.dialect.name != 'sqlite' or not archive_path:
+        return
+    _path = archive_path
+
+    @event.listens_for(engine, 'connect')
+    def attach_archive(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (archive_path,))
+        for name in ('journal_mode', 'synchronous'):
+            cursor.execute(f"PRAGMA {SCHEMA}.{name}={database.SQLITE_PRAGMAS[name]}")
+        _sync_schema(cursor)
+        cursor.close()
+
+
+def _columns(cursor, schema, table):
+    """[(name, declared type)] of a table, empty if it does not exist."""
+    return [(row[1], row[2]) for row in cursor.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def _attached(cursor):
+    return any(row[1] == SCHEMA for row in cursor.execute("PRAGMA database_list").fetchall())
+
+
+def _sync_schema(cursor):
+    """Create the archive tables, or add the columns the live tables gained since."""
+    for table, indexes in TABLES.items():
+        live = _columns(cursor, 'main', table)
+        if not live:
+            continue  # Not migrated yet; created on a later connection or by create_all()
+        archived = {name for name, _ in _columns(cursor, SCHEMA, table)}
+        if not archived:
+            columns = ', '.join(f'"{name}" {type_}{" PRIMARY KEY" if name == "id" else ""}' for name, type_ in live)
+            cursor.execute(f"CREATE TABLE {SCHEMA}.{table} ({columns})")
+            for name, indexed in indexes.items():
+                cursor.execute(f"CREATE INDEX {SCHEMA}.{name} ON {table} ({indexed})")
+            continue
+        for name, type_ in live:
+            if name not in archived:
+                cursor.execute(f'ALTER TABLE {SCHEMA}.{table} ADD COLUMN "{name}" {type_}')
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_tables(metadata, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        cursor = connection.connection.cursor()
+        if _attached(cursor):
+            _sync_schema(cursor)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_tables(metadata, connection, **kw):
+    # drop_all() empties the archive too, its rows belong to the dropped invoices
+    if connection.dialect.name == 'sqlite':
+        cursor = connection.connection.cursor()
+        if _attached(cursor):
+            for table in reversed(list(TABLES)):
+                cursor.execute(f"DROP TABLE IF EXISTS {SCHEMA}.{table}")
+
+
+# Read-only mappings of the archive tables, outside db.metadata so the
+# migrations do not see them
+_metadata = sa.MetaData()
+invoice_table = sa.Table('invoice', _metadata, *[sa.Column(column.name, column.type, primary_key=column.primary_key)
+                                                 for column in Invoice.__table__.columns], schema=SCHEMA)
+service_table = sa.Table('invoice_service', _metadata, *[
+    sa.Column(column.name, column.type, primary_key=column.primary_key)
+    for column in InvoiceService.__table__.columns], schema=SCHEMA)
+
+
+class ArchivedInvoice:
+    """An archived invoice; read-only, with the attributes of Invoice."""
+
+
+class ArchivedInvoiceService:
+    """A service line of an archived invoice."""
+
+
+db.Model.registry.map_imperatively(ArchivedInvoiceService, service_table)
+db.Model.registry.map_imperatively(ArchivedInvoice, invoice_table, properties={
+    'client': relationship(Client, primaryjoin=foreign(invoice_table.c.client_id) == Client.id, viewonly=True),
+    'services': relationship(ArchivedInvoiceService, primaryjoin=invoice_table.c.id == foreign(service_table.c.invoice_id),
+                             order_by=service_table.c.id, viewonly=True),
+})
+
+
+def not_live(table=invoice_table):
+    """Criterion for archived invoices that are not (or no longer) also in the live table."""
+    return ~sa.exists().where(Invoice.id == table.c.id)
+
+
+def with_archived(*names):
+    """FROM clause with the invoice columns `names` of the live and the archived invoices."""
+    live = Invoice.__table__
+    if not enabled():
+        return live
+    return sa.union_all(
+        sa.select(*[live.c[name] for name in names]),
+        sa.select(*[invoice_table.c[name] for name in names]).where(not_live()),
+    ).subquery('invoices')
+
+
+def has_invoices(client_id):
+    """Whether the archive holds invoices of the client."""
+    if not enabled():
+        return False
+    return db.session.execute(sa.select(sa.exists().where(invoice_table.c.client_id == client_id))).scalar()
+
+
+def _id_list(ids):
+    return ', '.join(str(int(i)) for i in ids)
+
+
+def _column_list(model):
+    return ', '.join(f'"{column.name}"' for column in model.__table__.columns)
+
+
+def _copy(conn, ids):
+    """Copy invoices and their service lines to the archive, replacing older copies."""
+    invoice_columns, service_columns, id_list = _column_list(Invoice), _column_list(InvoiceService), _id_list(ids)
+    conn.exec_driver_sql(f"INSERT OR REPLACE INTO {SCHEMA}.invoice ({invoice_columns}) "
+                         f"SELECT {invoice_columns} FROM main.invoice WHERE id IN ({id_list})")
+    conn.exec_driver_sql(f"DELETE FROM {SCHEMA}.invoice_service WHERE invoice_id IN ({id_list})")
+    conn.exec_driver_sql(f"INSERT INTO {SCHEMA}.invoice_service ({service_columns}) "
+                         f"SELECT {service_columns} FROM main.invoice_service WHERE invoice_id IN ({id_list})")
+
+
+def _changed(conn, ids):
+    """Ids among `ids` whose live invoice or service lines differ from their archived copies."""
+    invoice_columns, service_columns, id_list = _column_list(Invoice), _column_list(InvoiceService), _id_list(ids)
+    live_lines = f"SELECT {service_columns} FROM main.invoice_service WHERE invoice_id IN ({id_list})"
+    archived_lines = f"SELECT {service_columns} FROM {SCHEMA}.invoice_service WHERE invoice_id IN ({id_list})"
+    return set(conn.exec_driver_sql(
+        f"SELECT id FROM (SELECT {invoice_columns} FROM main.invoice WHERE id IN ({id_list}) "
+        f"EXCEPT SELECT {invoice_columns} FROM {SCHEMA}.invoice WHERE id IN ({id_list})) "
+        f"UNION SELECT invoice_id FROM ({live_lines} EXCEPT {archived_lines}) "
+        f"UNION SELECT invoice_id FROM ({archived_lines} EXCEPT {live_lines})").scalars())
+
+
+def _reserve_ids(conn):
+    """Move the invoice id counter past the archived ids, for an archive that was attached to another database."""
+    max_id = f"(SELECT max(id) FROM {SCHEMA}.invoice)"
+    conn.exec_driver_sql("INSERT INTO main.sqlite_sequence (name, seq) SELECT 'invoice', 0 "
+                         "WHERE NOT EXISTS (SELECT 1 FROM main.sqlite_sequence WHERE name = 'invoice')")
+    conn.exec_driver_sql(f"UPDATE main.sqlite_sequence SET seq = {max_id} WHERE name = 'invoice' AND seq < {max_id}")
+
+
+def archive_invoices(cutoff, batch_size=BATCH_SIZE):
+    """Move paid invoices dated before `cutoff`, with their service lines, to the archive.
+
+    Every batch takes two short transactions, so the app keeps working
+    meanwhile.  Returns the number of invoices moved.
+    """
+    if not enabled():
+        raise RuntimeError("The archive needs a SQLite database file")
+    moved, last_id = 0, 0
+    database.begin_write(db.session)
+    _reserve_ids(db.session.connection())
+    db.session.commit()
+    while True:
+        database.begin_write(db.session)
+        ids = db.session.scalars(
+            sa.select(Invoice.id)
+            .where(Invoice.state == STATE, Invoice.invoice_date < cutoff, Invoice.id > last_id)
+            .order_by(Invoice.id).limit(batch_size)).all()
+        if not ids:
+            db.session.commit()
+            return moved
+        _copy(db.session.connection(), ids)
+        db.session.commit()
+
+        database.begin_write(db.session)
+        conn = db.session.connection()
+        changed = _changed(conn, ids)
+        if changed:
+            logging.warning("Invoices %s changed while being archived; they stay live", sorted(changed))
+        unchanged = [i for i in ids if i not in changed]
+        if unchanged:
+            # Service lines first, for the foreign key; the search index triggers drop the invoices' documents
+            conn.exec_driver_sql(f"DELETE FROM main.invoice_service WHERE invoice_id IN ({_id_list(unchanged)})")
+            conn.exec_driver_sql(f"DELETE FROM main.invoice WHERE id IN ({_id_list(unchanged)})")
+        db.session.commit()
+        moved += len(unchanged)
+        last_id = ids[-1]
+        logging.info("Archived %d invoices (up to id %d)", moved, last_id)
@@ -0,0 +1,204 @@
+"""Static assets: vendored libraries, content-hashed names and precompressed copies.
+
+The CSS and JavaScript libraries are served from static/vendor instead of
+CDNs, so pages do not wait for (or break without) an outside network.
+`flask --app wsgi vendor-assets` downloads the versions pinned in VENDOR
+once, on a machine with network access; the files are then committed.
+
+`flask --app wsgi build-assets` copies every file under static/ to
+static/dist/ with a hash of its content in the name (css/styles.3f2a9c1d.css).
+On the way, url(...) references in CSS are pointed at the hashed names,
+PNGs are shrunk to IMAGE_PIXELS and recompressed, and text files get .gz and
+.br copies.  manifest.json maps the source names to the built ones.  A built
+name never changes its content, so /assets/ serves them with a one-year
+immutable Cache-Control, in the compression the browser accepts.
+
+asset_url() in the templates returns the built URL.  Without a build
+(development) it returns the plain static URL, or for a vendored file not
+downloaded yet, its CDN URL.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import urllib.request
+from io import BytesIO
+
+from flask import send_file, url_for
+from PIL import Image
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 8
+MAX_AGE = 365 * 24 * 3600
+COMPRESSIBLE = {'.css', '.js', '.json', '.map', '.svg', '.txt', '.ico'}
+MIN_COMPRESS_BYTES = 256  # Smaller files fit in one packet either way
+IMAGE_PIXELS = 640  # Twice the width logos are shown at, enough for print
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]  # In order of preference
+
+# Local path under static/ -> pinned CDN URL.  Bootstrap's bundle includes the
+# Popper 1.x it needs (the page used to load Popper 2, which Bootstrap 4 does
+# not support); one full jQuery replaces the slim and full builds.
+VENDOR = {
+    'vendor/bootstrap/css/bootstrap.min.css':
+        'https://stackpath.bootstrapcdn.com/bootstrap/4.5.3/css/bootstrap.min.css',
+    'vendor/bootstrap/js/bootstrap.bundle.min.js':
+        'https://stackpath.bootstrapcdn.com/bootstrap/4.5.3/js/bootstrap.bundle.min.js',
+    'vendor/jquery/jquery.min.js': 'https://code.jquery.com/jquery-3.6.0.min.js',
+    'vendor/datatables/css/jquery.dataTables.min.css':
+        'https://cdn.datatables.net/1.10.15/css/jquery.dataTables.min.css',
+    'vendor/datatables/js/jquery.dataTables.min.js': 'https://cdn.datatables.net/1.10.15/js/jquery.dataTables.min.js',
+    # The sort arrows, referenced by the DataTables CSS as ../images/
+    **{f'vendor/datatables/images/{name}.png': f'https://cdn.datatables.net/1.10.15/images/{name}.png'
+       for name in ['sort_both', 'sort_asc', 'sort_desc', 'sort_asc_disabled', 'sort_desc_disabled']},
+}
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def vendor(static_folder, force=False):
+    """Download the VENDOR files that are missing (all with `force`); returns the paths written."""
+    written = []
+    for path, url in VENDOR.items():
+        target = os.path.join(static_folder, path)
+        if os.path.isfile(target) and not force:
+            continue
+        with urllib.request.urlopen(url, timeout=30) as response:
+            data = response.read()
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        written.append(path)
+    return written
+
+
+def _hashed_name(path, data):
+    stem, ext = posixpath.splitext(path)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def _optimize_png(data):
+    """The PNG shrunk to IMAGE_PIXELS and recompressed, or `data` if that is not smaller."""
+    with Image.open(BytesIO(data)) as image:
+        image.thumbnail((IMAGE_PIXELS, IMAGE_PIXELS), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, format='PNG', optimize=True)
+    return min(buffer.getvalue(), data, key=len)
+
+
+def _rewrite_css(path, css, manifest):
+    """Point url(...) references to other static files at their built names."""
+    base = posixpath.dirname(path)
+
+    def replace(match):
+        quote, reference = match.groups()
+        target, suffix = re.match(r'([^?#]*)(.*)', reference).groups()
+        if not target or re.match(r'[a-z]+:|/', target):  # data:, https:, absolute
+            return match.group(0)
+        built = manifest.get(posixpath.normpath(posixpath.join(base, target)))
+        if not built:
+            return match.group(0)
+        return f"url({quote}{posixpath.relpath(built, base or '.')}{suffix}{quote})"
+
+    return CSS_URL.sub(replace, css.decode('utf-8')).encode('utf-8')
+
+
+def _compressed(data):
+    """The .gz and .br copies worth keeping, as {suffix: bytes}."""
+    import brotli  # Only needed to build
+
+    copies = {'.gz': gzip.compress(data, compresslevel=9, mtime=0), '.br': brotli.compress(data, quality=11)}
+    return {suffix: copy for suffix, copy in copies.items() if len(copy) < len(data)}
+
+
+def build(static_folder):
+    """Build static/dist from static/ and write its manifest; returns per-file stats.
+
+    Files of earlier builds are kept, so pages rendered before a restart can
+    still load them; delete static/dist to clear them out.
+    """
+    dist = os.path.join(static_folder, DIST)
+    sources = sorted(
+        os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, '/')
+        for root, dirs, names in os.walk(static_folder)
+        if os.path.relpath(root, static_folder).split(os.sep)[0] != DIST
+        for name in names)
+    # Stylesheets last: their references need the built names of the images
+    sources.sort(key=lambda path: path.endswith('.css'))
+    manifest, stats = {}, []
+    for path in sources:
+        with open(os.path.join(static_folder, path), 'rb') as f:
+            data = original = f.read()
+        ext = posixpath.splitext(path)[1].lower()
+        if ext == '.png':
+            data = _optimize_png(data)
+        elif ext == '.css':
+            data = _rewrite_css(path, data, manifest)
+        built = manifest[path] = _hashed_name(path, data)
+        copies = _compressed(data) if ext in COMPRESSIBLE and len(data) >= MIN_COMPRESS_BYTES else {}
+        target = os.path.join(dist, built)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        for suffix, content in [('', data)] + list(copies.items()):
+            with open(target + suffix, 'wb') as f:
+                f.write(content)
+        stats.append({'path': path, 'built': built, 'bytes': len(original), 'built_bytes': len(data),
+                      **{suffix.lstrip('.'): len(content) for suffix, content in copies.items()}})
+    # Replace the manifest in one step, for processes loading it meanwhile
+    os.makedirs(dist, exist_ok=True)
+    temporary = os.path.join(dist, MANIFEST + '.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temporary, os.path.join(dist, MANIFEST))
+    return stats
+
+
+class Assets:
+    """The built assets of one static folder, as listed in its manifest."""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self.dist = os.path.join(static_folder, DIST)
+        try:
+            with open(os.path.join(self.dist, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+            logging.info("No asset build (flask --app wsgi build-assets); serving static files as they are")
+        # Changes with every build that renames a file
+        self.version = hashlib.sha256(json.dumps(self.manifest, sort_keys=True).encode()).hexdigest()[:HASH_LENGTH]
+        missing = [path for path in VENDOR if not os.path.isfile(os.path.join(static_folder, path))]
+        if missing:
+            logging.warning("Vendored files missing, loaded from their CDNs instead: %s "
+                            "(flask --app wsgi vendor-assets)", ', '.join(missing))
+
+    def url(self, path):
+        built = self.manifest.get(path)
+        if built:
+            return url_for('built_asset', filename=built)
+        if path in VENDOR and not os.path.isfile(os.path.join(self.static_folder, path)):
+            return VENDOR[path]  # Not downloaded yet (flask --app wsgi vendor-assets)
+        return url_for('static', filename=path)
+
+    def send(self, filename, accept_encodings):
+        """Response with a built file, precompressed if the client accepts it."""
+        path = safe_join(self.dist, filename)
+        if path is None or filename.endswith(('.gz', '.br')) or not os.path.isfile(path):
+            raise NotFound()
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = next((encoding for encoding, suffix in ENCODINGS
+                         if accept_encodings[encoding] and os.path.isfile(path + suffix)), None)
+        if encoding:
+            response = send_file(path + dict(ENCODINGS)[encoding], mimetype=mimetype, max_age=MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = send_file(path, mimetype=mimetype, max_age=MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add('Accept-Encoding')
+        return response
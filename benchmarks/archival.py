@@ -0,0 +1,121 @@
+"""Archiving old paid invoices: live table size, page timings and read-through.
+
+Seeds INVOICES invoices over five years (1 to 5 service lines each), with
+most invoices before CUTOFF paid, and times a few pages that read the live
+invoice table.  Then it moves the paid invoices before CUTOFF to the archive
+database with archive.archive_invoices(), times the pages again and checks
+that nothing was lost: the CSV export, a printed (but for the send form)
+and a PDF invoice of an archived id are the same as before, the report
+summary still matches the invoices, and a second run moves nothing.
+
+    python -m benchmarks.archival [invoices]
+"""
+import base64
+import hashlib
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+_db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_db_path}')
+
+import sqlalchemy as sa  # noqa: E402
+
+from app import create_app, db, Invoice, InvoiceService  # noqa: E402
+import archive  # noqa: E402
+from benchmarks.seed import reset, seed  # noqa: E402
+import reports  # noqa: E402
+
+app = create_app()
+
+CUTOFF = date(2024, 1, 1)
+RUNS = 20
+PAGES = [
+    '/invoices/data?draw=1&start=0&length=100&order[0][column]=0&order[0][dir]=desc&columns[0][data]=total',
+    '/invoices/data?draw=1&start=0&length=100&search[value]=Last1',
+    '/client_invoices/1',
+    '/clients',
+]
+
+
+def median_ms(client, url, headers):
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        client.get(url, headers=headers)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def counts():
+    """(live invoices, live lines, archived invoices, archived lines)."""
+    return tuple(db.session.execute(sa.select(sa.func.count()).select_from(table)).scalar()
+                 for table in (Invoice.__table__, InvoiceService.__table__, archive.invoice_table, archive.service_table))
+
+
+def snapshot(client, headers, invoice_id):
+    """Digests of what must survive archiving."""
+    def digest(url, strip=None):
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200, (url, response.status_code)
+        return hashlib.sha256(re.sub(strip, b'', response.data) if strip else response.data).hexdigest()
+
+    pdf = client.get(f'/print_invoice/{invoice_id}/pdf', headers=headers)
+    # Archived invoices cannot be e-mailed, so their page has no send form
+    send_form = rb'(?s)\s*<form method="POST" action="[^"]*/send".*?</form>'
+    return {'export': digest('/export/invoices.csv'), 'print': digest(f'/print_invoice/{invoice_id}', send_form),
+            'pdf': pdf.status_code, 'reports': digest('/reports/period.json')}
+
+
+def main():
+    invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    credentials = f"{app.config['USERNAME']}:{app.config['PASSWORD']}".encode()
+    headers = {'Authorization': 'Basic ' + base64.b64encode(credentials).decode()}
+    client = app.test_client()
+    with app.app_context():
+        reset()
+        seed(clients=1000, invoices=invoices, lines_per_invoice=(1, 5))
+        # Old invoices are mostly settled; one in twenty is still open
+        db.session.execute(sa.update(Invoice).where(Invoice.invoice_date < CUTOFF, Invoice.id % 20 != 0)
+                           .values(state='Paid'))
+        reports.rebuild()
+        db.session.commit()
+        archived_id = db.session.scalar(sa.select(sa.func.min(Invoice.id)).where(
+            Invoice.state == 'Paid', Invoice.invoice_date < CUTOFF))
+        before = counts()
+        db.session.commit()
+
+    before_ms = {url: median_ms(client, url, headers) for url in PAGES}
+    before_snapshot = snapshot(client, headers, archived_id)
+
+    with app.app_context():
+        started = time.perf_counter()
+        moved = archive.archive_invoices(CUTOFF)
+        seconds = time.perf_counter() - started
+        again = archive.archive_invoices(CUTOFF)
+        after = counts()
+        mismatches = reports.check()
+        db.session.commit()
+
+    after_ms = {url: median_ms(client, url, headers) for url in PAGES}
+    after_snapshot = snapshot(client, headers, archived_id)
+
+    print(f"{invoices} invoices, paid ones before {CUTOFF} archived in batches of {archive.BATCH_SIZE}:\n")
+    print(f"  moved        {moved} invoices in {seconds:.1f} s ({moved / seconds:.0f} invoices/s)")
+    print(f"  run again    {again} invoices moved")
+    print(f"  live         {before[0]} -> {after[0]} invoices, {before[1]} -> {after[1]} lines")
+    print(f"  archive      {after[2]} invoices, {after[3]} lines\n")
+    for url in PAGES:
+        print(f"  {url[:60]:60} {before_ms[url]:7.2f} -> {after_ms[url]:7.2f} ms")
+    print(f"\nno invoice or line lost:                 {after[0] + after[2] == before[0] and after[1] + after[3] == before[1]}")
+    for name in ('export', 'print', 'pdf', 'reports'):
+        print(f"{name + ' unchanged:':41}{before_snapshot[name] == after_snapshot[name]}")
+    print(f"report summary matches the invoices:     {not mismatches}")
+
+
+if __name__ == '__main__':
+    main()
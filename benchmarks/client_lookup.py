@@ -0,0 +1,62 @@
+"""Client typeahead: lookup latency and invoice form size with many clients.
+
+Seeds CLIENTS clients (and as many invoices, whose service lines share words
+with the client names in the search index) and times
+client_lookup.lookup() for prefixes of one to eight letters, including words
+of the service lines.  Then it times opening the add and edit invoice forms,
+which no longer list the clients, and prints their size.
+
+    python -m benchmarks.client_lookup [clients]
+"""
+import base64
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+_db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_db_path}')
+
+from app import create_app, db  # noqa: E402
+from benchmarks.seed import reset, seed  # noqa: E402
+import client_lookup  # noqa: E402
+
+app = create_app()
+
+QUERIES = ['c', 'co', 'com', 'company 12', 'last4', 'first999', 'vat0000', 'se', 'serv', 'service', 'nothing']
+RUNS = 50
+
+
+def median_ms(function):
+    timings = []
+    for _ in range(RUNS):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with app.app_context():
+        reset()
+        seed(clients=clients, invoices=clients, lines_per_invoice=3)
+
+        print(f"{clients} clients, lookup of the best {client_lookup.LIMIT}, median of {RUNS}:\n")
+        for query in QUERIES:
+            matches = len(client_lookup.lookup(query))
+            print(f"  {query!r:14} {median_ms(lambda: client_lookup.lookup(query)):7.2f} ms  {matches:3} matches")
+        db.session.commit()
+
+    credentials = f"{app.config['USERNAME']}:{app.config['PASSWORD']}".encode()
+    headers = {'Authorization': 'Basic ' + base64.b64encode(credentials).decode()}
+    client = app.test_client()
+    print()
+    for url in ['/add_invoice', '/edit_invoice/1', '/clients/lookup.json?q=comp']:
+        size = len(client.get(url, headers=headers).data)
+        print(f"  {url:28} {median_ms(lambda: client.get(url, headers=headers)):7.2f} ms  {size / 1024:6.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""Concurrent read/write load test against a SQLite file, per database profile.
+
+Runs the same workload twice, each time against a fresh database:
+
+- legacy: the settings before database.py, i.e. the sqlite3 module's
+  implicit transactions, the rollback journal and the default pool.
+- production: database.py as configured (WAL, pragmas, pool, BEGIN
+  IMMEDIATE for writes).
+
+Every reader and writer is a separate process, like the workers of a WSGI
+server.  Readers page through /invoices/data and open /reports, one more
+process keeps streaming the CSV export (a long read), and writers edit and
+add invoices.  Prints requests per second, p95 latency and the number of
+failed requests (mostly "database is locked").
+
+    python -m benchmarks.concurrency [seconds] [readers] [writers]
+"""
+import base64
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+PROFILES = ['legacy', 'production']
+SEED = dict(clients=200, invoices=20000, lines_per_invoice=5)
+STARTUP_SECONDS = 5  # Time for every process to import the app before the clock starts
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def invoice_form(rng, client_count):
+    form = {
+        'invoice_number': str(rng.randint(1, 999999)),
+        'invoice_date': f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+        'client_id': str(rng.randint(1, client_count)),
+        'state': rng.choice(['Draft', 'Sent', 'Paid']),
+        'discount': '0',
+        'vat_percentage': '20',
+        'apply_vat': 'on',
+        'currency': 'EUR',
+        'line_count': '3',
+    }
+    for i in range(3):
+        form.update({f'service_{i}': f'Service {i}', f'unit_cost_{i}': str(rng.randint(100, 99999) / 100),
+                     f'quantity_{i}': str(rng.randint(1, 9))})
+    return form
+
+
+def load_app(profile, database_url):
+    """Import the app in this process with the settings of `profile`."""
+    os.environ['DATABASE_URL'] = database_url
+    import database
+    if profile == 'legacy':
+        database.engine_options = lambda uri, overrides=None: {}
+        database.configure_engine = lambda engine, pragmas=None: None
+        database.begin_write = lambda session: None
+    from app import create_app
+    logging.disable(logging.CRITICAL)
+    return create_app()
+
+
+def seed_database(profile, database_url):
+    app = load_app(profile, database_url)
+    from benchmarks.seed import reset, seed  # Imports the app, so only after load_app()
+    with app.app_context():
+        reset()
+        seed(**SEED)
+
+
+def worker(profile, database_url, kind, number, start_at, seconds):
+    """Send requests from `start_at` for `seconds`; returns [(seconds, ok)] per request."""
+    app = load_app(profile, database_url)
+    credentials = f"{app.config['USERNAME']}:{app.config['PASSWORD']}".encode()
+    headers = {'Authorization': 'Basic ' + base64.b64encode(credentials).decode()}
+    rng = random.Random(number)
+    client = app.test_client()
+    timings = []
+    counter = 0
+    time.sleep(max(0, start_at - time.time()))
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        counter += 1
+        started = time.perf_counter()
+        if kind == 'export':
+            response = client.get('/export/invoices.csv', headers=headers)
+            response.get_data()  # Drain the stream; the read transaction lasts until the end
+        elif kind == 'read':
+            if counter % 5 == 0:
+                response = client.get('/reports', headers=headers)
+            else:
+                start = rng.randrange(0, SEED['invoices'], 100)
+                response = client.get(f'/invoices/data?draw=1&start={start}&length=100', headers=headers)
+        else:
+            form = invoice_form(rng, SEED['clients'])
+            if counter % 2:
+                response = client.post(f"/edit_invoice/{rng.randint(1, SEED['invoices'])}", data=form)
+            else:
+                form['invoice_id'] = f'LOAD-{number}-{counter}'
+                response = client.post('/add_invoice', data=form)
+        timings.append((time.perf_counter() - started, response.status_code < 400))
+    return kind, timings
+
+
+def run_profile(profile, seconds, readers, writers):
+    """Seed a fresh database and run the workload; returns the measurements per kind."""
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+    # spawn: every process imports the app itself, with the profile's settings
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        pool.apply(seed_database, (profile, database_url))
+    jobs = [('export', 0)] + [('read', i) for i in range(readers)] + [('write', 100 + i) for i in range(writers)]
+    start_at = time.time() + STARTUP_SECONDS
+    with context.Pool(len(jobs)) as pool:
+        results = pool.starmap(worker, [(profile, database_url, kind, number, start_at, seconds)
+                                        for kind, number in jobs])
+
+    summary = {}
+    for kind in ('export', 'read', 'write'):
+        timings = [timing for result_kind, result in results if result_kind == kind for timing in result]
+        ok = [elapsed for elapsed, success in timings if success]
+        summary[kind] = {
+            'per_second': len(ok) / seconds,
+            'failed': len(timings) - len(ok),
+            'p95_ms': percentile(ok, 0.95) * 1000,
+        }
+    return summary
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    readers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    writers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    print(f"{seconds:.0f}s per profile, 1 export, {readers} reader and {writers} writer processes, "
+          f"{SEED['invoices']} invoices\n")
+    print(f"{'profile':12} {'kind':8} {'ok/s':>8} {'p95 ms':>8} {'failed':>7}")
+    for profile in PROFILES:
+        for kind, result in run_profile(profile, seconds, readers, writers).items():
+            print(f"{profile:12} {kind:8} {result['per_second']:8.1f} {result['p95_ms']:8.1f} {result['failed']:7}")
+
+
+if __name__ == '__main__':
+    main()
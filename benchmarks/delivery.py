@@ -0,0 +1,127 @@
+"""Mass e-mailing of invoices: queueing, worker throughput and web latency meanwhile.
+
+Seeds INVOICES invoices, queues all of them for delivery (one INSERT ...
+SELECT) and runs the deliver-invoices worker in a separate process against
+the local SMTP sink (benchmarks/smtp_sink.py), which waits SMTP_DELAY per
+message like a remote server would.  The sink refuses one client's address
+for good (550) and another's once (451), which must end up failed and sent
+after a retry.  While the worker runs, the invoice list is requested over
+and over; its latency is compared with the same requests while idle.
+
+    python -m benchmarks.delivery [invoices] [pdf|html]
+"""
+import base64
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+_db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_db_path}')
+
+import app as app_module  # noqa: E402
+from app import create_app, db, Delivery, Invoice  # noqa: E402
+from benchmarks.seed import reset, seed  # noqa: E402
+from benchmarks.smtp_sink import SMTPSink  # noqa: E402
+import delivery  # noqa: E402
+
+app = create_app()
+
+CLIENTS = 50
+SMTP_DELAY = 0.005
+THREADS = 4
+REFUSED = 'client5@example.com'  # 550: failed without a retry
+TEMPORARY = 'client7@example.com'  # 451 on the first attempt only
+PAGE = '/invoices/data?draw=1&start=0&length=100'
+
+
+def run_worker(port, threads):
+    os.nice(delivery.NICE)  # As deliver-invoices does
+    app.config.update(SMTP_HOST='127.0.0.1', SMTP_PORT=port)
+    delivery.RETRY_SECONDS = 0.5
+    with app.app_context():
+        pool = app_module.smtp_pool()
+        try:
+            while True:
+                delivery.work(app_module.delivery_messages, pool, threads=threads, once=True)
+                if not delivery.status_counts().get(delivery.QUEUED):
+                    break
+                db.session.commit()
+                time.sleep(0.2)  # Until the retries are due
+        finally:
+            pool.close()
+
+
+def latencies_ms(client, headers, until):
+    timings = []
+    while not until(len(timings)):
+        started = time.perf_counter()
+        client.get(PAGE, headers=headers)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    fmt = sys.argv[2] if len(sys.argv) > 2 else 'pdf'
+    refused_once = set()
+
+    def refuse(recipient):
+        if recipient == REFUSED:
+            return 550
+        if recipient == TEMPORARY and recipient not in refused_once:
+            refused_once.add(recipient)
+            return 451
+        return None
+
+    sink = SMTPSink(refuse=refuse, delay=SMTP_DELAY, keep=False).start()
+    with app.app_context():
+        reset()
+        seed(clients=CLIENTS, invoices=invoices)
+        started = time.perf_counter()
+        queued = delivery.queue([Invoice.id > 0], fmt)
+        db.session.commit()
+        queue_ms = (time.perf_counter() - started) * 1000
+        again = delivery.queue([Invoice.id > 0], fmt)
+        db.session.commit()
+
+    credentials = f"{app.config['USERNAME']}:{app.config['PASSWORD']}".encode()
+    headers = {'Authorization': 'Basic ' + base64.b64encode(credentials).decode()}
+    client = app.test_client()
+    idle = latencies_ms(client, headers, lambda count: count >= 100)
+
+    worker = multiprocessing.get_context('spawn').Process(target=run_worker, args=(sink.port, THREADS))
+    started = time.perf_counter()
+    worker.start()
+    busy = latencies_ms(client, headers, lambda count: not worker.is_alive())
+    worker.join()
+    seconds = time.perf_counter() - started
+
+    with app.app_context():
+        counts = delivery.status_counts()
+        failed = db.session.execute(db.select(Delivery.recipient).where(Delivery.status == delivery.FAILED)).all()
+        db.session.commit()
+    sink.shutdown()
+
+    print(f"{invoices} invoices as {fmt}, {THREADS} SMTP connections, {SMTP_DELAY * 1000:.0f} ms per message:\n")
+    print(f"  queue        {queued} deliveries in {queue_ms:.1f} ms; queued again: {again}")
+    print(f"  worker       {counts.get(delivery.SENT, 0)} sent in {seconds:.1f} s "
+          f"({counts.get(delivery.SENT, 0) / seconds:.0f}/s, process start included), {sink.connections} connections")
+    print(f"  statuses     {counts}")
+    print(f"\n  {PAGE} while idle: p50 {statistics.median(idle):6.1f} ms  p95 {percentile(idle, 0.95):6.1f} ms"
+          f"  ({len(idle)} requests)")
+    print(f"  {PAGE} sending:   p50 {statistics.median(busy):6.1f} ms  p95 {percentile(busy, 0.95):6.1f} ms"
+          f"  ({len(busy)} requests)")
+    print(f"\nevery message received once:            {sink.received == counts.get(delivery.SENT, 0)}")
+    print(f"only the refused address failed:        {set(row.recipient for row in failed) == {REFUSED}}")
+    print(f"temporary failure sent after a retry:   {TEMPORARY in refused_once and not counts.get(delivery.QUEUED)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Compare query plans and timings with and without the lookup indexes.
+
+Seeds a throwaway SQLite database (100k invoices by default), runs the hot
+lookups once with the indexes dropped and once with them in place, and
+prints the EXPLAIN QUERY PLAN output and the average time per query.
+
+    python -m benchmarks.index_plans [invoices]
+"""
+import os
+import sys
+import tempfile
+import time
+
+_db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_db_path}')
+
+from app import create_app, db, Invoice, InvoiceService  # noqa: E402
+from benchmarks.seed import reset, seed  # noqa: E402
+
+app = create_app()
+
+QUERIES = {
+    'client_invoices': (
+        "SELECT * FROM invoice WHERE client_id = :client_id ORDER BY invoice_date",
+        {'client_id': 42},
+    ),
+    'print_invoice services': (
+        "SELECT * FROM invoice_service WHERE invoice_id = :invoice_id",
+        {'invoice_id': 4242},
+    ),
+    'edit_invoice delete': (
+        "DELETE FROM invoice_service WHERE invoice_id = :invoice_id",
+        {'invoice_id': -1},
+    ),
+    'state + date range': (
+        "SELECT count(*) FROM invoice WHERE state = 'Sent' AND invoice_date >= '2024-01-01'",
+        {},
+    ),
+    'invoice number lookup': (
+        "SELECT * FROM invoice WHERE invoice_number = :number",
+        {'number': '004242'},
+    ),
+}
+REPEAT = 20
+
+
+def lookup_indexes():
+    tables = [Invoice.__table__, InvoiceService.__table__]
+    return [index for table in tables for index in table.indexes]
+
+
+def run(label):
+    print(f"\n== {label}")
+    connection = db.session.connection()
+    for name, (sql, params) in QUERIES.items():
+        plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        started = time.perf_counter()
+        for _ in range(REPEAT):
+            result = db.session.execute(db.text(sql), params)
+            if result.returns_rows:
+                result.fetchall()
+        elapsed_ms = (time.perf_counter() - started) / REPEAT * 1000
+        print(f"{name:24} {elapsed_ms:9.3f} ms   " + ' | '.join(row[-1] for row in plan))
+    db.session.rollback()
+
+
+def main():
+    invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with app.app_context():
+        reset()
+        started = time.perf_counter()
+        seed(clients=invoices // 50, invoices=invoices, lines_per_invoice=5)
+        print(f"seeded {invoices} invoices in {time.perf_counter() - started:.1f} s")
+
+        for index in lookup_indexes():
+            index.drop(db.engine)
+        db.session.execute(db.text("ANALYZE"))
+        run('without indexes')
+
+        for index in lookup_indexes():
+            index.create(db.engine)
+        db.session.execute(db.text("ANALYZE"))
+        run('with indexes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Write volume of invoice edits: replacing all service lines vs. diffing them.
+
+For invoices with 10, 100 and 1000 lines, saves the invoice repeatedly with
+one changed quantity, once the old way (delete every line, insert them all
+again) and once with line_items.sync_services().  Prints per edit the
+statements and rows written to invoice_service, the bytes appended to the
+SQLite WAL (pages actually written) and the time, plus how far the service
+line ids moved.
+
+    python -m benchmarks.line_edits [edits]
+"""
+from datetime import date
+import os
+import random
+import sys
+import tempfile
+import time
+
+_db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_db_path}')
+
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app, db, Client, Invoice, InvoiceService  # noqa: E402
+from benchmarks.seed import reset  # noqa: E402
+import database  # noqa: E402
+from line_items import sync_services  # noqa: E402
+from pricing import price_invoice  # noqa: E402
+
+app = create_app()
+
+LINE_COUNTS = [10, 100, 1000]
+MODES = ['replace', 'diff']
+
+
+def no_autocheckpoint(dbapi_connection, connection_record):
+    # Keep every written page in the WAL so its size measures the write volume
+    dbapi_connection.execute('PRAGMA wal_autocheckpoint=0')
+
+
+def wal_size():
+    path = db.engine.url.database + '-wal'
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def checkpoint():
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+def create_invoice(line_count):
+    lines = [InvoiceService(service=f'Service {i}', unit_cost=10, quantity=1) for i in range(line_count)]
+    invoice = Invoice(invoice_id=f'EDIT-{line_count}-{random.random()}', invoice_number='1',
+                      invoice_date=date(2024, 5, 1), client_id=1, state='Draft', services=lines)
+    price_invoice(invoice)
+    db.session.add(invoice)
+    db.session.commit()
+    return invoice.id
+
+
+def edit(invoice_id, mode, rng):
+    """One save of the edit form with one changed quantity."""
+    database.begin_write(db.session)
+    invoice = db.session.get(Invoice, invoice_id)
+    lines = [{'service': s.service, 'unit_cost': s.unit_cost, 'quantity': s.quantity} for s in invoice.services]
+    line_ids = [s.id for s in invoice.services]
+    lines[rng.randrange(len(lines))]['quantity'] += 1
+    if mode == 'replace':
+        invoice.services = [InvoiceService(**line) for line in lines]
+    else:
+        sync_services(invoice, lines, line_ids)
+    price_invoice(invoice)
+    db.session.commit()
+
+
+def run(mode, line_count, edits, writes):
+    invoice_id = create_invoice(line_count)
+    first_id = max(s.id for s in db.session.get(Invoice, invoice_id).services)
+    db.session.commit()
+    checkpoint()
+    writes.clear()
+    rng = random.Random(line_count)
+    started = time.perf_counter()
+    for _ in range(edits):
+        edit(invoice_id, mode, rng)
+    elapsed = time.perf_counter() - started
+    wal_bytes = wal_size()
+    last_id = db.session.scalar(db.select(db.func.max(InvoiceService.id)).where(InvoiceService.invoice_id == invoice_id))
+    db.session.commit()
+    return {
+        'statements': len(writes) / edits,
+        'rows': sum(writes) / edits,
+        'wal_kib': wal_bytes / edits / 1024,
+        'ms': elapsed / edits * 1000,
+        'id_drift': last_id - first_id,
+    }
+
+
+def main():
+    edits = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    writes = []
+
+    with app.app_context():
+        reset()
+        db.session.add(Client(company_name='Line Edits', currency='EUR'))
+        db.session.commit()
+        event.listen(db.engine, 'connect', no_autocheckpoint)
+        db.engine.dispose()  # New connections get the listener above
+
+        @event.listens_for(db.engine, 'after_cursor_execute')
+        def count_service_writes(conn, cursor, statement, parameters, context, executemany):
+            if statement.split()[0] in ('INSERT', 'UPDATE', 'DELETE') and 'invoice_service' in statement.split('(')[0]:
+                writes.append(cursor.rowcount)
+
+        print(f"{edits} edits per invoice, one changed quantity each; per edit:\n")
+        print(f"{'lines':>6} {'mode':8} {'stmts':>7} {'rows':>7} {'WAL KiB':>8} {'ms':>7} {'id drift':>9}")
+        for line_count in LINE_COUNTS:
+            for mode in MODES:
+                result = run(mode, line_count, edits, writes)
+                print(f"{line_count:6} {mode:8} {result['statements']:7.1f} {result['rows']:7.1f} "
+                      f"{result['wal_kib']:8.1f} {result['ms']:7.1f} {result['id_drift']:9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""The overdue job and the aging report on a large number of open invoices.
+
+Seeds INVOICES invoices and makes every draft a sent invoice, so about two
+thirds are open, most of them past their due date on TODAY.  A few overdue
+invoices get a due date after TODAY, as if it had been extended; they must
+be Sent again.  For comparison, ROW_BY_ROW of the overdue invoices are first
+flipped the way a Python loop over the ORM would do it; aging.mark_overdue()
+then does the rest with its set-based UPDATEs, and again, which must change
+nothing.  It checks every invoice's state against the expected one, that
+version_id was bumped once per change and that the report summary agrees
+with the invoices, then times aging_report() and compares it with the same
+report computed in Python.
+
+    python -m benchmarks.overdue [invoices]
+"""
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+_db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_db_path}')
+
+import aging  # noqa: E402
+from app import create_app, db, Invoice  # noqa: E402
+from benchmarks.seed import reset, seed  # noqa: E402
+import reports  # noqa: E402
+
+app = create_app()
+
+CLIENTS = 2000
+TODAY = date(2024, 7, 1)
+ROW_BY_ROW = 5000
+EXTENDED = 1000
+
+
+def expected_state(state, due_date):
+    if state == aging.SENT and due_date < TODAY:
+        return aging.OVERDUE
+    if state == aging.OVERDUE and due_date >= TODAY:
+        return aging.SENT
+    return state
+
+
+def expected_aging(rows):
+    """(client_id, currency) -> [invoice count, bucket amounts..., total], computed row by row."""
+    report = defaultdict(lambda: [0] * (len(aging.BUCKETS) + 2))
+    for client_id, currency, state, due_date, total in rows:
+        if state not in aging.OPEN_STATES:
+            continue
+        days = (TODAY - due_date).days
+        index = 0 if days < 0 else max(i for i, (_, _, first) in enumerate(aging.BUCKETS) if first is not None
+                                       and days >= first)
+        values = report[(client_id, currency or '')]
+        values[0] += 1
+        values[1 + index] += total
+        values[-1] += total
+    return report
+
+
+def main():
+    invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    with app.app_context():
+        reset()
+        seed(clients=CLIENTS, invoices=invoices, lines_per_invoice=1)
+        table = Invoice.__table__
+        db.session.execute(table.update().where(table.c.state == 'Draft').values(state=aging.SENT))
+        extended = db.session.scalars(db.select(Invoice.id).where(Invoice.state == aging.SENT,
+                                                                  Invoice.due_date < TODAY).limit(EXTENDED)).all()
+        db.session.execute(table.update().where(table.c.id.in_(extended))
+                           .values(state=aging.OVERDUE, due_date=TODAY + timedelta(days=10)))
+        reports.rebuild()
+        db.session.commit()
+
+        before = {row.id: row for row in db.session.execute(
+            db.select(Invoice.id, Invoice.state, Invoice.due_date, Invoice.version_id))}
+        expected = {id_: expected_state(row.state, row.due_date) for id_, row in before.items()}
+        open_count = sum(row.state in aging.OPEN_STATES for row in before.values())
+        db.session.commit()
+
+        # The row-by-row way: load, change and flush every invoice through the ORM
+        started = time.perf_counter()
+        for invoice in Invoice.query.filter(Invoice.state == aging.SENT, Invoice.due_date < TODAY).limit(ROW_BY_ROW):
+            invoice.state = aging.OVERDUE
+        db.session.commit()
+        row_by_row_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        overdue, back = aging.mark_overdue(TODAY)
+        job_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        again = aging.mark_overdue(TODAY)
+        again_seconds = time.perf_counter() - started
+
+        after = {row.id: row for row in db.session.execute(
+            db.select(Invoice.id, Invoice.state, Invoice.version_id))}
+        wrong_states = sum(after[id_].state != state for id_, state in expected.items())
+        wrong_versions = sum(after[id_].version_id != row.version_id + (expected[id_] != row.state)
+                             for id_, row in before.items())
+        mismatches = reports.check()
+
+        started = time.perf_counter()
+        report = aging.aging_report(TODAY)
+        aging_ms = (time.perf_counter() - started) * 1000
+        computed = expected_aging(db.session.execute(
+            db.select(Invoice.client_id, Invoice.currency, Invoice.state, Invoice.due_date, Invoice.total)))
+        db.session.commit()
+    from_sql = {(row.client_id, row.currency): [row.invoice_count] + [getattr(row, key) for key, _, _ in aging.BUCKETS]
+                + [row.total] for row in report}
+
+    changed = overdue + back + ROW_BY_ROW
+    print(f"{invoices} invoices, {open_count} open, as of {TODAY}:\n")
+    print(f"  row by row (ORM)   {ROW_BY_ROW} overdue in {row_by_row_seconds:.2f} s "
+          f"({ROW_BY_ROW / row_by_row_seconds:,.0f}/s)")
+    print(f"  mark_overdue()     {overdue} overdue, {back} sent again in {job_seconds:.2f} s "
+          f"({(overdue + back) / job_seconds:,.0f}/s, report summary included)")
+    print(f"  again              {again} in {again_seconds * 1000:.0f} ms")
+    print(f"  aging_report()     {len(report)} client/currency rows in {aging_ms:.0f} ms")
+    print(f"\nstates as expected ({changed} changed):  {wrong_states == 0}")
+    print(f"version_id bumped once per change:       {wrong_versions == 0}")
+    print(f"second run changes nothing:              {again == (0, 0)}")
+    print(f"report summary matches the invoices:     {not mismatches}")
+    print(f"aging report matches Python:             {from_sql == dict(computed)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Check that the number of SQL statements per route does not grow with the data.
+
+Seeds an in-memory database at two sizes, requests every listed route and
+compares the statement counts.  Exits with status 1 if any route issues more
+statements on the larger data set (i.e. an N+1 pattern crept back in).
+
+    python -m benchmarks.query_counts
+"""
+import base64
+import os
+import sys
+
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from sqlalchemy import event  # noqa: E402
+
+from app import create_app, db  # noqa: E402
+from benchmarks.seed import reset, seed  # noqa: E402
+
+app = create_app()
+
+ROUTES = [
+    '/',
+    '/invoices/data?draw=1&start=0&length=100',
+    '/invoices/data?draw=1&start=0&length=100&search[value]=Last1',
+    '/clients',
+    '/clients/lookup.json?q=Comp',
+    '/client_invoices/1',
+    '/print_invoice/1',
+    '/add_invoice',
+    '/edit_invoice/1',
+    '/reports',
+    '/reports/client.json',
+    '/reports/aging',
+    '/api/v1/clients',
+    '/api/v1/invoices?include=services',
+    '/api/v1/invoices?fields=invoice_number,total&limit=1000',
+    '/search?q=Last1',
+    '/search.json?q=Service',
+]
+
+SIZES = {
+    'small': dict(clients=5, invoices=20, lines_per_invoice=2),
+    'large': dict(clients=200, invoices=2000, lines_per_invoice=20),
+}
+
+
+def count_statements(client, url, headers):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        response = client.get(url, headers=headers)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    if response.status_code != 200:
+        raise RuntimeError(f"{url} returned {response.status_code}")
+    return len(statements)
+
+
+def main():
+    credentials = f"{app.config['USERNAME']}:{app.config['PASSWORD']}".encode()
+    headers = {'Authorization': 'Basic ' + base64.b64encode(credentials).decode()}
+    counts = {}
+    for size, volumes in SIZES.items():
+        with app.app_context():
+            reset()
+            seed(**volumes)
+            client = app.test_client()
+            counts[size] = {url: count_statements(client, url, headers) for url in ROUTES}
+
+    failed = False
+    for url in ROUTES:
+        small, large = counts['small'][url], counts['large'][url]
+        status = 'ok' if large <= small else 'FAIL'
+        failed = failed or status == 'FAIL'
+        print(f"{status:4}  {url:60} small={small:<3} large={large}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
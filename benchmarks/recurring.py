@@ -0,0 +1,114 @@
+"""Generating a month of recurring invoices: one batch vs. one invoice at a time.
+
+Seeds CLIENTS clients with one recurring invoice each (monthly, quarterly or
+yearly, 1 to 5 services) and times recurring.generate() for one month, then
+runs it again, which must create nothing.  It checks that the new invoice IDs
+and numbers are consecutive and unique, and that the report summary agrees
+with the invoices.  For comparison it times ONE_BY_ONE of the invoices due
+in another month created one by one through the ORM with a commit each, as a
+loop over the add form would.
+
+    python -m benchmarks.recurring [clients]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+
+_db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_db_path}')
+
+from app import create_app, db, Invoice, InvoiceService  # noqa: E402
+from benchmarks.seed import reset, seed  # noqa: E402
+from models import GeneratedInvoice, RecurringInvoice, RecurringService  # noqa: E402
+import numbering  # noqa: E402
+from pricing import price_invoice  # noqa: E402
+import recurring  # noqa: E402
+import reports  # noqa: E402
+
+app = create_app()
+
+PERIOD = '2025-03'
+ONE_BY_ONE_PERIOD = '2025-06'  # Due for the same (monthly and quarterly) templates
+ONE_BY_ONE = 500
+
+
+def seed_templates(clients):
+    rng = random.Random(0)
+    templates = [{
+        'id': i, 'client_id': i, 'start_date': date(2024, 12, rng.randint(1, 31)),
+        'interval_months': rng.choice([1, 1, 3, 12]), 'active': True, 'apply_vat': rng.random() < 0.5,
+        'vat_percentage': 20, 'currency': 'EUR', 'discount': rng.choice([0, 0, 5]),
+    } for i in range(1, clients + 1)]
+    services = [{'recurring_invoice_id': i, 'service': f'Service {line}', 'unit_cost': rng.randint(1000, 50000) / 100,
+                 'quantity': rng.randint(1, 10)}
+                for i in range(1, clients + 1) for line in range(rng.randint(1, 5))]
+    db.session.execute(db.insert(RecurringInvoice), templates)
+    db.session.execute(db.insert(RecurringService), services)
+    db.session.commit()
+
+
+def one_by_one(period):
+    """The invoices of `period` created the way the add form creates one."""
+    year, month = recurring.parse_period(period)
+    templates = recurring.due_templates(period)[:ONE_BY_ONE]
+    db.session.commit()
+    for template in templates:
+        invoice = Invoice(
+            invoice_id=numbering.next_invoice_id(), invoice_number=numbering.next_invoice_number(),
+            invoice_date=recurring.invoice_date(template, year, month), client_id=template.client_id,
+            state='Draft', apply_vat=template.apply_vat, vat_percentage=template.vat_percentage,
+            currency=template.currency, discount=template.discount,
+            services=[InvoiceService(service=line.service, unit_cost=line.unit_cost, quantity=line.quantity)
+                      for line in template.services])
+        price_invoice(invoice)
+        db.session.add(invoice)
+        db.session.commit()
+    return len(templates)
+
+
+def consecutive(values):
+    return sorted(values) == list(range(min(values), min(values) + len(values)))
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with app.app_context():
+        reset()
+        seed(clients=clients, invoices=clients)
+        seed_templates(clients)
+
+        started = time.perf_counter()
+        created = recurring.generate(PERIOD)
+        batch_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        again = recurring.generate(PERIOD)
+        again_seconds = time.perf_counter() - started
+
+        invoices = db.session.execute(
+            db.select(Invoice.invoice_id, Invoice.invoice_number)
+            .join(GeneratedInvoice, GeneratedInvoice.invoice_id == Invoice.id)
+            .where(GeneratedInvoice.period == PERIOD)).all()
+        ids = [int(invoice_id.removeprefix('INV-')) for invoice_id, _ in invoices]
+        numbers = [int(number) for _, number in invoices]
+        mismatches = reports.check()
+        db.session.commit()
+
+        started = time.perf_counter()
+        one_by_one_count = one_by_one(ONE_BY_ONE_PERIOD)
+        one_by_one_seconds = time.perf_counter() - started
+
+    print(f"{clients} recurring invoices, {created} due in {PERIOD}:\n")
+    print(f"  batch        {batch_seconds * 1000:9.1f} ms  {created / batch_seconds:9.0f} invoices/s")
+    print(f"  one by one   {one_by_one_seconds * 1000:9.1f} ms  {one_by_one_count / one_by_one_seconds:9.0f} invoices/s"
+          f"  ({one_by_one_count} of {ONE_BY_ONE_PERIOD})")
+    print(f"  run again    {again_seconds * 1000:9.1f} ms  {again} invoices created")
+    print(f"\ninvoice IDs consecutive and unique:     {consecutive(ids) and len(set(ids)) == len(ids)}")
+    print(f"invoice numbers consecutive and unique: {consecutive(numbers) and len(set(numbers)) == len(numbers)}")
+    print(f"report summary matches the invoices:    {not mismatches}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Time the report breakdowns from the summary table against live aggregation.
+
+Seeds a throwaway SQLite database (100k invoices by default), then answers
+every dashboard breakdown once from invoice_summary and once with the same
+GROUP BY over the invoice table, and checks the summary against the live data.
+Also times single-invoice edits, which pay for keeping the summary current.
+
+    python -m benchmarks.report_queries [invoices]
+"""
+import os
+import sys
+import tempfile
+import time
+
+_db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_db_path}')
+
+import sqlalchemy as sa  # noqa: E402
+
+from app import create_app, db, Client, Invoice  # noqa: E402
+from benchmarks.seed import reset, seed  # noqa: E402
+import reports  # noqa: E402
+
+app = create_app()
+
+REPEAT = 20
+
+
+def live_breakdown(dimension):
+    """The breakdown computed from the invoice table, for comparison."""
+    rows = reports._aggregate(db.engine.dialect.name).subquery()
+    keys = {'period': [rows.c.period], 'client': [rows.c.client_id], 'currency': [], 'state': [rows.c.state]}
+    columns = keys[dimension] + [rows.c.currency]
+    query = sa.select(*columns, sa.func.sum(rows.c.invoice_count), *[sa.func.sum(rows.c[name]) for name in reports.AMOUNTS])
+    if dimension == 'client':
+        query = query.join(Client.__table__, Client.id == rows.c.client_id).add_columns(Client.company_name)
+    return db.session.execute(query.group_by(*columns, *([Client.company_name] if dimension == 'client' else []))).all()
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        function(*args)
+    return (time.perf_counter() - started) / REPEAT * 1000
+
+
+def main():
+    invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with app.app_context():
+        reset()
+        started = time.perf_counter()
+        seed(clients=invoices // 50, invoices=invoices, lines_per_invoice=5)
+        print(f"seeded {invoices} invoices in {time.perf_counter() - started:.1f} s")
+        summary_rows = db.session.query(sa.func.count()).select_from(reports.summary).scalar()
+        print(f"{summary_rows} summary rows\n")
+
+        print(f"{'breakdown':10} {'summary':>10} {'live':>10}")
+        for dimension in reports.DIMENSIONS:
+            print(f"{dimension:10} {timed(reports.breakdown, dimension):7.2f} ms {timed(live_breakdown, dimension):7.2f} ms")
+
+        started = time.perf_counter()
+        for invoice_id in range(1, REPEAT + 1):
+            invoice = db.session.get(Invoice, invoice_id)
+            invoice.state = 'Paid' if invoice.state != 'Paid' else 'Sent'
+            db.session.commit()
+        print(f"\ninvoice edit + summary refresh: {(time.perf_counter() - started) / REPEAT * 1000:.2f} ms")
+
+        mismatches = reports.check()
+        print(f"summary check: {len(mismatches)} mismatches")
+        return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""Time full-text searches against a large SQLite database.
+
+Seeds a throwaway database (200k invoices with 5 lines each, i.e. 1M
+service lines, by default), then times typical searches: a client name, an
+invoice number, a common and a rare service description, a short prefix and
+a miss.  Also compares a client-name search with the LIKE scan the invoice
+list uses, and times the edits that the triggers have to index.
+
+    python -m benchmarks.search_queries [invoices]
+"""
+import os
+import sys
+import tempfile
+import time
+
+_db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{_db_path}')
+
+import sqlalchemy as sa  # noqa: E402
+
+from app import create_app, db, Client, Invoice, InvoiceService  # noqa: E402
+from benchmarks.seed import reset, seed  # noqa: E402
+import search  # noqa: E402
+
+app = create_app()
+
+REPEAT = 20
+QUERIES = [
+    ('client name', 'Last1234', None),
+    ('invoice number', '004321', 'invoice'),
+    ('common service', 'Service 17', None),
+    ('rare service', 'Plumbing repair', 'service'),
+    ('prefix', 'Comp', None),
+    ('page 5', 'Service', 'service'),
+    ('miss', 'nonexistent', None),
+]
+
+
+def timed(function, *args, **kwargs):
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        result = function(*args, **kwargs)
+    return (time.perf_counter() - started) / REPEAT * 1000, result
+
+
+def like_scan(term):
+    """The invoice list's LIKE search, for comparison."""
+    pattern = f'%{term}%'
+    return db.session.query(Invoice.id).join(Client, Invoice.client_id == Client.id).filter(sa.or_(
+        Client.last_name.ilike(pattern), Client.company_name.ilike(pattern),
+        Invoice.invoice_number.ilike(pattern))).limit(20).all()
+
+
+def main():
+    invoices = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with app.app_context():
+        reset()
+        started = time.perf_counter()
+        seed(clients=invoices // 50, invoices=invoices, lines_per_invoice=5)
+        print(f"seeded {invoices} invoices, {invoices * 5} service lines in {time.perf_counter() - started:.1f} s")
+        # A handful of distinctive lines among the generic ones
+        for line_id in range(1000, invoices * 5, invoices * 5 // 10):
+            db.session.get(InvoiceService, line_id).service = 'Plumbing repair, kitchen'
+        db.session.commit()
+        documents = db.session.execute(sa.text(f"SELECT count(*) FROM {search.TABLE}")).scalar()
+        print(f"{documents} documents in the search index\n")
+
+        print(f"{'search':16} {'query':18} {'ms':>8} {'results':>8}")
+        for label, query, kind in QUERIES:
+            page = 5 if label == 'page 5' else 1
+            elapsed, (results, has_more) = timed(search.search, query, kind, page)
+            print(f"{label:16} {query:18} {elapsed:8.2f} {len(results):7}{'+' if has_more else ' '}")
+        elapsed, rows = timed(like_scan, 'Last1234')
+        print(f"{'LIKE scan':16} {'Last1234':18} {elapsed:8.2f} {len(rows):7}")
+
+        started = time.perf_counter()
+        for line_id in range(1, REPEAT + 1):
+            db.session.get(InvoiceService, line_id).service = f'Edited line {line_id}'
+            db.session.commit()
+        print(f"\nservice line edit incl. reindexing: {(time.perf_counter() - started) / REPEAT * 1000:.2f} ms")
+        results, _ = search.search('Edited line', 'service')
+        print(f"edited lines found: {len(results)} of {REPEAT}")
+        return 0 if len(results) == REPEAT else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
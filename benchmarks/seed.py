@@ -0,0 +1,107 @@
+"""Synthetic data for the benchmark scripts.
+
+Rows are written with bulk INSERTs and explicit primary keys, so the target
+database is expected to be empty (use reset() first).
+"""
+import random
+from datetime import date, timedelta
+
+from app import db, Client, Invoice, InvoiceService
+from pricing import compute_totals, line_total
+import reports
+
+STATES = ['Draft', 'Sent', 'Paid']
+CURRENCIES = ['EUR', 'USD', 'CAD', 'CHF']
+LANGUAGES = ['en', 'fr', 'de']
+PAYMENT_DAYS = [14, 30, 60]  # Assigned in turn, so the random data stays the same
+BATCH_SIZE = 10000
+
+
+def reset():
+    """Drop and recreate every table."""
+    db.drop_all()
+    db.create_all()
+
+
+def _flush(invoice_rows, service_rows):
+    """Bulk insert the pending rows and empty the buffers."""
+    if invoice_rows:
+        db.session.execute(db.insert(Invoice), invoice_rows)
+    if service_rows:
+        db.session.execute(db.insert(InvoiceService), service_rows)
+    invoice_rows.clear()
+    service_rows.clear()
+
+
+def seed(clients=100, invoices=1000, lines_per_invoice=5, start=date(2020, 1, 1), rng_seed=0, currency_weights=None):
+    """Insert `clients` clients and `invoices` invoices spread over them.
+
+    `lines_per_invoice` is a number or a (fewest, most) range to pick from per
+    invoice; `currency_weights` are relative frequencies of CURRENCIES.
+    """
+    rng = random.Random(rng_seed)
+
+    def currency():
+        return rng.choices(CURRENCIES, currency_weights)[0] if currency_weights else rng.choice(CURRENCIES)
+
+    client_rows = [{
+        'id': i,
+        'company_name': f'Company {i}',
+        'vat_number': f'VAT{i:08d}',
+        'vat_percentage': rng.choice([0, 7.7, 19, 20]),
+        'street': f'{i} Main Street',
+        'city': 'Anytown',
+        'postal_code': f'{10000 + i}',
+        'country': 'Country',
+        'first_name': f'First{i}',
+        'last_name': f'Last{i}',
+        'email': f'client{i}@example.com',
+        'currency': currency(),
+        'language': rng.choice(LANGUAGES),
+        'payment_terms': f'Net {PAYMENT_DAYS[i % len(PAYMENT_DAYS)]}',
+        'payment_days': PAYMENT_DAYS[i % len(PAYMENT_DAYS)],
+    } for i in range(1, clients + 1)]
+    db.session.execute(db.insert(Client), client_rows)
+
+    invoice_rows, service_rows = [], []
+    line_id = 0
+    for i in range(1, invoices + 1):
+        line_totals = []
+        line_count = lines_per_invoice if isinstance(lines_per_invoice, int) else rng.randint(*lines_per_invoice)
+        for _ in range(line_count):
+            line_id += 1
+            unit_cost = rng.randint(1000, 50000) / 100
+            quantity = rng.randint(1, 10)
+            line_totals.append(line_total(unit_cost, quantity))
+            service_rows.append({
+                'id': line_id,
+                'invoice_id': i,
+                'service': f'Service {rng.randint(1, 50)}',
+                'unit_cost': unit_cost,
+                'quantity': quantity,
+                'line_total': line_totals[-1],
+            })
+        apply_vat = rng.random() < 0.5
+        discount = rng.choice([0, 0, 0, 5, 10])
+        totals = compute_totals(line_totals, discount, apply_vat, 20)
+        invoice_date = start + timedelta(days=rng.randrange(5 * 365))
+        client_id = rng.randint(1, clients)
+        invoice_rows.append({
+            'id': i,
+            'invoice_id': f'SEED{i:09d}',
+            'invoice_number': f'{i:06d}',
+            'invoice_date': invoice_date,
+            'due_date': invoice_date + timedelta(days=PAYMENT_DAYS[client_id % len(PAYMENT_DAYS)]),
+            'client_id': client_id,
+            'state': rng.choice(STATES),
+            'apply_vat': apply_vat,
+            'vat_percentage': 20,
+            'currency': currency(),
+            'discount': discount,
+            **totals._asdict(),
+        })
+        if len(invoice_rows) >= BATCH_SIZE:
+            _flush(invoice_rows, service_rows)
+    _flush(invoice_rows, service_rows)
+    reports.rebuild()  # The bulk inserts bypass the summary hooks
+    db.session.commit()
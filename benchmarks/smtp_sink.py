@@ -0,0 +1,110 @@
+"""A local SMTP server that accepts every message and keeps or prints it.
+
+For trying out the invoice delivery without a real mail server; point
+SMTP_HOST/SMTP_PORT in config.py at it.  It speaks just enough SMTP for
+smtplib (no TLS, no authentication).  Recipients can be refused with a
+given reply code, and every message can be delayed like a remote server's.
+
+    python -m benchmarks.smtp_sink [port]        # prints From, To and Subject
+"""
+import email
+import socketserver
+import sys
+import threading
+import time
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        self.reply('220 localhost SMTP sink')
+        sender, recipients = None, []
+        server.count_connection()
+        for raw in self.rfile:
+            command = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip('<> '), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = command[8:].strip('<> ')
+                code = server.refuse(recipient) if server.refuse else None
+                if code:
+                    self.reply(f'{code} Recipient refused')
+                else:
+                    recipients.append(recipient)
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for line in self.rfile:
+                    if line in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(line[1:] if line.startswith(b'..') else line)
+                time.sleep(server.delay)
+                server.deliver(sender, recipients, b''.join(lines))
+                self.reply('250 OK')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Collects (sender, recipients, message) in .messages.
+
+    `refuse(recipient)` returns a reply code (e.g. 550, or 451 for a
+    temporary failure) to refuse a recipient, or None to accept it;
+    `delay` is slept before every message is accepted.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, refuse=None, delay=0.0, keep=True, echo=False):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.refuse, self.delay, self.keep, self.echo = refuse, delay, keep, echo
+        self.messages, self.received, self.connections = [], 0, 0
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def deliver(self, sender, recipients, data):
+        with self._lock:
+            self.received += 1
+            if self.keep:
+                self.messages.append((sender, recipients, data))
+        if self.echo:
+            message = email.message_from_bytes(data)
+            print(f"{sender} -> {', '.join(recipients)}: {message['Subject']} ({len(data)} bytes)", flush=True)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1025
+    sink = SMTPSink(port, keep=False, echo=True)
+    print(f"SMTP sink on 127.0.0.1:{sink.port}", flush=True)
+    sink.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
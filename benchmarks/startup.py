@@ -0,0 +1,132 @@
+"""Cold start time of an app process and the memory each worker adds.
+
+Every run starts a fresh interpreter, like a server starting a worker, and
+times three steps: importing app.py, create_app() (logging, translations
+and personas, engine settings) and the first requests (the invoice list,
+the client list and a printed invoice).
+
+Then one process loads the app the way wsgi.py does under gunicorn's
+preload_app and forks WORKERS workers that serve the same requests, timed
+from the fork.  For them and for a worker that loaded the app itself, it
+prints the memory the worker does not share with any other process (private
+pages from /proc/self/smaps_rollup, so Linux only).
+
+    python -m benchmarks.startup [runs]
+"""
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+WORKERS = 4
+URLS = ['/', '/clients', '/print_invoice/1']
+
+
+def private_kib():
+    """KiB of this process's memory that no other process shares."""
+    total = 0
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            name, _, value = line.partition(':')
+            if name in ('Private_Clean', 'Private_Dirty'):
+                total += int(value.split()[0])
+    return total
+
+
+def serve_requests(app):
+    credentials = f"{app.config['USERNAME']}:{app.config['PASSWORD']}".encode()
+    headers = {'Authorization': 'Basic ' + base64.b64encode(credentials).decode()}
+    client = app.test_client()
+    for url in URLS:
+        response = client.get(url, headers=headers)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} returned {response.status_code}")
+
+
+def cold_start():
+    """Runs in a fresh interpreter: the three steps, timed."""
+    started = time.perf_counter()
+    import app as app_module
+    imported = time.perf_counter()
+    app = app_module.create_app()
+    created = time.perf_counter()
+    serve_requests(app)
+    served = time.perf_counter()
+    return {'import': imported - started, 'create_app': created - imported, 'first_requests': served - created,
+            'private_kib': private_kib()}
+
+
+def preloaded_workers():
+    """Runs in a fresh interpreter: preload like wsgi.py, fork, serve.
+
+    Returns the preload time and, per worker, the time from the fork until
+    the requests were served and its private KiB.
+    """
+    started = time.perf_counter()
+    from models import db
+    import wsgi
+    preloaded = time.perf_counter()
+    results = []
+    for _ in range(WORKERS):  # One after the other, so they do not compete for the CPU
+        read_end, write_end = os.pipe()
+        forked = time.perf_counter()
+        if os.fork() == 0:
+            os.close(read_end)
+            with wsgi.app.app_context():
+                db.engine.dispose(close=False)  # As gunicorn.conf.py's post_fork
+            serve_requests(wsgi.app)
+            os.write(write_end, json.dumps([time.perf_counter() - forked, private_kib()]).encode())
+            os._exit(0)
+        os.close(write_end)
+        os.wait()
+        results.append(json.loads(os.read(read_end, 64)))
+        os.close(read_end)
+    return {'preload': preloaded - started, 'worker_seconds': [seconds for seconds, _ in results],
+            'worker_private_kib': [kib for _, kib in results]}
+
+
+def child(step):
+    result = cold_start() if step == 'cold' else preloaded_workers()
+    print(json.dumps(result))
+
+
+def run_child(step, database_url):
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--child', step], check=True,
+                            capture_output=True, text=True, env=dict(os.environ, DATABASE_URL=database_url)).stdout
+    result = json.loads(output.splitlines()[-1])
+    result['process'] = time.perf_counter() - started
+    return result
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'startup.db')}"
+    os.environ['DATABASE_URL'] = database_url
+    from app import create_app
+    from benchmarks.seed import reset, seed
+    with create_app().app_context():
+        reset()
+        seed(clients=200, invoices=2000)
+
+    results = [run_child('cold', database_url) for _ in range(runs)]
+    print(f"cold start, median of {runs} runs:")
+    for step in ('import', 'create_app', 'first_requests', 'process'):
+        print(f"  {step:16} {statistics.median(result[step] for result in results) * 1000:8.1f} ms")
+    workers = run_child('workers', database_url)
+    print(f"\npreloaded like wsgi.py: {workers['preload'] * 1000:.1f} ms once, then per forked worker "
+          f"(median of {WORKERS}) {statistics.median(workers['worker_seconds']) * 1000:.1f} ms to serve them")
+    print(f"\nprivate memory per worker after {len(URLS)} requests:")
+    print(f"  loads the app itself  {statistics.median(result['private_kib'] for result in results):8.0f} KiB")
+    print(f"  forked, preloaded     {statistics.median(workers['worker_private_kib']):8.0f} KiB")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,289 @@
+"""Reproducible route benchmarks, written to a JSON baseline that later runs are compared with.
+
+`run` seeds a database at one of the SCALES (realistic line counts and
+currency mix, same data for the same seed), then requests the main pages
+through the Flask test client: the invoice list, its data endpoint, the
+client list, the printed invoice, and the add and edit forms, shown and
+submitted.  Per route it records p50/p95/p99 latency, SQL statements per
+request and the peak memory allocated by one request (tracemalloc, in a
+separate pass so tracing does not slow the timed one).
+
+`compare` checks a run against a baseline and exits with status 1 if a route
+got slower or allocates more than the tolerance allows, or issues more SQL
+statements at all.  Small absolute changes are ignored, so sub-millisecond
+routes do not fail on timer noise.
+
+    python -m benchmarks.suite run [--scale small|medium|large] [--iterations N] [--database PATH] [--output FILE]
+    python -m benchmarks.suite compare BASELINE CURRENT [--tolerance 0.3]
+
+The database is a throwaway file unless --database is given.  An existing
+file with at least the scale's invoices is reused as is (seeding the large
+scale takes minutes); otherwise it is emptied and seeded.
+"""
+import argparse
+import base64
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+SCALES = {
+    'small': dict(clients=100, invoices=1_000),
+    'medium': dict(clients=5_000, invoices=100_000),
+    'large': dict(clients=20_000, invoices=1_000_000),
+}
+LINES_PER_INVOICE = (1, 12)
+CURRENCY_WEIGHTS = [60, 25, 5, 10]  # EUR, USD, CAD, CHF
+RNG_SEED = 0
+WARMUP = 3  # Requests per route before measuring: template compilation, caches
+MEMORY_ITERATIONS = 5
+# compare: changes smaller than these never count as regressions
+MIN_LATENCY_DELTA_MS = 1.0
+MIN_MEMORY_DELTA_KIB = 64
+
+
+def _get(url):
+    return lambda client, volumes, rng: ('GET', url(volumes, rng), None)
+
+
+def _invoice_url(path):
+    return _get(lambda volumes, rng: f'{path}/{rng.randint(1, volumes["invoices"])}')
+
+
+def _new_invoice(client, volumes, rng):
+    number = f'BENCH-{rng.getrandbits(48):012x}'
+    form = {'invoice_id': number, 'invoice_number': number, 'invoice_date': '2024-05-01',
+            'client_id': str(rng.randint(1, volumes['clients'])), 'state': 'Draft', 'discount': '0',
+            'apply_vat': 'on', 'vat_percentage': '20', 'currency': 'EUR', 'line_count': '3'}
+    for i in range(3):
+        form.update({f'service_{i}': f'Service {i}', f'unit_cost_{i}': '120.50', f'quantity_{i}': str(i + 1)})
+    return 'POST', '/add_invoice', form
+
+
+def _edited_invoice(client, volumes, rng):
+    """The edit form of a random invoice as loaded, with one quantity changed."""
+    from app import app, db, Invoice
+    with app.app_context():
+        invoice = db.session.get(Invoice, rng.randint(1, volumes['invoices']))
+        form = {'invoice_number': invoice.invoice_number, 'invoice_date': invoice.invoice_date.isoformat(),
+                'client_id': str(invoice.client_id), 'state': invoice.state, 'discount': str(invoice.discount),
+                'vat_percentage': str(invoice.vat_percentage), 'currency': invoice.currency or '',
+                'version_id': str(invoice.version_id), 'line_count': str(len(invoice.services))}
+        if invoice.apply_vat:
+            form['apply_vat'] = 'on'
+        for i, line in enumerate(invoice.services):
+            form.update({f'service_id_{i}': str(line.id), f'service_{i}': line.service,
+                         f'unit_cost_{i}': str(line.unit_cost), f'quantity_{i}': str(line.quantity)})
+        changed = rng.randrange(len(invoice.services))
+        form[f'quantity_{changed}'] = str(invoice.services[changed].quantity % 10 + 1)
+        return 'POST', f'/edit_invoice/{invoice.id}', form
+
+
+# name -> (URL rule, request factory, expected status); factories get the
+# test client, the seeded volumes and the run's random generator
+ROUTES = {
+    'index': ('/', _get(lambda volumes, rng: '/'), 200),
+    'invoices_data': ('/invoices/data', _get(lambda volumes, rng: (
+        f'/invoices/data?draw=1&start={rng.randrange(0, volumes["invoices"], 100)}&length=100')), 200),
+    'clients': ('/clients', _get(lambda volumes, rng: '/clients'), 200),
+    'print_invoice': ('/print_invoice/<id>', _invoice_url('/print_invoice'), 200),
+    'add_invoice_form': ('/add_invoice', _get(lambda volumes, rng: '/add_invoice'), 200),
+    'add_invoice': ('POST /add_invoice', _new_invoice, 302),
+    'edit_invoice_form': ('/edit_invoice/<id>', _invoice_url('/edit_invoice'), 200),
+    'edit_invoice': ('POST /edit_invoice/<id>', _edited_invoice, 302),
+}
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(percent / 100 * (len(ordered) - 1)))]
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _prepare_database(volumes):
+    from app import app, db, Invoice
+    from benchmarks.seed import reset, seed
+    with app.app_context():
+        existing = db.session.query(Invoice).count() if db.inspect(db.engine).has_table('invoice') else 0
+        db.session.rollback()  # A read transaction left open would keep the seeding from writing
+        if existing >= volumes['invoices']:
+            print(f"reusing {db.engine.url.database}")
+            return None
+        reset()
+        started = time.perf_counter()
+        seed(**volumes, lines_per_invoice=LINES_PER_INVOICE, rng_seed=RNG_SEED, currency_weights=CURRENCY_WEIGHTS)
+        elapsed = time.perf_counter() - started
+        print(f"seeded {volumes['invoices']} invoices for {volumes['clients']} clients in {elapsed:.1f} s")
+        return elapsed
+
+
+def _send(client, headers, method, url, form, expected):
+    response = client.open(url, method=method, data=form, headers=headers)
+    if response.status_code != expected:
+        raise RuntimeError(f"{method} {url} returned {response.status_code}, expected {expected}")
+    if method == 'POST' and response.headers.get('Location') != '/':
+        # The forms redirect back to themselves when they reject the input
+        raise RuntimeError(f"{method} {url} was rejected, redirected to {response.headers.get('Location')}")
+    return response
+
+
+def measure_route(client, headers, volumes, name, iterations, statements):
+    _, factory, expected = ROUTES[name]
+    rng = random.Random(f'{RNG_SEED}-{name}')
+    for _ in range(WARMUP):
+        _send(client, headers, *factory(client, volumes, rng), expected)
+
+    latencies, counts = [], []
+    for _ in range(iterations):
+        request = factory(client, volumes, rng)
+        statements[0] = 0
+        started = time.perf_counter()
+        _send(client, headers, *request, expected)
+        latencies.append((time.perf_counter() - started) * 1000)
+        counts.append(statements[0])
+
+    peaks = []
+    for _ in range(MEMORY_ITERATIONS):
+        request = factory(client, volumes, rng)
+        tracemalloc.start()
+        try:
+            _send(client, headers, *request, expected)
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'requests': iterations,
+        'latency_ms': {'p50': _percentile(latencies, 50), 'p95': _percentile(latencies, 95),
+                       'p99': _percentile(latencies, 99), 'mean': statistics.fmean(latencies)},
+        'queries': {'median': statistics.median(counts), 'max': max(counts)},
+        'peak_memory_kib': max(peaks),
+    }
+
+
+def run(args):
+    volumes = dict(SCALES[args.scale])
+    database = args.database or os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(database)}'  # Before the app is imported
+
+    from sqlalchemy import event
+    from app import create_app, db
+
+    app = create_app()
+    logging.getLogger().setLevel(logging.WARNING)  # Even with LOG_LEVEL = 'DEBUG' in config.py
+    app.config['SLOW_REQUEST_SECONDS'] = None  # The memory pass is slow by design
+    seed_seconds = _prepare_database(volumes)
+    credentials = f"{app.config['USERNAME']}:{app.config['PASSWORD']}".encode()
+    headers = {'Authorization': 'Basic ' + base64.b64encode(credentials).decode()}
+    statements = [0]
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements[0] += 1
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+    client = app.test_client()
+    routes = {}
+    print(f"\n{'route':18} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'peak KiB':>9}")
+    for name in ROUTES:
+        routes[name] = result = measure_route(client, headers, volumes, name, args.iterations, statements)
+        latency = result['latency_ms']
+        print(f"{name:18} {latency['p50']:8.2f} {latency['p95']:8.2f} {latency['p99']:8.2f} "
+              f"{result['queries']['median']:8g} {result['peak_memory_kib']:9.0f}")
+
+    baseline = {
+        'meta': {
+            'scale': args.scale, **volumes, 'lines_per_invoice': list(LINES_PER_INVOICE), 'rng_seed': RNG_SEED,
+            'iterations': args.iterations, 'commit': _git_commit(), 'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(),
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'), 'seed_seconds': seed_seconds,
+        },
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // (1024 if sys.platform == 'darwin' else 1),
+        'routes': routes,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(baseline, f, indent=2)
+        f.write('\n')
+    print(f"\nwrote {args.output}")
+    return 0
+
+
+def regressions(baseline, current, tolerance):
+    """(route, metric, baseline value, current value, regressed) for every compared number."""
+    rows = []
+    for name, before in baseline['routes'].items():
+        after = current['routes'].get(name)
+        if after is None:
+            continue
+        for percentile in ('p50', 'p95', 'p99'):
+            old, new = before['latency_ms'][percentile], after['latency_ms'][percentile]
+            # p99 of a few hundred requests is a handful of outliers: shown, not enforced
+            regressed = percentile != 'p99' and new > old * (1 + tolerance) and new - old > MIN_LATENCY_DELTA_MS
+            rows.append((name, f'{percentile} ms', old, new, regressed))
+        old, new = before['queries']['max'], after['queries']['max']
+        rows.append((name, 'queries', old, new, new > old))  # Deterministic, so any increase counts
+        old, new = before['peak_memory_kib'], after['peak_memory_kib']
+        rows.append((name, 'peak KiB', old, new, new > old * (1 + tolerance) and new - old > MIN_MEMORY_DELTA_KIB))
+    return rows
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    for key in ('scale', 'invoices', 'clients', 'rng_seed'):
+        if baseline['meta'].get(key) != current['meta'].get(key):
+            print(f"Not comparable: {key} is {baseline['meta'].get(key)} in the baseline, "
+                  f"{current['meta'].get(key)} now")
+            return 2
+    missing = set(baseline['routes']) - set(current['routes'])
+    if missing:
+        print(f"Not measured any more: {', '.join(sorted(missing))}")
+
+    failed = bool(missing)
+    print(f"{'':4}  {'route':18} {'metric':9} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, metric, old, new, regressed in regressions(baseline, current, args.tolerance):
+        failed = failed or regressed
+        change = f'{(new - old) / old * 100:+.0f}%' if old else ''
+        print(f"{'FAIL' if regressed else 'ok':4}  {name:18} {metric:9} {old:10.2f} {new:10.2f} {change:>8}")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='benchmark the routes and write a baseline')
+    run_parser.add_argument('--scale', choices=SCALES, default='small')
+    run_parser.add_argument('--iterations', type=int, default=200, help='timed requests per route')
+    run_parser.add_argument('--database', help='SQLite file to seed or reuse (default: a temporary file)')
+    run_parser.add_argument('--output', default='benchmark.json')
+    compare_parser = commands.add_parser('compare', help='check a run against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=0.3,
+                                help='allowed relative increase of latency and memory')
+    args = parser.parse_args(argv)
+    return run(args) if args.command == 'run' else compare(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Typeahead lookup of clients for the invoice form.
+
+Instead of listing every client, the form asks lookup() for the clients
+whose company name, first or last name or VAT number start with what was
+typed.  On SQLite these come from an FTS5 table of their own, client_lookup,
+with one document per client (rowid = client id).  The shared search_index
+would do, but a prefix like "serv" also matches every service line there,
+and skipping those takes seconds.  Like the search index, the table is kept
+current by triggers on client (see search.py for why a migration that
+batch-alters client must create them again).  Other databases use LIKE.
+"""
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from models import db, Client
+from search import match_expression
+
+TABLE = 'client_lookup'
+COLUMNS = ['company_name', 'first_name', 'last_name', 'vat_number']
+LIMIT = 10
+# Prefixes with more matches list them by client id: ranking them all (a
+# letter matches most clients) takes far longer than the user waits to type on
+RANK_LIMIT = 200
+
+
+def _insert_document(row):
+    return (f"INSERT INTO {TABLE} (rowid, {', '.join(COLUMNS)}) "
+            f"VALUES ({row}.id, {', '.join(f'{row}.{column}' for column in COLUMNS)})")
+
+
+def trigger_statements():
+    delete = f"DELETE FROM {TABLE} WHERE rowid = old.id"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {TABLE}_insert AFTER INSERT ON client BEGIN {_insert_document('new')}; END",
+        f"CREATE TRIGGER IF NOT EXISTS {TABLE}_update AFTER UPDATE OF {', '.join(COLUMNS)} ON client "
+        f"BEGIN {delete}; {_insert_document('new')}; END",
+        f"CREATE TRIGGER IF NOT EXISTS {TABLE}_delete AFTER DELETE ON client BEGIN {delete}; END",
+    ]
+
+
+def fill_statement():
+    return f"INSERT INTO {TABLE} (rowid, {', '.join(COLUMNS)}) SELECT id, {', '.join(COLUMNS)} FROM client"
+
+
+def create(connection):
+    """Create and fill the lookup table and its triggers (SQLite only)."""
+    # prefix: one to three letters are index lookups, as typed into the form
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5({', '.join(COLUMNS)}, "
+        f"tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3')")
+    # Default ranking: the company name first, the VAT number last
+    connection.exec_driver_sql(f"INSERT INTO {TABLE} ({TABLE}, rank) VALUES ('rank', 'bm25(10.0, 5.0, 5.0, 1.0)')")
+    for statement in [fill_statement()] + trigger_statements():
+        connection.exec_driver_sql(statement)
+
+
+def rebuild(connection=None):
+    conn = connection or db.session.connection()
+    conn.exec_driver_sql(f"DELETE FROM {TABLE}")
+    conn.exec_driver_sql(fill_statement())
+    conn.exec_driver_sql(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_table(metadata, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    if sa.inspect(connection).has_table(TABLE):
+        for statement in trigger_statements():
+            connection.exec_driver_sql(statement)
+    else:
+        create(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_table(metadata, connection, **kw):
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+def label(client):
+    """How a client is shown in the form: "Company - First Last"."""
+    return f"{client.company_name or ''} - {client.first_name or ''} {client.last_name or ''}"
+
+
+def lookup(query, limit=LIMIT):
+    """The best `limit` clients for `query` as typed so far.
+
+    Every word must match a word of the company name, first or last name or
+    VAT number; the last one may be incomplete.  Up to RANK_LIMIT matches
+    are ranked, the company name counting most.  Returns dicts with id,
+    label, currency and vat_percentage, which the form copies into the
+    invoice.
+    """
+    conn = db.session.connection()
+    if conn.dialect.name == 'sqlite':
+        match = match_expression(query, prefix=True)
+        if not match:
+            return []
+        many = conn.exec_driver_sql(f"SELECT 1 FROM {TABLE} WHERE {TABLE} MATCH ? LIMIT 1 OFFSET ?",
+                                    (match, RANK_LIMIT)).scalar()
+        rows = conn.exec_driver_sql(
+            f"SELECT client.id, client.company_name, client.first_name, client.last_name, client.currency, "
+            f"client.vat_percentage FROM {TABLE} JOIN client ON client.id = {TABLE}.rowid "
+            f"WHERE {TABLE} MATCH ? ORDER BY {'' if many else f'{TABLE}.rank, '}{TABLE}.rowid LIMIT ?",
+            (match, limit)).all()
+    else:
+        query = query.strip()
+        if not query:
+            return []
+        pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        rows = conn.execute(
+            sa.select(Client.id, Client.company_name, Client.first_name, Client.last_name, Client.currency,
+                      Client.vat_percentage)
+            .where(sa.or_(*[getattr(Client, column).ilike(pattern, escape='\\') for column in COLUMNS]))
+            .order_by(Client.company_name, Client.id).limit(limit)).all()
+    return [{'id': row.id, 'label': label(row), 'currency': row.currency, 'vat_percentage': row.vat_percentage}
+            for row in rows]
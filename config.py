@@ -0,0 +1,4 @@
+class Config:
+    SECRET_KEY = 'dev'
+    USERNAME = 'admin'
+    PASSWORD = 'admin'
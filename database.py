@@ -0,0 +1,82 @@
+"""Database engine profile: pool options and per-connection SQLite settings.
+
+The URI comes from the DATABASE_URL environment variable, then
+SQLALCHEMY_DATABASE_URI in config.py, then a local SQLite file.  For SQLite
+every new connection gets the pragmas below (WAL journal, busy timeout, ...)
+merged with SQLITE_PRAGMAS from config.py, and transactions are started
+explicitly: BEGIN (deferred) for reads, BEGIN IMMEDIATE for requests that
+write, so a writer waits for the lock up front instead of failing with
+"database is locked" when it upgrades a read transaction.  Other databases
+(e.g. PostgreSQL) only get the pool options.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import scoped_session
+
+DEFAULT_URI = 'sqlite:///invoicing.db'
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # Readers and the writer do not block each other
+    'synchronous': 'NORMAL',  # Safe with WAL; only the last commits can be lost on power failure
+    'foreign_keys': 'ON',
+    'busy_timeout': 5000,  # ms to wait for a lock before giving up
+    'cache_size': -32000,  # Negative: KiB of page cache per connection
+    'mmap_size': 268435456,  # Read the first 256 MiB of the file through memory mapping
+    'temp_store': 'MEMORY',
+}
+
+# One process serves a few threads; overflow covers bursts and the export streams
+POOL_OPTIONS = {'pool_size': 10, 'max_overflow': 20, 'pool_timeout': 30}
+SERVER_POOL_OPTIONS = {'pool_pre_ping': True, 'pool_recycle': 1800}
+
+
+def database_uri(environ, config):
+    return environ.get('DATABASE_URL') or config.get('SQLALCHEMY_DATABASE_URI') or DEFAULT_URI
+
+
+def _is_sqlite_memory(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(uri, overrides=None):
+    """Engine options for `uri`, updated with SQLALCHEMY_ENGINE_OPTIONS from the config."""
+    url = make_url(uri)
+    if _is_sqlite_memory(url):
+        options = {}  # Flask-SQLAlchemy shares the single in-memory connection
+    elif url.get_backend_name() == 'sqlite':
+        options = dict(POOL_OPTIONS)
+    else:
+        options = dict(POOL_OPTIONS, **SERVER_POOL_OPTIONS)
+    options.update(overrides or {})
+    return options
+
+
+def configure_engine(engine, pragmas=None):
+    """Install the SQLite connection settings on `engine`; a no-op for other databases."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = dict(SQLITE_PRAGMAS, **(pragmas or {}))
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # Let begin() below issue BEGIN instead of the sqlite3 module's implicit one
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin(conn):
+        conn.exec_driver_sql(f"BEGIN {conn.get_execution_options().get('sqlite_begin', 'DEFERRED')}")
+
+
+def begin_write(session):
+    """Start the session's next transaction with the write lock (BEGIN IMMEDIATE on SQLite).
+
+    Has no effect if the session is already in a transaction.
+    """
+    if isinstance(session, scoped_session):
+        session = session()
+    if not session.in_transaction():
+        session.connection(execution_options={'sqlite_begin': 'IMMEDIATE'})
@@ -0,0 +1,263 @@
+"""Queue for e-mailing invoices to their clients.
+
+Sending from a request would hold a web worker for the whole SMTP
+conversation, so the app only records a Delivery row (queue(): one
+INSERT ... SELECT, however many invoices) and the deliver-invoices command
+sends them in a process of its own.  work() loops over batches:
+
+1. claim() marks up to BATCH_SIZE due deliveries 'sending' in one short
+   write transaction and sets their next_attempt_at to the end of a LEASE.
+   A worker that dies leaves them 'sending'; once the lease has expired the
+   next claim takes them again (so a message can be sent twice, never lost).
+2. The caller's render() turns the batch into e-mails (the app renders the
+   PDFs in its process pool, see pdf.render_many()).
+3. THREADS threads send them, each over an SMTP connection of its own that
+   stays open from one message and batch to the next (SMTPPool).
+4. record() stores the outcomes in one transaction: sent, failed for good
+   (5xx answers, invoice gone) or queued again after a backoff that doubles
+   with every attempt, until MAX_ATTEMPTS.
+
+Deleting an invoice fails the deliveries still waiting for it (a flush hook),
+so the worker never sends an invoice that is gone.
+"""
+import logging
+import random
+import re
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import database
+from models import db, utcnow, Client, Delivery, Invoice
+
+FORMATS = ['pdf', 'html']
+QUEUED, SENDING, SENT, FAILED = 'queued', 'sending', 'sent', 'failed'
+STATUSES = [QUEUED, SENDING, SENT, FAILED]
+BATCH_SIZE = 100
+THREADS = 4  # SMTP connections; the conversation is mostly waiting for the server
+LEASE = timedelta(minutes=10)  # Longer than a batch takes to render and send
+MAX_ATTEMPTS = 5
+RETRY_SECONDS = 60  # Before the second attempt; doubles for every further one
+MAX_RETRY_SECONDS = 6 * 3600
+POLL_SECONDS = 5
+NICE = 10  # The worker yields the CPU to the web workers on the same machine
+deliveries = Delivery.__table__
+
+
+def queue(criteria, fmt='pdf', language=None, persona=None):
+    """Queue the invoices matching `criteria` (on Invoice) for their clients' e-mail addresses.
+
+    Invoices whose client has no e-mail, or that are already waiting to be
+    sent, are skipped.  Returns the number queued.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    now = utcnow()
+    pending = sa.select(Delivery.id).where(Delivery.invoice_id == Invoice.id, Delivery.status.in_([QUEUED, SENDING]))
+    rows = (
+        sa.select(Invoice.id, Client.email, sa.literal(fmt), sa.literal(language, sa.String),
+                  sa.literal(persona, sa.String), sa.literal(QUEUED), sa.literal(0), sa.literal(now), sa.literal(now))
+        .join(Client, Invoice.client_id == Client.id)
+        .where(*criteria, sa.func.trim(sa.func.coalesce(Client.email, '')) != '', ~pending.exists())
+        .order_by(Invoice.id)
+    )
+    result = db.session.execute(deliveries.insert().from_select(
+        ['invoice_id', 'recipient', 'format', 'language', 'persona', 'status', 'attempts', 'next_attempt_at',
+         'created_at'], rows))
+    return result.rowcount
+
+
+def claim(limit=BATCH_SIZE):
+    """Mark up to `limit` due deliveries as being sent and return them."""
+    database.begin_write(db.session)
+    now = utcnow()
+    due = (sa.select(deliveries.c.id)
+           .where(deliveries.c.status.in_([QUEUED, SENDING]), deliveries.c.next_attempt_at <= now)
+           .order_by(deliveries.c.next_attempt_at, deliveries.c.id).limit(limit)
+           .with_for_update(skip_locked=True))  # Several workers on PostgreSQL; SQLite has the write lock
+    rows = db.session.execute(
+        deliveries.update().where(deliveries.c.id.in_(due.scalar_subquery()))
+        .values(status=SENDING, attempts=deliveries.c.attempts + 1, next_attempt_at=now + LEASE)
+        .returning(deliveries.c.id, deliveries.c.invoice_id, deliveries.c.recipient, deliveries.c.format,
+                   deliveries.c.language, deliveries.c.persona, deliveries.c.attempts)).all()
+    db.session.commit()
+    return sorted(rows, key=lambda row: row.id)
+
+
+def retry_delay(attempts):
+    """Seconds until the next attempt after `attempts` failed ones, with some jitter."""
+    delay = min(RETRY_SECONDS * 2 ** (attempts - 1), MAX_RETRY_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def record(outcomes, max_attempts=MAX_ATTEMPTS):
+    """Store (delivery row, error or None, permanent) outcomes in one transaction."""
+    now = utcnow()
+    sent = [row.id for row, error, _ in outcomes if error is None]
+    retries, failures = [], []
+    for row, error, permanent in outcomes:
+        if error is None:
+            continue
+        message = str(error)[:500] or error.__class__.__name__
+        if permanent or row.attempts >= max_attempts:
+            failures.append({'_id': row.id, '_error': message})
+        else:
+            retries.append({'_id': row.id, '_error': message,
+                            '_next': now + timedelta(seconds=retry_delay(row.attempts))})
+    database.begin_write(db.session)
+    if sent:
+        db.session.execute(deliveries.update().where(deliveries.c.id.in_(sent))
+                           .values(status=SENT, sent_at=now, last_error=None))
+    by_id = deliveries.c.id == sa.bindparam('_id')
+    if retries:
+        db.session.execute(deliveries.update().where(by_id).values(
+            status=QUEUED, last_error=sa.bindparam('_error'), next_attempt_at=sa.bindparam('_next')), retries)
+    if failures:
+        db.session.execute(deliveries.update().where(by_id).values(status=FAILED, last_error=sa.bindparam('_error')),
+                           failures)
+    db.session.commit()
+    return len(sent), len(retries), len(failures)
+
+
+def status_counts():
+    return dict(db.session.execute(sa.select(Delivery.status, sa.func.count()).group_by(Delivery.status)).all())
+
+
+def fill(text, fields):
+    """Replace the {name} placeholders of a translated text; unknown ones are left as they are."""
+    return re.sub(r'\{(\w+)\}', lambda match: str(fields.get(match.group(1), match.group(0))), text)
+
+
+def build_message(sender, recipient, subject, text, html=None, attachment=None):
+    """An e-mail with a text body, an optional HTML alternative and an optional (filename, PDF bytes)."""
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = recipient
+    message['Subject'] = subject
+    message['Date'] = formatdate(localtime=True)
+    message['Message-ID'] = make_msgid()
+    message.set_content(text)
+    if html:
+        message.add_alternative(html, subtype='html')
+    if attachment:
+        filename, data = attachment
+        message.add_attachment(data, maintype='application', subtype='pdf', filename=filename)
+    return message
+
+
+class SMTPPool:
+    """One SMTP connection per sending thread, opened on first use and kept open."""
+
+    def __init__(self, host='localhost', port=25, username=None, password=None, starttls=False, timeout=30):
+        self.settings = dict(host=host, port=port, username=username, password=password, starttls=starttls)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.settings['host'], self.settings['port'], timeout=self.timeout)
+        if self.settings['starttls']:
+            connection.starttls()
+        if self.settings['username']:
+            connection.login(self.settings['username'], self.settings['password'])
+        with self._lock:
+            self._connections.append(connection)
+        return connection
+
+    def _discard(self, connection):
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+        try:
+            connection.close()
+        except OSError:
+            pass
+
+    def send(self, message):
+        """Send over this thread's connection; reconnects once if the server dropped it."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            try:
+                connection.send_message(message)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._discard(connection)
+        self._local.connection = None
+        self._local.connection = self._connect()
+        try:
+            self._local.connection.send_message(message)
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self._discard(self._local.connection)
+            self._local.connection = None
+            raise
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, OSError):
+                connection.close()
+
+
+def is_permanent(error):
+    """Whether sending again cannot help: the server answered with a 5xx code."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return False
+
+
+def _send(pool, row, message):
+    if isinstance(message, Exception):
+        return row, message, True  # Could not be rendered; a retry renders the same
+    try:
+        pool.send(message)
+    except (smtplib.SMTPException, OSError) as e:
+        logging.warning("Delivery %d of invoice %d to %s failed: %s", row.id, row.invoice_id, row.recipient, e)
+        return row, e, is_permanent(e)
+    return row, None, False
+
+
+def work(render, pool, batch_size=BATCH_SIZE, threads=THREADS, once=False, poll_seconds=POLL_SECONDS,
+         max_attempts=MAX_ATTEMPTS):
+    """Send queued deliveries batch by batch; with `once`, return when none is due.
+
+    render(rows) returns {delivery id: EmailMessage, or the exception that
+    prevented building it}.  Returns the (sent, retried, failed) totals.
+    """
+    totals = [0, 0, 0]
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while True:
+            rows = claim(batch_size)
+            if not rows:
+                if once:
+                    return tuple(totals)
+                time.sleep(poll_seconds)
+                continue
+            messages = render(rows)
+            missing = LookupError("Invoice not found")
+            outcomes = list(executor.map(lambda row: _send(pool, row, messages.get(row.id, missing)), rows))
+            counts = record(outcomes, max_attempts)
+            totals = [total + count for total, count in zip(totals, counts)]
+            logging.info("Deliveries: %d sent, %d to retry, %d failed", *counts)
+
+
+@event.listens_for(Session, 'after_flush')
+def _cancel_deliveries(session, flush_context):
+    invoice_ids = [obj.id for obj in session.deleted if isinstance(obj, Invoice)]
+    if invoice_ids:
+        pending = sa.and_(deliveries.c.invoice_id.in_(invoice_ids), deliveries.c.status.in_([QUEUED, SENDING]))
+        session.connection().execute(
+            deliveries.update().where(pending).values(status=FAILED, last_error="Invoice deleted"))
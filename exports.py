@@ -0,0 +1,216 @@
+"""Streaming CSV/XLSX export of invoices joined with clients and service lines.
+
+One row per service line (invoices without lines get a single row with empty
+line columns).  Rows are fetched in batches with yield_per, so memory use does
+not depend on the size of the export, and the first bytes go out before the
+query has finished.  Archived invoices (see archive.py) are included.
+"""
+import csv
+import heapq
+import io
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+import archive
+from models import db, Client, Invoice, InvoiceService
+from streaming import iter_zip
+
+BATCH_SIZE = 1000
+
+# (header, table, column), in output order; see export_queries()
+EXPORT_COLUMNS = [
+    ('invoice_id', 'invoice', 'invoice_id'),
+    ('invoice_number', 'invoice', 'invoice_number'),
+    ('invoice_date', 'invoice', 'invoice_date'),
+    ('due_date', 'invoice', 'due_date'),
+    ('state', 'invoice', 'state'),
+    ('currency', 'invoice', 'currency'),
+    ('client_id', 'client', 'id'),
+    ('client_company', 'client', 'company_name'),
+    ('client_first_name', 'client', 'first_name'),
+    ('client_last_name', 'client', 'last_name'),
+    ('client_vat_number', 'client', 'vat_number'),
+    ('client_country', 'client', 'country'),
+    ('service', 'service', 'service'),
+    ('unit_cost', 'service', 'unit_cost'),
+    ('quantity', 'service', 'quantity'),
+    ('line_total', 'service', 'line_total'),
+    ('subtotal', 'invoice', 'subtotal'),
+    ('discount_percent', 'invoice', 'discount'),
+    ('discount_amount', 'invoice', 'discount_amount'),
+    ('vat_percent', 'invoice', 'vat_percentage'),
+    ('vat_amount', 'invoice', 'vat_amount'),
+    ('total', 'invoice', 'total'),
+]
+HEADERS = [header for header, _, _ in EXPORT_COLUMNS]
+_DATE = HEADERS.index('invoice_date')
+
+
+def parse_filters(args):
+    """Export filters from request args or CLI options; raises ValueError on bad dates."""
+    def parse_date(value):
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+    return {
+        'date_from': parse_date(args.get('date_from')),
+        'date_to': parse_date(args.get('date_to')),
+        'state': args.get('state') or None,
+        'client_id': int(args['client_id']) if args.get('client_id') else None,
+        'currency': args.get('currency') or None,
+    }
+
+
+def _export_query(invoice, service, date_from=None, date_to=None, state=None, client_id=None, currency=None):
+    tables = {'invoice': invoice, 'client': Client.__table__, 'service': service}
+    query = (
+        # The ids after the export columns order the rows of both queries the same way
+        db.select(*[tables[table].c[column] for _, table, column in EXPORT_COLUMNS], invoice.c.id, service.c.id)
+        .select_from(invoice)
+        .join(Client, invoice.c.client_id == Client.id)
+        .outerjoin(service, service.c.invoice_id == invoice.c.id)
+    )
+    if date_from:
+        query = query.where(invoice.c.invoice_date >= date_from)
+    if date_to:
+        query = query.where(invoice.c.invoice_date <= date_to)
+    if state:
+        query = query.where(invoice.c.state == state)
+    if client_id:
+        query = query.where(invoice.c.client_id == client_id)
+    if currency:
+        query = query.where(invoice.c.currency == currency)
+    return query.order_by(invoice.c.invoice_date, invoice.c.id, service.c.id)
+
+
+def export_queries(**filters):
+    """The export of the live invoices and, if there is an archive, of the archived ones."""
+    queries = [_export_query(Invoice.__table__, InvoiceService.__table__, **filters)]
+    if archive.enabled():
+        queries.append(_export_query(archive.invoice_table, archive.service_table, **filters).where(archive.not_live()))
+    return queries
+
+
+def _sort_key(row):
+    return row[_DATE], row[-2], row[-1] or 0
+
+
+def iter_rows(filters):
+    """Yield result rows batch by batch through server-side cursors.
+
+    The rows of the live and the archived invoices are merged by invoice
+    date as they arrive; neither result is sorted or held as a whole.
+    """
+    def rows(query):
+        result = db.session.execute(query.execution_options(yield_per=BATCH_SIZE))
+        for partition in result.partitions():
+            yield from partition
+
+    for row in heapq.merge(*[rows(query) for query in export_queries(**filters)], key=_sort_key):
+        yield row[:len(HEADERS)]
+
+
+def iter_csv(filters):
+    """Yield the export as UTF-8 CSV, one chunk per batch of rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(HEADERS)
+    yield drain()
+    for count, row in enumerate(iter_rows(filters), 1):
+        writer.writerow(['' if value is None else value for value in row])
+        if count % BATCH_SIZE == 0:
+            yield drain()
+    yield drain()
+
+
+# Minimal SpreadsheetML package: one worksheet with inline strings and a date style
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Invoices" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+_EXCEL_EPOCH = date(1899, 12, 30)
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, date):
+        return f'<c s="1"><v>{(value - _EXCEL_EPOCH).days}</v></c>'
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def _iter_sheet(filters):
+    yield ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+           '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>').encode('utf-8')
+    yield ('<row>' + ''.join(_xlsx_cell(header) for header in HEADERS) + '</row>').encode('utf-8')
+    chunk = []
+    for row in iter_rows(filters):
+        chunk.append('<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>')
+        if len(chunk) >= BATCH_SIZE:
+            yield ''.join(chunk).encode('utf-8')
+            chunk = []
+    chunk.append('</sheetData></worksheet>')
+    yield ''.join(chunk).encode('utf-8')
+
+
+def iter_xlsx(filters):
+    """Yield the export as an .xlsx workbook, streaming the worksheet."""
+    entries = [(name, content.encode('utf-8')) for name, content in _XLSX_PARTS.items()]
+    entries.append(('xl/worksheets/sheet1.xml', _iter_sheet(filters)))
+    return iter_zip(entries)
+
+
+FORMATS = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (iter_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
@@ -0,0 +1,20 @@
+"""gunicorn settings: gunicorn -c gunicorn.conf.py wsgi:app
+
+BIND and WEB_CONCURRENCY override the address and the number of workers.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '127.0.0.1:8080')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+preload_app = True  # Load the app once in the master, see wsgi.py
+timeout = 120  # The PDF exports stream for a while
+
+
+def post_fork(server, worker):
+    # The master has not opened any connection, but a worker must never reuse one
+    # inherited from it: start every worker with an empty pool
+    from models import db
+    from wsgi import app
+    with app.app_context():
+        db.engine.dispose(close=False)
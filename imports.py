@@ -0,0 +1,166 @@
+"""Bulk import of invoices and their service lines from CSV or JSON.
+
+Rows are validated with the same rules as the invoice form
+(validation.clean_invoice) and written in chunks: one multi-row INSERT for
+the invoices and one for their service lines, committed as a single
+transaction per chunk.  Invalid rows are reported and skipped; they never
+abort the rest of the run.
+
+CSV files have one row per service line, with the invoice columns repeated
+on every line of the invoice; consecutive rows with the same invoice_id
+belong to the same invoice.  JSON files hold a list of invoice objects,
+each with a "services" list.
+"""
+import csv
+import io
+import json
+import logging
+import time
+from itertools import groupby, islice
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import aging
+import archive
+import database
+from models import db, utcnow, Invoice, InvoiceService
+from pricing import compute_totals, line_total
+import reports
+from validation import ValidationError, clean_invoice
+
+CHUNK_SIZE = 2000
+LINE_FIELDS = ('service', 'unit_cost', 'quantity')
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.errors = []  # (row reference, message)
+        self.seconds = 0.0
+
+    def error(self, ref, message):
+        self.errors.append((ref, message))
+
+    def as_dict(self):
+        return {
+            'imported': self.imported,
+            'failed': len(self.errors),
+            'seconds': round(self.seconds, 3),
+            'errors': [{'row': ref, 'error': message} for ref, message in self.errors],
+        }
+
+
+def read_csv(stream):
+    """Yield (row reference, invoice data, lines) from a CSV text stream."""
+    reader = csv.DictReader(stream)
+    numbered = enumerate(reader, start=2)  # Row 1 is the header
+    for invoice_id, rows in groupby(numbered, key=lambda item: item[1].get('invoice_id')):
+        rows = list(rows)
+        first_row_number, data = rows[0]
+        lines = [{field: row.get(field) for field in LINE_FIELDS}
+                 for _, row in rows if any(row.get(field) for field in LINE_FIELDS)]
+        yield f"line {first_row_number}", data, lines
+
+
+def read_json(stream):
+    """Yield (row reference, invoice data, lines) from a JSON list of invoices."""
+    records = json.load(stream)
+    if not isinstance(records, list):
+        raise ValueError("The JSON file must contain a list of invoices.")
+    for index, record in enumerate(records):
+        if not isinstance(record, dict):
+            yield f"item {index}", {}, []
+            continue
+        yield f"item {index}", record, record.get('services') or []
+
+
+READERS = {'csv': read_csv, 'json': read_json}
+
+
+def open_text(binary_stream):
+    return io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _insert_chunk(rows, report):
+    """Insert one chunk of cleaned (ref, fields, lines) in a single transaction."""
+    invoice_rows, line_groups = [], []
+    now = utcnow()
+    for _, fields, lines in rows:
+        line_rows = [dict(line, line_total=line_total(line['unit_cost'], line['quantity'])) for line in lines]
+        totals = compute_totals([line['line_total'] for line in line_rows],
+                                fields['discount'], fields['apply_vat'], fields['vat_percentage'])
+        invoice_rows.append(dict(fields, updated_at=now, **totals._asdict()))
+        line_groups.append(line_rows)
+
+    try:
+        ids = db.session.scalars(
+            db.insert(Invoice).returning(Invoice.id, sort_by_parameter_order=True),
+            invoice_rows,
+        ).all()
+        service_rows = [dict(line, invoice_id=invoice_id)
+                        for invoice_id, line_rows in zip(ids, line_groups) for line in line_rows]
+        if service_rows:
+            db.session.execute(db.insert(InvoiceService), service_rows)
+        reports.add(invoice_rows)  # Bulk inserts bypass the flush hooks of the report summary
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logging.error(f"Import chunk failed: {e}")
+        for ref, _, _ in rows:
+            report.error(ref, f"Not imported, the batch failed: {e.__class__.__name__}")
+        return
+    report.imported += len(rows)
+
+
+def import_invoices(records, chunk_size=CHUNK_SIZE):
+    """Validate and insert (row reference, data, lines) records; returns an ImportReport."""
+    report = ImportReport()
+    started = time.perf_counter()
+    seen_invoice_ids = set()
+
+    for chunk in _chunks(records, chunk_size):
+        # Each chunk reads, then inserts: take the write lock before the reads
+        database.begin_write(db.session)
+        client_days = aging.payment_days()  # {client id: net days}, for the due dates not given
+        cleaned = []
+        for ref, data, lines in chunk:
+            try:
+                fields, lines = clean_invoice(data, lines)
+            except ValidationError as e:
+                report.error(ref, str(e))
+                continue
+            if fields['client_id'] not in client_days:
+                report.error(ref, f"Unknown client {fields['client_id']}.")
+            elif fields['invoice_id'] in seen_invoice_ids:
+                report.error(ref, f"Duplicate invoice_id {fields['invoice_id']} in the file.")
+            else:
+                seen_invoice_ids.add(fields['invoice_id'])
+                if fields['due_date'] is None:
+                    fields['due_date'] = aging.due_date(fields['invoice_date'], client_days[fields['client_id']])
+                cleaned.append((ref, fields, lines))
+
+        # invoice_id is unique; report clashes with existing invoices instead of failing the chunk.
+        # Archived invoices keep theirs, so an imported invoice must not reuse one either
+        invoice_ids = [fields['invoice_id'] for _, fields, _ in cleaned]
+        existing = set(db.session.scalars(db.select(Invoice.invoice_id).where(Invoice.invoice_id.in_(invoice_ids))))
+        if archive.enabled():
+            existing.update(db.session.scalars(db.select(archive.invoice_table.c.invoice_id).where(
+                archive.invoice_table.c.invoice_id.in_(invoice_ids))))
+        rows = []
+        for ref, fields, lines in cleaned:
+            if fields['invoice_id'] in existing:
+                report.error(ref, f"Invoice {fields['invoice_id']} already exists.")
+            else:
+                rows.append((ref, fields, lines))
+        if rows:
+            _insert_chunk(rows, report)
+
+    report.seconds = time.perf_counter() - started
+    logging.info(f"Imported {report.imported} invoices in {report.seconds:.1f}s, {len(report.errors)} rows failed")
+    return report
@@ -0,0 +1,52 @@
+"""Apply edited service lines to an invoice with as few writes as possible.
+
+The forms and the API used to replace every service line on save, which
+deleted and re-inserted all rows even when one quantity changed.
+sync_services() instead matches the submitted lines to the existing rows and
+lets the unit of work write only the difference: an UPDATE per changed line,
+an INSERT per added line and a DELETE per removed one.  Unchanged lines are
+not written at all.
+"""
+from models import InvoiceService
+from pricing import quantize
+from validation import ValidationError
+
+
+def _line_id(value):
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValidationError("Invalid service line.")
+
+
+def sync_services(invoice, lines, line_ids=None):
+    """Make invoice.services match `lines`, the cleaned lines from clean_invoice().
+
+    `line_ids` gives the id of the existing service row each line was loaded
+    from (None for new lines).  Lines without an id reuse the rows nobody
+    claimed, in order, before new rows are added; rows left over are deleted.
+    """
+    line_ids = [_line_id(value) for value in (line_ids or [None] * len(lines))]
+    existing = {service.id: service for service in invoice.services}
+    claimed = [line_id for line_id in line_ids if line_id is not None]
+    if len(set(claimed)) != len(claimed) or not set(claimed) <= existing.keys():
+        raise ValidationError("Unknown or duplicate service line.")
+
+    spare = [service for service in invoice.services if service.id not in claimed]
+    services = []
+    for line, line_id in zip(lines, line_ids):
+        if line_id is not None:
+            service = existing[line_id]
+        elif spare:
+            service = spare.pop(0)
+        else:
+            service = InvoiceService()
+        # Same types as the loaded values, so unchanged columns are not part of the UPDATE
+        service.service = line['service']
+        service.unit_cost = quantize(line['unit_cost'])
+        service.quantity = line['quantity']
+        services.append(service)
+    invoice.services = services  # The rows left in `spare` are deleted (delete-orphan)
+    return invoice.services
@@ -0,0 +1,206 @@
+"""Per-request performance metrics in the Prometheus text format.
+
+init_app() hooks into Flask to record, per route: request latency, the
+number of SQL statements and the time spent in them (from SQLAlchemy engine
+events), template render time and response size.  render() formats them
+for the /metrics endpoint.  Streamed responses (exports) are measured until
+the last chunk is sent.
+
+Requests slower than SLOW_REQUEST_SECONDS (config, default 1s; None turns
+it off) are logged with their SQL, grouped by statement.  A statement run
+hundreds of times is usually an N+1 query.
+
+The numbers are kept in memory per process.  With several worker
+processes, each one reports its own; Prometheus adds them up.
+"""
+import logging
+import threading
+import time
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+SLOW_REQUEST_SECONDS = 1.0
+MAX_LOGGED_STATEMENTS = 20  # Distinct statements listed per slow request
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _labels(names, values):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames):
+        self.name, self.help, self.labelnames = name, help_text, labelnames
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self._values.items()):
+            yield f'{self.name}{{{_labels(self.labelnames, labels)}}} {value}'
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames, buckets):
+        self.name, self.help, self.labelnames, self.buckets = name, help_text, labelnames, buckets
+        self._series = {}  # labels -> [count per bucket..., sum, count]
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, series in sorted(self._series.items()):
+            label_text = _labels(self.labelnames, labels)
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket{{{label_text},le="{bound}"}} {count}'
+            yield f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-1]}'
+            yield f'{self.name}_sum{{{label_text}}} {series[-2]:.6f}'
+            yield f'{self.name}_count{{{label_text}}} {series[-1]}'
+
+
+_lock = threading.Lock()
+requests_total = Counter('http_requests_total', 'Requests by route, method and status.',
+                         ('route', 'method', 'status'))
+slow_requests_total = Counter('http_slow_requests_total', 'Requests slower than SLOW_REQUEST_SECONDS.',
+                              ('route', 'method'))
+request_seconds = Histogram('http_request_duration_seconds', 'Time to serve a request, streaming included.',
+                            ('route', 'method'), SECONDS_BUCKETS)
+response_bytes = Histogram('http_response_size_bytes', 'Response body size (streamed responses excluded).',
+                           ('route', 'method'), BYTES_BUCKETS)
+sql_statements = Histogram('db_statements_per_request', 'SQL statements executed per request.',
+                           ('route', 'method'), COUNT_BUCKETS)
+sql_seconds = Histogram('db_duration_seconds_per_request', 'Time spent in SQL statements per request.',
+                        ('route', 'method'), SECONDS_BUCKETS)
+render_seconds = Histogram('template_render_duration_seconds_per_request', 'Time spent rendering templates per request.',
+                           ('route', 'method'), SECONDS_BUCKETS)
+METRICS = [requests_total, slow_requests_total, request_seconds, response_bytes, sql_statements, sql_seconds,
+           render_seconds]
+
+
+class RequestStats:
+    """What one request did so far; kept on flask.g."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements = {}  # statement -> [count, seconds], for the slow request log
+        self.render_seconds = 0.0
+        self.render_started = []
+        self.status = 500  # Unless after_request sees a response
+        self.size = None
+
+
+def _stats():
+    return getattr(g, '_request_stats', None) if has_request_context() else None
+
+
+def instrument_engine(engine):
+    """Count and time the statements of `engine` for the current request."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['statement_started'].pop()
+        stats = _stats()
+        if stats is None:
+            return  # CLI commands and other work outside a request
+        stats.sql_count += 1
+        stats.sql_seconds += elapsed
+        totals = stats.statements.setdefault(statement, [0, 0.0])
+        totals[0] += 1
+        totals[1] += elapsed
+
+
+def _route():
+    # The URL rule, not the URL, so /edit_invoice/1 and /edit_invoice/2 are one series
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _log_slow_request(route, elapsed, stats):
+    statements = sorted(stats.statements.items(), key=lambda item: item[1][1], reverse=True)
+    lines = [f"  {count}x {seconds * 1000:.1f} ms  {' '.join(statement.split())[:300]}"
+             for statement, (count, seconds) in statements[:MAX_LOGGED_STATEMENTS]]
+    logging.warning(
+        f"Slow request {request.method} {request.full_path.rstrip('?')} ({route}): {elapsed * 1000:.0f} ms, "
+        f"{stats.sql_count} SQL statements in {stats.sql_seconds * 1000:.0f} ms, "
+        f"templates {stats.render_seconds * 1000:.0f} ms\n" + '\n'.join(lines))
+
+
+def init_app(app):
+    """Record the metrics of every request served by `app`."""
+
+    @app.before_request
+    def start_request_stats():
+        g._request_stats = RequestStats()
+
+    @app.after_request
+    def record_response(response):
+        stats = _stats()
+        if stats is not None:
+            stats.status = response.status_code
+            stats.size = None if response.is_streamed else response.calculate_content_length()
+        return response
+
+    @app.teardown_request
+    def record_request_stats(exc):
+        # Runs after a streamed response has been sent completely
+        stats = g.pop('_request_stats', None)
+        if stats is None:
+            return
+        elapsed = time.perf_counter() - stats.started
+        route, method = _route(), request.method
+        threshold = app.config.get('SLOW_REQUEST_SECONDS', SLOW_REQUEST_SECONDS)
+        slow = threshold is not None and elapsed > threshold
+        with _lock:
+            requests_total.inc(route, method, stats.status)
+            request_seconds.observe(elapsed, route, method)
+            sql_statements.observe(stats.sql_count, route, method)
+            sql_seconds.observe(stats.sql_seconds, route, method)
+            render_seconds.observe(stats.render_seconds, route, method)
+            if stats.size is not None:
+                response_bytes.observe(stats.size, route, method)
+            if slow:
+                slow_requests_total.inc(route, method)
+        if slow:
+            _log_slow_request(route, elapsed, stats)
+
+    @before_render_template.connect_via(app)
+    def start_render(sender, template, context, **extra):
+        stats = _stats()
+        if stats is not None:
+            stats.render_started.append(time.perf_counter())
+
+    @template_rendered.connect_via(app)
+    def end_render(sender, template, context, **extra):
+        stats = _stats()
+        if stats is not None and stats.render_started:
+            stats.render_seconds += time.perf_counter() - stats.render_started.pop()
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    return '\n'.join(lines) + '\n'
@@ -72,6 +72,12 @@ def run_migrations_offline():
         context.run_migrations()
 
 
+def include_name(name, type_, parent_names):
+    # The FTS5 search index and client lookup (see search.py, client_lookup.py) and
+    # their shadow tables are not models; without this autogenerate would emit drop_table for them
+    return not (type_ == 'table' and name.startswith(('search_index', 'client_lookup')))
+
+
 def run_migrations_online():
     """Run migrations in 'online' mode.
 
@@ -93,10 +99,16 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_name") is None:
+        conf_args["include_name"] = include_name
 
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        if connection.dialect.name == 'sqlite':
+            # Batch migrations recreate tables, which foreign key enforcement
+            # would turn into cascading deletes; only settable outside a transaction
+            connection.connection.driver_connection.execute('PRAGMA foreign_keys=OFF')
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
@@ -0,0 +1,48 @@
+"""Add client lookup table for the invoice form
+
+Revision ID: 00469b13f4f4
+Revises: 2c0e81567736
+Create Date: 2026-10-18 09:46:37.623904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '00469b13f4f4'
+down_revision = '2c0e81567736'
+branch_labels = None
+depends_on = None
+
+
+# The lookup as defined by client_lookup.py at this revision (SQLite only)
+COLUMNS = ['company_name', 'first_name', 'last_name', 'vat_number']
+
+
+def _insert(row):
+    return (f"INSERT INTO client_lookup (rowid, {', '.join(COLUMNS)}) "
+            f"VALUES ({row}.id, {', '.join(f'{row}.{column}' for column in COLUMNS)})")
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return  # client_lookup.py falls back to LIKE queries
+    op.execute(f"CREATE VIRTUAL TABLE client_lookup USING fts5({', '.join(COLUMNS)}, "
+               f"tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3')")
+    op.execute("INSERT INTO client_lookup (client_lookup, rank) VALUES ('rank', 'bm25(10.0, 5.0, 5.0, 1.0)')")
+    op.execute(f"INSERT INTO client_lookup (rowid, {', '.join(COLUMNS)}) SELECT id, {', '.join(COLUMNS)} FROM client")
+
+    delete = "DELETE FROM client_lookup WHERE rowid = old.id"
+    op.execute(f"CREATE TRIGGER client_lookup_insert AFTER INSERT ON client BEGIN {_insert('new')}; END")
+    op.execute(f"CREATE TRIGGER client_lookup_update AFTER UPDATE OF {', '.join(COLUMNS)} ON client "
+               f"BEGIN {delete}; {_insert('new')}; END")
+    op.execute(f"CREATE TRIGGER client_lookup_delete AFTER DELETE ON client BEGIN {delete}; END")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for event in ('insert', 'update', 'delete'):
+        op.execute(f"DROP TRIGGER IF EXISTS client_lookup_{event}")
+    op.execute("DROP TABLE IF EXISTS client_lookup")
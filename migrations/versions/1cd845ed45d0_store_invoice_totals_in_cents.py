@@ -0,0 +1,75 @@
+"""Store invoice totals in cents
+
+Revision ID: 1cd845ed45d0
+Revises: 03cfd0cb83b5
+Create Date: 2026-10-18 08:33:43.389922
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1cd845ed45d0'
+down_revision = '03cfd0cb83b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Amounts become integer cents (pricing.Money); convert before changing the type
+    op.execute("UPDATE invoice_service SET unit_cost = ROUND(unit_cost * 100)")
+    # From the rounded unit cost, as pricing.line_total() computes it
+    op.execute("UPDATE invoice_service SET line_total = COALESCE(unit_cost, 0) * COALESCE(quantity, 0)")
+    op.execute("UPDATE invoice SET total = ROUND(total * 100)")
+
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('subtotal', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('discount_amount', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('vat_amount', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.alter_column('total',
+               existing_type=sa.FLOAT(),
+               type_=sa.Integer(),
+               existing_nullable=False)
+
+    with op.batch_alter_table('invoice_service', schema=None) as batch_op:
+        batch_op.alter_column('unit_cost',
+               existing_type=sa.FLOAT(),
+               type_=sa.Integer(),
+               existing_nullable=True)
+        batch_op.alter_column('line_total',
+               existing_type=sa.FLOAT(),
+               type_=sa.Integer(),
+               existing_nullable=True)
+
+    # Recompute the stored totals from the service lines, as pricing.compute_totals() does
+    op.execute("UPDATE invoice SET subtotal = COALESCE((SELECT SUM(line_total) FROM invoice_service "
+               "WHERE invoice_service.invoice_id = invoice.id), 0)")
+    op.execute("UPDATE invoice SET discount_amount = ROUND(subtotal * COALESCE(discount, 0) / 100.0)")
+    op.execute("UPDATE invoice SET vat_amount = CASE WHEN apply_vat THEN "
+               "ROUND((subtotal - discount_amount) * COALESCE(vat_percentage, 0) / 100.0) ELSE 0 END")
+    op.execute("UPDATE invoice SET total = subtotal - discount_amount + vat_amount")
+
+
+def downgrade():
+    with op.batch_alter_table('invoice_service', schema=None) as batch_op:
+        batch_op.alter_column('line_total',
+               existing_type=sa.Integer(),
+               type_=sa.FLOAT(),
+               existing_nullable=True)
+        batch_op.alter_column('unit_cost',
+               existing_type=sa.Integer(),
+               type_=sa.FLOAT(),
+               existing_nullable=True)
+
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.alter_column('total',
+               existing_type=sa.Integer(),
+               type_=sa.FLOAT(),
+               existing_nullable=False)
+        batch_op.drop_column('vat_amount')
+        batch_op.drop_column('discount_amount')
+        batch_op.drop_column('subtotal')
+
+    op.execute("UPDATE invoice_service SET unit_cost = unit_cost / 100.0, line_total = line_total / 100.0")
+    op.execute("UPDATE invoice SET total = total / 100.0")
@@ -0,0 +1,74 @@
+"""Create the client, invoice and invoice_service tables
+
+Revision ID: 5b2dd4566b37
+Revises: 
+Create Date: 2026-10-18 09:40:12.318604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2dd4566b37'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The tables as they were before the first migration.  Databases created
+    # that older versions of app.py created with db.create_all() already have them
+    if sa.inspect(op.get_bind()).has_table('client'):
+        return
+
+    op.create_table('client',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('company_name', sa.String(length=100), nullable=True),
+    sa.Column('vat_number', sa.String(length=50), nullable=True),
+    sa.Column('vat_percentage', sa.Float(), nullable=True),
+    sa.Column('street', sa.String(length=200), nullable=True),
+    sa.Column('city', sa.String(length=100), nullable=True),
+    sa.Column('state', sa.String(length=100), nullable=True),
+    sa.Column('postal_code', sa.String(length=20), nullable=True),
+    sa.Column('country', sa.String(length=100), nullable=True),
+    sa.Column('first_name', sa.String(length=100), nullable=True),
+    sa.Column('last_name', sa.String(length=100), nullable=True),
+    sa.Column('email', sa.String(length=100), nullable=True),
+    sa.Column('phone', sa.String(length=20), nullable=True),
+    sa.Column('currency', sa.String(length=10), nullable=True),
+    sa.Column('language', sa.String(length=10), nullable=True),
+    sa.Column('payment_terms', sa.String(length=100), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('invoice',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('invoice_id', sa.String(length=50), nullable=False),
+    sa.Column('invoice_number', sa.String(length=50), nullable=False),
+    sa.Column('invoice_date', sa.Date(), nullable=False),
+    sa.Column('client_id', sa.Integer(), nullable=False),
+    sa.Column('total', sa.Float(), nullable=False),
+    sa.Column('state', sa.String(length=20), nullable=False),
+    sa.Column('apply_vat', sa.Boolean(), nullable=True),
+    sa.Column('vat_percentage', sa.Float(), nullable=True),
+    sa.Column('currency', sa.String(length=10), nullable=True),
+    sa.ForeignKeyConstraint(['client_id'], ['client.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('invoice_id')
+    )
+    op.create_table('invoice_service',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('invoice_id', sa.Integer(), nullable=False),
+    sa.Column('service', sa.String(length=100), nullable=True),
+    sa.Column('unit_cost', sa.Float(), nullable=True),
+    sa.Column('quantity', sa.Integer(), nullable=True),
+    sa.Column('line_total', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['invoice_id'], ['invoice.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('invoice_service')
+    op.drop_table('invoice')
+    op.drop_table('client')
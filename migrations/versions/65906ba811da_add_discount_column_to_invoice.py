@@ -1,7 +1,7 @@
 """Add discount column to invoice
 
 Revision ID: 65906ba811da
-Revises: 
+Revises: 5b2dd4566b37
 Create Date: 2024-10-31 11:03:57.021519
 
 """
@@ -11,7 +11,7 @@ import sqlalchemy as sa
 
 # revision identifiers, used by Alembic.
 revision = '65906ba811da'
-down_revision = None
+down_revision = '5b2dd4566b37'
 branch_labels = None
 depends_on = None
 
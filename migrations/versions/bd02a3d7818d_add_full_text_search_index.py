@@ -0,0 +1,70 @@
+"""Add full-text search index
+
+Revision ID: bd02a3d7818d
+Revises: e27c92c9fe6a
+Create Date: 2026-10-18 09:14:03.414046
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bd02a3d7818d'
+down_revision = 'e27c92c9fe6a'
+branch_labels = None
+depends_on = None
+
+
+# The documents as defined by search.py at this revision (SQLite only):
+# kind -> (table, rowid offset, title columns, body columns)
+DOCUMENTS = {
+    'client': ('client', 1, ['company_name', 'first_name', 'last_name'],
+               ['vat_number', 'email', 'phone', 'street', 'postal_code', 'city', 'state', 'country']),
+    'invoice': ('invoice', 2, ['invoice_number', 'invoice_id'], []),
+    'service': ('invoice_service', 3, ['service'], []),
+}
+
+
+def _text(row, columns):
+    return " || ' ' || ".join(f"coalesce({row}.{column}, '')" for column in columns) or "''"
+
+
+def _insert(kind, row):
+    table, offset, title, body = DOCUMENTS[kind]
+    return (f"INSERT INTO search_index (rowid, kind, title, body) "
+            f"VALUES ({row}.id * 4 + {offset}, '{kind}', {_text(row, title)}, {_text(row, body)})")
+
+
+def _delete(kind, row):
+    return f"DELETE FROM search_index WHERE rowid = {row}.id * 4 + {DOCUMENTS[kind][1]}"
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return  # search.py falls back to LIKE queries
+    # app.py runs db.create_all() on import, which already creates (and fills) the index
+    if not sa.inspect(op.get_bind()).has_table('search_index'):
+        op.execute("CREATE VIRTUAL TABLE search_index USING fts5(kind UNINDEXED, title, body, "
+                   "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+        op.execute("INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(0.0, 10.0, 1.0)')")
+        for kind, (table, offset, title, body) in DOCUMENTS.items():
+            op.execute(f"INSERT INTO search_index (rowid, kind, title, body) "
+                       f"SELECT id * 4 + {offset}, '{kind}', {_text(table, title)}, {_text(table, body)} FROM {table}")
+
+    for kind, (table, _, title, body) in DOCUMENTS.items():
+        op.execute(f"CREATE TRIGGER IF NOT EXISTS search_index_{kind}_insert AFTER INSERT ON {table} "
+                   f"BEGIN {_insert(kind, 'new')}; END")
+        op.execute(f"CREATE TRIGGER IF NOT EXISTS search_index_{kind}_update AFTER UPDATE OF "
+                   f"{', '.join(title + body)} ON {table} BEGIN {_delete(kind, 'old')}; {_insert(kind, 'new')}; END")
+        op.execute(f"CREATE TRIGGER IF NOT EXISTS search_index_{kind}_delete AFTER DELETE ON {table} "
+                   f"BEGIN {_delete(kind, 'old')}; END")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    for kind in DOCUMENTS:
+        for event in ('insert', 'update', 'delete'):
+            op.execute(f"DROP TRIGGER IF EXISTS search_index_{kind}_{event}")
+    op.execute("DROP TABLE IF EXISTS search_index")
@@ -0,0 +1,50 @@
+"""Never reuse invoice ids
+
+Revision ID: d6bd908360c1
+Revises: aebaf46f8953
+Create Date: 2026-10-18 14:05:31.208417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6bd908360c1'
+down_revision = 'aebaf46f8953'
+branch_labels = None
+depends_on = None
+
+
+def _recreate_invoice_table(autoincrement):
+    # AUTOINCREMENT is part of CREATE TABLE, so SQLite needs a new table; the
+    # triggers on it (search index) go with the old one and are created again
+    conn = op.get_bind()
+    triggers = conn.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'invoice'").scalars().all()
+    with op.batch_alter_table('invoice', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': autoincrement}) as batch_op:
+        pass
+    for sql in triggers:
+        op.execute(sql)
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return  # Sequences never hand out an id twice
+    _recreate_invoice_table(True)
+    # The copied rows set the counter to max(id); the ids in an attached
+    # archive (archive.py) may be higher if the newest invoices were deleted
+    conn = op.get_bind()
+    databases = [row[1] for row in conn.exec_driver_sql("PRAGMA database_list")]
+    if 'archive' in databases and sa.inspect(conn).has_table('invoice', schema='archive'):
+        op.execute("INSERT INTO main.sqlite_sequence (name, seq) SELECT 'invoice', 0 "
+                   "WHERE NOT EXISTS (SELECT 1 FROM main.sqlite_sequence WHERE name = 'invoice')")
+        op.execute("UPDATE main.sqlite_sequence SET seq = (SELECT max(id) FROM archive.invoice) "
+                   "WHERE name = 'invoice' AND seq < (SELECT max(id) FROM archive.invoice)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    _recreate_invoice_table(False)
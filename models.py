@@ -0,0 +1,165 @@
+# models.py
+from datetime import datetime
+from flask_sqlalchemy import SQLAlchemy
+from pricing import Money
+
+db = SQLAlchemy()
+
+def utcnow():
+    """Naive UTC timestamp for the updated_at columns."""
+    return datetime.utcnow()
+
+# Define the Client model
+class Client(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    company_name = db.Column(db.String(100), nullable=True)
+    vat_number = db.Column(db.String(50), nullable=True)  # VAT identification number
+    vat_percentage = db.Column(db.Float, nullable=True)  # VAT percentage
+    street = db.Column(db.String(200), nullable=True)
+    city = db.Column(db.String(100), nullable=True)
+    state = db.Column(db.String(100), nullable=True)
+    postal_code = db.Column(db.String(20), nullable=True)
+    country = db.Column(db.String(100), nullable=True)
+    first_name = db.Column(db.String(100), nullable=True)
+    last_name = db.Column(db.String(100), nullable=True)
+    email = db.Column(db.String(100), nullable=True)
+    phone = db.Column(db.String(20), nullable=True)
+    currency = db.Column(db.String(10), nullable=True)  # Currency field
+    language = db.Column(db.String(10), nullable=True)
+    payment_terms = db.Column(db.String(300), nullable=True)
+    payment_days = db.Column(db.Integer, nullable=True)  # Net days until an invoice is due, see aging.py
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+    invoices = db.relationship('Invoice', backref='client', lazy=True)
+    recurring_invoices = db.relationship('RecurringInvoice', backref='client', lazy=True, cascade="all, delete-orphan")
+
+# Define the Invoice model
+class Invoice(db.Model):
+    id = db.Column(db.Integer, primary_key=True)  # Primary key
+    invoice_id = db.Column(db.String(50), unique=True, nullable=False)  # Unique invoice ID
+    invoice_number = db.Column(db.String(50), nullable=False, index=True)
+    invoice_date = db.Column(db.Date, nullable=False, index=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False)
+    subtotal = db.Column(Money, nullable=False, default=0)
+    discount_amount = db.Column(Money, nullable=False, default=0)
+    vat_amount = db.Column(Money, nullable=False, default=0)
+    total = db.Column(Money, nullable=False)  # Kept in sync by pricing.price_invoice()
+    state = db.Column(db.String(20), nullable=False)
+    due_date = db.Column(db.Date, nullable=True)  # invoice_date + the client's payment days unless set
+    apply_vat = db.Column(db.Boolean, default=False)
+    vat_percentage = db.Column(db.Float, nullable=True)
+    currency = db.Column(db.String(10), nullable=True)  # Currency field
+    discount = db.Column(db.Float, default=0)  # Add discount field
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+    version_id = db.Column(db.Integer, nullable=False, default=1)  # Bumped on every update, see __mapper_args__
+    services = db.relationship('InvoiceService', backref='invoice', lazy=True, cascade="all, delete-orphan", order_by='InvoiceService.id')
+
+    # client_id and state lookups are served by the leading column of these composites
+    __table_args__ = (
+        db.Index('ix_invoice_client_id_invoice_date', 'client_id', 'invoice_date'),
+        db.Index('ix_invoice_state_invoice_date', 'state', 'invoice_date'),
+        # The overdue job and the aging report look up the open states by due date
+        db.Index('ix_invoice_state_due_date', 'state', 'due_date'),
+        # Ids are never handed out again, also not those of archived or deleted invoices
+        {'sqlite_autoincrement': True},
+    )
+    # UPDATE ... WHERE version_id = <the version that was loaded>: a concurrent
+    # edit raises StaleDataError instead of being overwritten silently
+    __mapper_args__ = {'version_id_col': version_id}
+
+class InvoiceService(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'), nullable=False, index=True)
+    service = db.Column(db.String(100), nullable=True)
+    unit_cost = db.Column(Money, nullable=True)
+    quantity = db.Column(db.Integer, nullable=True)
+    line_total = db.Column(Money, nullable=True)
+
+# Pre-aggregated invoice amounts per client, month, currency and state.
+# Maintained by reports.py on every flush that touches an invoice.
+class InvoiceSummary(db.Model):
+    __tablename__ = 'invoice_summary'
+    period = db.Column(db.String(7), primary_key=True)  # YYYY-MM of the invoice date
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), primary_key=True)
+    currency = db.Column(db.String(10), primary_key=True)  # '' for invoices without a currency
+    state = db.Column(db.String(20), primary_key=True)
+    invoice_count = db.Column(db.Integer, nullable=False)
+    subtotal = db.Column(Money, nullable=False)
+    discount_amount = db.Column(Money, nullable=False)
+    vat_amount = db.Column(Money, nullable=False)
+    total = db.Column(Money, nullable=False)
+
+# InvoiceSummary rolled up over all clients; small enough to answer the
+# month, currency and state breakdowns without scanning per-client rows.
+class PeriodSummary(db.Model):
+    __tablename__ = 'period_summary'
+    period = db.Column(db.String(7), primary_key=True)
+    currency = db.Column(db.String(10), primary_key=True)
+    state = db.Column(db.String(20), primary_key=True)
+    invoice_count = db.Column(db.Integer, nullable=False)
+    subtotal = db.Column(Money, nullable=False)
+    discount_amount = db.Column(Money, nullable=False)
+    vat_amount = db.Column(Money, nullable=False)
+    total = db.Column(Money, nullable=False)
+
+# Named counters for invoice numbers and IDs, see numbering.py
+class InvoiceSequence(db.Model):
+    __tablename__ = 'invoice_sequence'
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False)
+
+# A client's invoice that is created again every interval_months, see recurring.py
+class RecurringInvoice(db.Model):
+    __tablename__ = 'recurring_invoice'
+    id = db.Column(db.Integer, primary_key=True)
+    client_id = db.Column(db.Integer, db.ForeignKey('client.id'), nullable=False, index=True)
+    start_date = db.Column(db.Date, nullable=False)  # Date of the first invoice; later ones fall on the same day
+    interval_months = db.Column(db.Integer, nullable=False, default=1)
+    end_date = db.Column(db.Date, nullable=True)  # No invoices dated after it
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    apply_vat = db.Column(db.Boolean, default=False)
+    vat_percentage = db.Column(db.Float, nullable=True)
+    currency = db.Column(db.String(10), nullable=True)
+    discount = db.Column(db.Float, default=0)
+    services = db.relationship('RecurringService', backref='recurring_invoice', lazy=True,
+                               cascade="all, delete-orphan", order_by='RecurringService.id')
+
+class RecurringService(db.Model):
+    __tablename__ = 'recurring_service'
+    id = db.Column(db.Integer, primary_key=True)
+    recurring_invoice_id = db.Column(db.Integer, db.ForeignKey('recurring_invoice.id'), nullable=False, index=True)
+    service = db.Column(db.String(100), nullable=True)
+    unit_cost = db.Column(Money, nullable=True)
+    quantity = db.Column(db.Integer, nullable=True)
+
+# The months a recurring invoice has been generated for, so that a rerun skips
+# them; kept when the generated invoice is deleted
+class GeneratedInvoice(db.Model):
+    __tablename__ = 'generated_invoice'
+    period = db.Column(db.String(7), primary_key=True)  # YYYY-MM
+    recurring_invoice_id = db.Column(db.Integer, db.ForeignKey('recurring_invoice.id', ondelete='CASCADE'),
+                                     primary_key=True)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id', ondelete='SET NULL'), nullable=True, index=True)
+
+# An invoice e-mailed to its client, queued by the app and sent by the
+# deliver-invoices worker, see delivery.py.  invoice_id has no foreign key:
+# the record outlives the invoice when it is deleted (its pending deliveries
+# fail) or archived (they are sent from the archive).
+class Delivery(db.Model):
+    __tablename__ = 'delivery'
+    id = db.Column(db.Integer, primary_key=True)
+    invoice_id = db.Column(db.Integer, nullable=False, index=True)
+    recipient = db.Column(db.String(100), nullable=False)  # The client's e-mail when it was queued
+    format = db.Column(db.String(10), nullable=False, default='pdf')  # pdf: attached; html: the invoice as the body
+    language = db.Column(db.String(10), nullable=True)  # None: the client's language
+    persona = db.Column(db.String(50), nullable=True)  # None: the default persona
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=utcnow)  # For 'sending': when the claim expires
+    last_error = db.Column(db.String(500), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    # The workers claim the due deliveries in order of this index
+    __table_args__ = (
+        db.Index('ix_delivery_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
@@ -0,0 +1,57 @@
+"""Invoice IDs and invoice numbers from counters in the database.
+
+Each sequence is a row of invoice_sequence holding its next value.
+reserve() takes a block of consecutive values by incrementing that row in
+the caller's transaction.  A concurrent writer cannot take the same values:
+it waits for the row (the write lock on SQLite, a row lock elsewhere) until
+that transaction ends.  A rollback returns the block, so the numbers of the
+committed invoices have no gaps.
+
+New invoices get their invoice_id from INVOICE_ID ("INV-000042") and, unless
+one is typed in, their invoice_number from INVOICE_NUMBER, which starts
+after the highest all-digit invoice number when it is first used.
+"""
+import sqlalchemy as sa
+
+from models import db, Invoice, InvoiceSequence
+
+INVOICE_ID = 'invoice_id'
+INVOICE_NUMBER = 'invoice_number'
+sequence = InvoiceSequence.__table__
+
+
+def _first_value(name):
+    """Where a sequence starts: after the invoice numbers entered so far."""
+    if name != INVOICE_NUMBER:
+        return 1
+    number = Invoice.invoice_number
+    if db.session.get_bind().dialect.name == 'sqlite':
+        digits_only = sa.and_(number != '', sa.not_(number.op('GLOB')('*[^0-9]*')))
+    else:
+        digits_only = number.op('~')('^[0-9]+$')
+    highest = db.session.scalar(sa.select(sa.func.max(sa.cast(number, sa.BigInteger))).where(digits_only))
+    return (highest or 0) + 1
+
+
+def reserve(name, count=1):
+    """The first of `count` consecutive values of sequence `name`, taken in the current transaction."""
+    next_value = db.session.execute(
+        sequence.update().where(sequence.c.name == name)
+        .values(next_value=sequence.c.next_value + count).returning(sequence.c.next_value)).scalar()
+    if next_value is not None:
+        return next_value - count
+    first = _first_value(name)
+    db.session.execute(sequence.insert().values(name=name, next_value=first + count))
+    return first
+
+
+def format_invoice_id(value):
+    return f"INV-{value:06d}"
+
+
+def next_invoice_id():
+    return format_invoice_id(reserve(INVOICE_ID))
+
+
+def next_invoice_number():
+    return str(reserve(INVOICE_NUMBER))
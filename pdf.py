@@ -0,0 +1,227 @@
+"""Server-side PDF rendering of invoices.
+
+invoice_document() flattens an invoice (with its client and services) plus
+the chosen persona and translations into a plain, picklable dict.  The PDF is
+then drawn from that dict only, so batches can be rendered in a process pool
+without the workers touching the database.
+"""
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import Image as PILImage
+
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+from xml.sax.saxutils import escape
+
+from pricing import format_amount
+
+# Embed images as binary streams; without the C accelerator the ASCII85
+# encoder takes most of the render time of a one-page invoice.
+rl_config.useA85 = 0
+
+LOGO_SIZE = 25 * mm
+POOL_MIN_DOCUMENTS = 50  # Below this, starting the worker processes costs more than it saves
+LOGO_PIXELS = 300  # Enough for print at ~300 dpi; the source logos are much larger
+
+CLIENT_FIELDS = ['company_name', 'first_name', 'last_name', 'street', 'city', 'state',
+                 'postal_code', 'country', 'phone', 'email', 'vat_number']
+
+
+def invoice_document(invoice, language_dict, persona_info):
+    """Collect everything print_invoice.html shows into a plain dict."""
+    client = invoice.client
+    return {
+        'id': invoice.id,
+        'invoice_number': invoice.invoice_number,
+        'invoice_date': invoice.invoice_date.strftime('%Y-%m-%d'),
+        'due_date': invoice.due_date.strftime('%Y-%m-%d') if invoice.due_date else '',
+        'currency': invoice.currency or '',
+        'discount': invoice.discount or 0,
+        'vat_percentage': invoice.vat_percentage,
+        'subtotal': invoice.subtotal,
+        'discount_amount': invoice.discount_amount,
+        'vat_amount': invoice.vat_amount,
+        'total': invoice.total,
+        'services': [(s.service, s.unit_cost, s.quantity, s.line_total) for s in invoice.services],
+        'client': {field: getattr(client, field) or '' for field in CLIENT_FIELDS},
+        'payment_terms': client.payment_terms or '',
+        'labels': dict(language_dict),
+        'persona': persona_info,
+    }
+
+
+def document_filename(document):
+    number = re.sub(r'[^A-Za-z0-9._-]+', '_', document['invoice_number'] or '')
+    return f"invoice_{number}_{document['id']}.pdf"
+
+
+@lru_cache(maxsize=32)
+def _logo_image(path, mtime):
+    """Downscale a logo once per process instead of embedding the full image in every PDF.
+
+    The result is a JPEG on white, which reportlab embeds as is rather than
+    re-compressing the pixels for every document.
+    """
+    with PILImage.open(path) as image:
+        image.thumbnail((LOGO_PIXELS, LOGO_PIXELS))
+        image = image.convert('RGBA')
+        flattened = PILImage.new('RGB', image.size, 'white')
+        flattened.paste(image, mask=image.getchannel('A'))
+    buffer = BytesIO()
+    flattened.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def _p(text, style):
+    """Paragraph with escaped text; newlines become line breaks."""
+    return Paragraph(escape(str(text)).replace('\n', '<br/>'), style)
+
+
+def render_pdf(document, static_folder):
+    """Render one invoice document to PDF bytes."""
+    labels = document['labels']
+    persona = document['persona']
+    client = document['client']
+    currency = document['currency']
+    styles = getSampleStyleSheet()
+    normal, small = styles['Normal'], styles['BodyText']
+
+    def money(value):
+        return f"{format_amount(value)} {currency}"
+
+    story = []
+
+    # Title with the persona logo on the right
+    title = _p(f"{labels['invoice']} #{document['invoice_number']}", styles['Title'])
+    logo = ''
+    logo_path = os.path.join(static_folder, persona.get('logo', ''))
+    if persona.get('logo') and os.path.isfile(logo_path):
+        logo_data = _logo_image(logo_path, os.path.getmtime(logo_path))
+        logo = Image(BytesIO(logo_data), width=LOGO_SIZE, height=LOGO_SIZE, kind='proportional')
+    header = Table([[title, logo]], colWidths=[130 * mm, 40 * mm])
+    header.setStyle(TableStyle([('VALIGN', (0, 0), (-1, -1), 'MIDDLE'), ('ALIGN', (1, 0), (1, 0), 'RIGHT')]))
+    story += [header, Spacer(1, 6 * mm)]
+
+    # Recipient and place/date
+    recipient = '\n'.join([
+        f"{client['first_name']} {client['last_name']}",
+        client['street'],
+        f"{client['city']}, {client['state']} {client['postal_code']}",
+        client['country'],
+        f"{labels['tel']}: {client['phone']}",
+        f"{labels['email']}: {client['email']}",
+        f"{labels['vat_number']}: {client['vat_number']}",
+    ])
+    place_date = f"{persona.get('address', {}).get('city', '')}, {document['invoice_date']}"
+    story.append(_p(f"{labels['recipient']}:", styles['Heading3']))
+    recipient_table = Table([[
+        [Paragraph(f"<b>{escape(client['company_name'])}</b>", normal), _p(recipient, normal)],
+        _p(place_date, normal),
+    ]], colWidths=[100 * mm, 70 * mm])
+    recipient_table.setStyle(TableStyle([('VALIGN', (0, 0), (-1, -1), 'TOP'), ('ALIGN', (1, 0), (1, 0), 'RIGHT')]))
+    story += [recipient_table, Spacer(1, 6 * mm)]
+
+    # Services and summary
+    story.append(_p(labels['services'], styles['Heading3']))
+    rows = [[labels['service'], labels['unit_cost'], labels['quantity'], labels['line_total']]]
+    for service, unit_cost, quantity, line_total in document['services']:
+        rows.append([_p(service or '', small), money(unit_cost), quantity, money(line_total)])
+    summary_start = len(rows)
+    rows.append(['', '', labels['subtotal'], money(document['subtotal'])])
+    if document['discount'] > 0:
+        rows.append(['', '', f"{labels['discount']} ({document['discount']}%)", f"- {money(document['discount_amount'])}"])
+    if document['vat_amount'] > 0:
+        rows.append(['', '', f"{labels['vat']} ({document['vat_percentage']}%)", money(document['vat_amount'])])
+    services_table = Table(rows, colWidths=[80 * mm, 35 * mm, 25 * mm, 35 * mm], repeatRows=1)
+    services_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('LINEBELOW', (0, 0), (-1, 0), 0.5, colors.grey),
+        ('LINEABOVE', (0, summary_start), (-1, summary_start), 0.5, colors.grey),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    story += [services_table, Spacer(1, 4 * mm)]
+    total_style = styles['Heading4'].clone('Total', alignment=2)
+    story.append(_p(f"{labels['total']}: {money(document['total'])}", total_style))
+
+    # Payment terms and transfer text
+    story.append(Paragraph(f"<b>{escape(labels['client_terms'])}</b>", normal))
+    if document['due_date']:
+        story.append(_p(f"{labels['due_date']} {document['due_date']}", normal))
+    story += [_p(document['payment_terms'], normal), Spacer(1, 2 * mm), _p(labels['transfer_text'], normal), Spacer(1, 8 * mm)]
+
+    # Footer with persona and bank details
+    address = persona.get('address', {})
+    bank = persona.get('bank_info', {})
+    persona_lines = []
+    if persona.get('company_name'):
+        persona_lines.append(persona['company_name'])
+    persona_lines += [
+        ' '.join(filter(None, [persona.get('prefix'), persona.get('first_name'), persona.get('last_name'), persona.get('suffix')])),
+        address.get('street', ''),
+        f"{address.get('city', '')}, {address.get('state', '')} {address.get('postal_code', '')}",
+        address.get('country', ''),
+    ]
+    if persona.get('tel'):
+        persona_lines.append(f"{labels['tel']}: {persona['tel']}")
+    persona_lines.append(f"{labels['email']}: {persona.get('email', '')}")
+    persona_lines.append(f"{labels['tax_info']}:")
+    persona_lines += [persona.get(key, '') for key in ('tax_info1', 'tax_info2', 'tax_info3')]
+    bank_lines = [labels['bank_info'], bank.get('account_holder', ''), f"Bank Name: {bank.get('bank_name', '')}"]
+    if bank.get('iban'):
+        bank_lines.append(f"IBAN: {bank['iban']}")
+    if bank.get('account_number'):
+        bank_lines.append(f"Account Number: {bank['account_number']}")
+    bank_lines.append(f"BIC/SWIFT: {bank.get('bic_swift', '')}")
+    footer = Table([[_p('\n'.join(persona_lines), small), _p('\n'.join(bank_lines), small)]], colWidths=[90 * mm, 80 * mm])
+    footer.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, -1), colors.whitesmoke),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('BOX', (0, 0), (-1, -1), 0.25, colors.lightgrey),
+    ]))
+    story.append(footer)
+
+    buffer = BytesIO()
+    pdf = SimpleDocTemplate(buffer, pagesize=A4, title=f"{labels['invoice']} #{document['invoice_number']}",
+                            leftMargin=20 * mm, rightMargin=20 * mm, topMargin=15 * mm, bottomMargin=15 * mm)
+    pdf.build(story)
+    return buffer.getvalue()
+
+
+def _render_named(args):
+    document, static_folder = args
+    return document_filename(document), render_pdf(document, static_folder)
+
+
+def render_many(documents, static_folder, processes=None, stats=None):
+    """Render documents in a process pool, yielding (filename, pdf_bytes) in order.
+
+    When `stats` is a dict it receives the count, elapsed seconds and
+    invoices per second once the batch is done.
+    """
+    documents = list(documents)
+    processes = processes or os.cpu_count() or 1
+    started = time.perf_counter()
+    jobs = [(document, static_folder) for document in documents]
+    if processes == 1 or len(documents) < POOL_MIN_DOCUMENTS:
+        yield from map(_render_named, jobs)
+    else:
+        # spawn: forking a threaded web worker can inherit held locks
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(processes, len(documents)), mp_context=context) as pool:
+            yield from pool.map(_render_named, jobs, chunksize=max(1, len(jobs) // (processes * 4)))
+    elapsed = time.perf_counter() - started
+    rate = len(documents) / elapsed if elapsed else 0
+    logging.info(f"Rendered {len(documents)} invoice PDFs in {elapsed:.2f}s ({rate:.1f} invoices/s)")
+    if stats is not None:
+        stats.update(count=len(documents), seconds=elapsed, per_second=rate)
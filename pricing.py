@@ -0,0 +1,83 @@
+"""Invoice pricing: line totals, discount, VAT and grand total.
+
+Every code path that writes an invoice goes through price_invoice() so the
+stored subtotal/discount/VAT/total columns always match the service lines.
+Amounts are Decimal in Python and integer cents in the database (Money), so
+sums are exact both in Python and in SQL aggregates.
+"""
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+import sqlalchemy as sa
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+Totals = namedtuple('Totals', ['subtotal', 'discount_amount', 'vat_amount', 'total'])
+
+
+def to_decimal(value):
+    """Convert a form value, float or None to Decimal without binary noise."""
+    if value is None or value == '':
+        return ZERO
+    if isinstance(value, Decimal):
+        return value
+    # Going through str() keeps 19.99 as 19.99 instead of 19.989999...
+    return Decimal(str(value))
+
+
+def quantize(amount):
+    """Round an amount to whole cents (half up, like a cash register)."""
+    return to_decimal(amount).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class Money(sa.types.TypeDecorator):
+    """A Decimal amount stored as an integer number of cents."""
+    impl = sa.Integer
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int(quantize(value) * 100)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return (Decimal(value) / 100).quantize(CENT)
+
+
+def format_amount(value):
+    """Format a number with a space as a thousand separator (no decimals)."""
+    if isinstance(value, (int, float, Decimal)):
+        return f"{value:,.0f}".replace(',', ' ')
+    return value
+
+
+def line_total(unit_cost, quantity):
+    return quantize(to_decimal(unit_cost) * int(quantity or 0))
+
+
+def compute_totals(line_totals, discount=0, apply_vat=False, vat_percentage=0):
+    """Return the Totals for the given line totals and invoice settings."""
+    subtotal = quantize(sum((to_decimal(amount) for amount in line_totals), ZERO))
+    discount_amount = quantize(subtotal * to_decimal(discount) / 100)
+    vat_amount = ZERO
+    if apply_vat:
+        vat_amount = quantize((subtotal - discount_amount) * to_decimal(vat_percentage) / 100)
+    total = subtotal - discount_amount + vat_amount
+    return Totals(subtotal, discount_amount, vat_amount, total)
+
+
+def price_invoice(invoice):
+    """Recompute the line totals and the stored totals of an invoice."""
+    for service in invoice.services:
+        service.line_total = line_total(service.unit_cost, service.quantity)
+    totals = compute_totals(
+        [service.line_total for service in invoice.services],
+        discount=invoice.discount,
+        apply_vat=invoice.apply_vat,
+        vat_percentage=invoice.vat_percentage,
+    )
+    invoice.subtotal, invoice.discount_amount, invoice.vat_amount, invoice.total = totals
+    return totals
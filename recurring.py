@@ -0,0 +1,132 @@
+"""Recurring invoices: a client's services, invoiced again every few months.
+
+A RecurringInvoice is due every interval_months-th month from its
+start_date, on the same day of the month (the last day in shorter months),
+until its end_date.  generate() creates the invoices of every template due
+in a month in one transaction: one multi-row INSERT for the invoices, one
+for their service lines, with their IDs and numbers reserved as one block
+(see numbering.py).  Each generated invoice is recorded in
+generated_invoice, so running it again for the same month creates nothing,
+not even for an invoice that was deleted in the meantime.
+"""
+import calendar
+from datetime import date, datetime
+
+import sqlalchemy as sa
+from sqlalchemy.orm import selectinload
+
+import aging
+import database
+from models import db, utcnow, GeneratedInvoice, Invoice, InvoiceService, RecurringInvoice, RecurringService
+import numbering
+from pricing import compute_totals, line_total
+import reports
+
+INTERVALS = {1: 'Monthly', 3: 'Quarterly', 6: 'Every 6 months', 12: 'Yearly'}
+STATES = ['Draft', 'Sent', 'Paid']  # Generated invoices start in one of these
+
+
+def parse_period(period):
+    """(year, month) of a YYYY-MM string; raises ValueError."""
+    month = datetime.strptime(period, '%Y-%m')
+    return month.year, month.month
+
+
+def _day_in_month(day, year, month):
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+def invoice_date(template, year, month):
+    return _day_in_month(template.start_date.day, year, month)
+
+
+def month_after(day):
+    """The same day of the next month (its last day if it is shorter)."""
+    return _day_in_month(day.day, day.year + day.month // 12, day.month % 12 + 1)
+
+
+def is_due(template, year, month):
+    months = (year - template.start_date.year) * 12 + month - template.start_date.month
+    if months < 0 or months % template.interval_months:
+        return False
+    return template.end_date is None or invoice_date(template, year, month) <= template.end_date
+
+
+def next_due_date(template, today):
+    """Date of the first invoice due from today's month on, or None once it has ended."""
+    year, month = max((today.year, today.month), (template.start_date.year, template.start_date.month))
+    for _ in range(template.interval_months):
+        if is_due(template, year, month):
+            return invoice_date(template, year, month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return None
+
+
+def total(template):
+    """Total of one invoice of `template`."""
+    return compute_totals([line_total(line.unit_cost, line.quantity) for line in template.services],
+                          template.discount, template.apply_vat, template.vat_percentage).total
+
+
+def from_invoice(invoice, interval_months, start_date):
+    """A new template with the client, services and settings of `invoice`."""
+    return RecurringInvoice(
+        client_id=invoice.client_id, start_date=start_date, interval_months=interval_months,
+        apply_vat=invoice.apply_vat, vat_percentage=invoice.vat_percentage, currency=invoice.currency,
+        discount=invoice.discount,
+        services=[RecurringService(service=line.service, unit_cost=line.unit_cost, quantity=line.quantity)
+                  for line in invoice.services])
+
+
+def due_templates(period):
+    """Active templates due in `period` that have not been generated for it yet."""
+    year, month = parse_period(period)
+    first_day, last_day = date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+    generated = sa.select(GeneratedInvoice.recurring_invoice_id).where(GeneratedInvoice.period == period)
+    candidates = db.session.scalars(
+        sa.select(RecurringInvoice).options(selectinload(RecurringInvoice.services))
+        .where(RecurringInvoice.active, RecurringInvoice.start_date <= last_day,
+               sa.or_(RecurringInvoice.end_date.is_(None), RecurringInvoice.end_date >= first_day),
+               RecurringInvoice.id.not_in(generated))
+        .order_by(RecurringInvoice.client_id, RecurringInvoice.id))
+    return [template for template in candidates if template.services and is_due(template, year, month)]
+
+
+def generate(period, state='Draft'):
+    """Create the invoices of every template due in `period` (YYYY-MM); returns how many."""
+    year, month = parse_period(period)
+    database.begin_write(db.session)  # Reads the templates, then writes: take the lock first
+    templates = due_templates(period)
+    if not templates:
+        db.session.commit()
+        return 0
+
+    first_id = numbering.reserve(numbering.INVOICE_ID, len(templates))
+    first_number = numbering.reserve(numbering.INVOICE_NUMBER, len(templates))
+    invoice_rows, line_groups = [], []
+    now = utcnow()
+    client_days = aging.payment_days(template.client_id for template in templates)
+    for offset, template in enumerate(templates):
+        lines = [{'service': line.service, 'unit_cost': line.unit_cost, 'quantity': line.quantity,
+                  'line_total': line_total(line.unit_cost, line.quantity)} for line in template.services]
+        totals = compute_totals([line['line_total'] for line in lines],
+                                template.discount, template.apply_vat, template.vat_percentage)
+        day = invoice_date(template, year, month)
+        invoice_rows.append(dict(
+            invoice_id=numbering.format_invoice_id(first_id + offset), invoice_number=str(first_number + offset),
+            invoice_date=day, due_date=aging.due_date(day, client_days.get(template.client_id)),
+            client_id=template.client_id, state=state,
+            apply_vat=template.apply_vat, vat_percentage=template.vat_percentage, currency=template.currency,
+            discount=template.discount, updated_at=now, **totals._asdict()))
+        line_groups.append(lines)
+
+    ids = db.session.scalars(
+        db.insert(Invoice).returning(Invoice.id, sort_by_parameter_order=True), invoice_rows).all()
+    db.session.execute(db.insert(InvoiceService), [dict(line, invoice_id=invoice_id)
+                                                   for invoice_id, lines in zip(ids, line_groups) for line in lines])
+    db.session.execute(db.insert(GeneratedInvoice), [
+        {'period': period, 'recurring_invoice_id': template.id, 'invoice_id': invoice_id}
+        for template, invoice_id in zip(templates, ids)])
+    reports.add(invoice_rows)  # Bulk inserts bypass the flush hooks of the report summary
+    db.session.commit()
+    return len(ids)
@@ -0,0 +1,149 @@
+"""Translations and personas, validated on load and reloaded when their files change.
+
+translations.json maps a language code to its labels; personas.json maps a
+persona key to the sender details printed on invoices.  Both files are
+checked when they are loaded, and every language is merged over English
+ahead of time, so a label missing in one language shows the English text
+instead of failing at render time.  Personas get every field, empty if the
+file leaves it out.
+
+Registry.current() returns the loaded Catalog.  At most once per
+check_interval it compares the files' modification times with the loaded
+ones and, if they changed, loads them again.  Only one thread does this;
+others keep using the previous catalog in the meantime.  The new catalog
+replaces the old one in a single assignment.  A file that fails validation
+on reload is logged and the previous catalog stays in use; at startup it
+raises.
+"""
+from collections import namedtuple
+import json
+import logging
+import os
+import threading
+import time
+
+DEFAULT_LANGUAGE = 'en'  # Every other language falls back to it
+DEFAULT_PERSONA = 'persona1'
+LANGUAGE_NAME = 'language_name'  # The language's name in itself, shown in the language selectors
+PERSONA_FIELDS = ['prefix', 'first_name', 'last_name', 'suffix', 'company_name', 'logo', 'tel', 'email',
+                  'tax_info1', 'tax_info2', 'tax_info3']
+PERSONA_SECTIONS = {
+    'address': ['street', 'city', 'postal_code', 'state', 'country'],
+    'bank_info': ['account_holder', 'bank_name', 'iban', 'account_number', 'bic_swift'],
+}
+
+# languages: code -> labels (with the English fallback merged in); language_names:
+# code -> name; personas: key -> details; version: the file mtimes it was loaded from.
+# The dicts are shared between requests and must not be modified.
+Catalog = namedtuple('Catalog', ['languages', 'language_names', 'personas', 'default_persona', 'version'])
+
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{os.path.basename(path)}: {e}")
+    if not isinstance(data, dict) or not data:
+        raise ValueError(f"{os.path.basename(path)}: expected a non-empty JSON object")
+    return data
+
+
+def load_translations(path):
+    """(languages, language_names) from translations.json; raises ValueError if it is invalid."""
+    name = os.path.basename(path)
+    data = _read_json(path)
+    if DEFAULT_LANGUAGE not in data:
+        raise ValueError(f"{name}: the fallback language {DEFAULT_LANGUAGE!r} is missing")
+    for code, labels in data.items():
+        if not isinstance(labels, dict):
+            raise ValueError(f"{name}: {code} must be an object of labels")
+        for key, text in labels.items():
+            if not isinstance(text, str):
+                raise ValueError(f"{name}: {code}.{key} must be a string")
+
+    fallback = data[DEFAULT_LANGUAGE]
+    languages, language_names = {}, {}
+    for code, labels in data.items():
+        missing = set(fallback) - set(labels) - {LANGUAGE_NAME}
+        if missing:
+            logging.warning(f"{name}: {code} has no {', '.join(sorted(missing))}; using {DEFAULT_LANGUAGE}")
+        unknown = set(labels) - set(fallback)
+        if unknown:
+            logging.warning(f"{name}: {code} has labels that {DEFAULT_LANGUAGE} lacks: {', '.join(sorted(unknown))}")
+        languages[code] = {**fallback, **labels}
+        language_names[code] = labels.get(LANGUAGE_NAME) or code  # Never the English name
+    return languages, language_names
+
+
+def load_personas(path):
+    """Personas from personas.json with every field present; raises ValueError if it is invalid."""
+    name = os.path.basename(path)
+    personas = {}
+    for key, persona in _read_json(path).items():
+        if not isinstance(persona, dict):
+            raise ValueError(f"{name}: {key} must be an object")
+        resolved = {}
+        for field in PERSONA_FIELDS:
+            value = persona.get(field) or ''
+            if not isinstance(value, str):
+                raise ValueError(f"{name}: {key}.{field} must be a string")
+            resolved[field] = value
+        for section, fields in PERSONA_SECTIONS.items():
+            values = persona.get(section) or {}
+            if not isinstance(values, dict):
+                raise ValueError(f"{name}: {key}.{section} must be an object")
+            resolved[section] = {field: str(values.get(field) or '') for field in fields}
+        if not (resolved['first_name'] or resolved['last_name'] or resolved['company_name']):
+            raise ValueError(f"{name}: {key} needs a first_name, last_name or company_name")
+        personas[key] = resolved
+    return personas
+
+
+class Registry:
+    """The current Catalog of translations and personas, reloaded when the files change."""
+
+    def __init__(self, translations_path, personas_path, check_interval=1.0):
+        self.paths = (translations_path, personas_path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._failed_version = None
+        self._catalog = self._load(self._mtimes())  # Invalid files stop the app from starting
+
+    def _mtimes(self):
+        return tuple(os.stat(path).st_mtime_ns for path in self.paths)
+
+    def _load(self, version):
+        languages, language_names = load_translations(self.paths[0])
+        personas = load_personas(self.paths[1])
+        default_persona = DEFAULT_PERSONA if DEFAULT_PERSONA in personas else next(iter(personas))
+        return Catalog(languages, language_names, personas, default_persona, version)
+
+    def current(self):
+        """The loaded Catalog, after reloading it if a file has changed."""
+        now = time.monotonic()
+        # Whoever gets the lock checks the files; nobody waits for it
+        if now - self._checked_at >= self.check_interval and self._lock.acquire(blocking=False):
+            try:
+                self._checked_at = now
+                self._reload_if_changed()
+            finally:
+                self._lock.release()
+        return self._catalog
+
+    def _reload_if_changed(self):
+        try:
+            version = self._mtimes()
+        except OSError as e:
+            logging.error(f"Cannot check translations and personas, keeping the loaded ones: {e}")
+            return
+        if version in (self._catalog.version, self._failed_version):
+            return
+        try:
+            self._catalog = self._load(version)
+            self._failed_version = None
+            logging.info("Reloaded translations and personas")
+        except (OSError, ValueError) as e:
+            self._failed_version = version  # Log once per change, not on every check
+            logging.error(f"Keeping the previous translations and personas: {e}")
@@ -0,0 +1,85 @@
+"""Bounded LRU cache for rendered invoice pages.
+
+Keys are (invoice_id, persona, language, *versions) tuples where the
+versions change whenever the invoice or its client is modified, so a stale
+page can never be served; invalidate() just frees the space early.  When a
+directory is given, entries are also written to disk so they survive
+restarts and can be shared between worker processes.  On disk each invoice
+has its own subdirectory with one file per persona and language: a newer
+version replaces the file, so the directory never holds more than the live
+pages, and invalidate() deletes an invoice's subdirectory.
+"""
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+VARIANT = 3  # (invoice_id, persona, language): the leading key elements naming a file
+
+
+def cache_key_digest(key):
+    """Stable hex digest of a cache key, used for file names and ETags."""
+    return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+
+class RenderCache:
+    def __init__(self, maxsize=256, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, str(key[0]), f"{cache_key_digest(key[1:VARIANT])}.html")
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                return html
+        if self.directory:
+            try:
+                with open(self._path(key), encoding='utf-8') as f:
+                    digest, html = f.readline().rstrip('\n'), f.read()
+            except FileNotFoundError:
+                return None
+            if digest != cache_key_digest(key):
+                return None  # Another version of the page
+            self._remember(key, html)
+        return html
+
+    def set(self, key, html):
+        self._remember(key, html)
+        if self.directory:
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(f"{cache_key_digest(key)}\n{html}")
+                os.replace(tmp_path, path)  # Atomic, readers never see a partial file
+            except FileNotFoundError:
+                pass  # invalidate() removed the subdirectory meanwhile; the page is outdated anyway
+
+    def _remember(self, key, html):
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *invoice_ids):
+        """Drop every cached page of the given invoices."""
+        invoice_ids = set(invoice_ids)
+        if not invoice_ids:
+            return
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in invoice_ids]:
+                del self._entries[key]
+        if self.directory:
+            for invoice_id in invoice_ids:
+                shutil.rmtree(os.path.join(self.directory, str(invoice_id)), ignore_errors=True)
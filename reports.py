@@ -0,0 +1,293 @@
+"""Revenue reports served from pre-aggregated summary rows.
+
+invoice_summary (models.InvoiceSummary) holds one row per month, client,
+currency and state with the invoice count and the summed amounts;
+period_summary (models.PeriodSummary) rolls those up over all clients.  A session
+hook recomputes the affected (client, month) buckets from the invoice table
+whenever a flush inserts, updates or deletes an invoice, so the summary is
+written in the same transaction as the change.  Writes that bypass the unit
+of work must keep it current themselves: bulk inserts call add(), set-based
+UPDATEs call refresh(), or restate() if they only change the state.
+rebuild() recomputes everything from scratch and check() compares the stored
+rows with the live data.  Archived invoices (see archive.py) stay in the
+summary: it is computed from the live and the archived invoices together.
+"""
+from datetime import date
+
+import sqlalchemy as sa
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import archive
+from models import db, Client, Invoice, InvoiceSummary, PeriodSummary
+
+AMOUNTS = ['subtotal', 'discount_amount', 'vat_amount', 'total']
+INVOICE_KEYS = ['client_id', 'invoice_date', 'currency', 'state']  # Invoice columns that pick the bucket
+SUMMARY_COLUMNS = ['period', 'client_id', 'currency', 'state', 'invoice_count'] + AMOUNTS
+ROLLUP_COLUMNS = ['period', 'currency', 'state', 'invoice_count'] + AMOUNTS
+summary = InvoiceSummary.__table__
+rollup = PeriodSummary.__table__
+
+
+def period_of(day):
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def _period_range(period):
+    """First day of the month and first day of the next month."""
+    year, month = map(int, period.split('-'))
+    return date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+
+
+def _month(column, dialect_name):
+    if dialect_name == 'sqlite':
+        return sa.func.strftime('%Y-%m', column)
+    return sa.func.to_char(column, 'YYYY-MM')
+
+
+def _aggregate(dialect_name, client_id=None, period=None):
+    """SELECT of summary rows computed from the invoices, archived ones included.
+
+    With `client_id` and/or `period` the rows are for that client and month
+    only; with `period` the month is not computed per row.
+    """
+    invoices = archive.with_archived(*INVOICE_KEYS, *AMOUNTS)
+    criteria = []
+    if client_id is not None:
+        criteria.append(invoices.c.client_id == client_id)
+    if period:
+        first_day, next_month = _period_range(period)
+        criteria += [invoices.c.invoice_date >= first_day, invoices.c.invoice_date < next_month]
+    month = sa.literal(period, sa.String) if period else _month(invoices.c.invoice_date, dialect_name)
+    currency = sa.func.coalesce(invoices.c.currency, '')
+    group_by = [invoices.c.client_id, currency, invoices.c.state]
+    if not period:
+        group_by.insert(0, month)
+    return (
+        sa.select(
+            month.label('period'),
+            invoices.c.client_id,
+            currency.label('currency'),
+            invoices.c.state,
+            sa.func.count().label('invoice_count'),
+            *[sa.func.sum(invoices.c[name]).label(name) for name in AMOUNTS],
+        )
+        .where(*criteria)
+        .group_by(*group_by)
+    )
+
+
+def _rollup_select(*criteria):
+    """SELECT of period_summary rows rolled up from invoice_summary."""
+    return (
+        sa.select(
+            summary.c.period,
+            summary.c.currency,
+            summary.c.state,
+            *[sa.func.sum(summary.c[name]) for name in ROLLUP_COLUMNS[3:]],
+        )
+        .where(*criteria)
+        .group_by(summary.c.period, summary.c.currency, summary.c.state)
+    )
+
+
+def refresh(buckets, connection=None):
+    """Recompute the summary rows of the given (client_id, 'YYYY-MM') buckets."""
+    conn = connection or db.session.connection()
+    buckets = set(buckets)
+    for client_id, period in buckets:
+        conn.execute(summary.delete().where(summary.c.client_id == client_id, summary.c.period == period))
+        conn.execute(summary.insert().from_select(
+            SUMMARY_COLUMNS, _aggregate(conn.dialect.name, client_id=client_id, period=period)))
+    for period in {period for _, period in buckets}:
+        conn.execute(rollup.delete().where(rollup.c.period == period))
+        conn.execute(rollup.insert().from_select(ROLLUP_COLUMNS, _rollup_select(summary.c.period == period)))
+
+
+def _dialect_insert(conn):
+    return {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}[conn.dialect.name]
+
+
+def add(invoice_rows, connection=None):
+    """Add newly inserted invoices to the summary without re-reading the invoice table.
+
+    `invoice_rows` are the dicts passed to a bulk INSERT (client_id,
+    invoice_date, currency, state and the amounts).  Used by the importers,
+    where recomputing every touched bucket would rescan a growing table.
+    """
+    conn = connection or db.session.connection()
+    totals, rollup_totals = {}, {}
+    for row in invoice_rows:
+        period, currency = period_of(row['invoice_date']), row.get('currency') or ''
+        for key, buckets in (((period, row['client_id'], currency, row['state']), totals),
+                             ((period, currency, row['state']), rollup_totals)):
+            bucket = buckets.setdefault(key, [0] * (1 + len(AMOUNTS)))
+            bucket[0] += 1
+            for i, name in enumerate(AMOUNTS, 1):
+                bucket[i] += row[name]
+    if not totals:
+        return
+    dialect_insert = _dialect_insert(conn)
+    for table, columns, buckets in ((summary, SUMMARY_COLUMNS, totals), (rollup, ROLLUP_COLUMNS, rollup_totals)):
+        insert = dialect_insert(table)
+        keys = [column.name for column in table.primary_key]
+        conn.execute(
+            insert.on_conflict_do_update(
+                index_elements=keys,
+                set_={name: table.c[name] + insert.excluded[name] for name in columns[len(keys):]},
+            ),
+            [dict(zip(columns, key + tuple(values))) for key, values in buckets.items()],
+        )
+
+
+def restate(criterion, old_state, new_state, connection=None):
+    """Move the live invoices matching `criterion` from their `old_state` buckets to the `new_state` ones.
+
+    For set-based UPDATEs that change nothing but the state; run it before
+    the UPDATE, in the same transaction, with the UPDATE's WHERE clause.
+    Only the amounts of those invoices are added up (in SQL, per bucket),
+    unlike refresh(), which recomputes whole buckets.
+    """
+    conn = connection or db.session.connection()
+    invoices = Invoice.__table__
+    currency = sa.func.coalesce(invoices.c.currency, '')
+    for table, keys in ((summary, ['period', 'client_id', 'currency']), (rollup, ['period', 'currency'])):
+        expressions = {'period': _month(invoices.c.invoice_date, conn.dialect.name), 'client_id': invoices.c.client_id,
+                       'currency': currency}
+        columns = [expressions[key] for key in keys]
+        values = ['invoice_count'] + AMOUNTS
+        delta = (
+            sa.select(*[column.label(key) for key, column in zip(keys, columns)],
+                      sa.literal(new_state, sa.String).label('state'), sa.func.count().label('invoice_count'),
+                      *[sa.func.sum(invoices.c[name]).label(name) for name in AMOUNTS])
+            .where(criterion, invoices.c.state == old_state)
+            .group_by(*columns)
+        )
+        moved = delta.subquery()
+        conn.execute(table.update()
+                     .where(*[table.c[key] == moved.c[key] for key in keys], table.c.state == old_state)
+                     .values({name: table.c[name] - moved.c[name] for name in values}))
+        conn.execute(table.delete().where(table.c.invoice_count == 0))  # Buckets left empty
+        insert = _dialect_insert(conn)(table).from_select(keys + ['state'] + values, delta)
+        conn.execute(insert.on_conflict_do_update(
+            index_elements=keys + ['state'], set_={name: table.c[name] + insert.excluded[name] for name in values}))
+
+
+def rebuild(connection=None):
+    """Replace every summary row with aggregates of the current invoices."""
+    conn = connection or db.session.connection()
+    conn.execute(summary.delete())
+    conn.execute(rollup.delete())
+    conn.execute(summary.insert().from_select(SUMMARY_COLUMNS, _aggregate(conn.dialect.name)))
+    conn.execute(rollup.insert().from_select(ROLLUP_COLUMNS, _rollup_select()))
+
+
+def check():
+    """Compare the stored summaries with the invoices.
+
+    Returns [(table name, bucket, stored values, live values)] for every
+    bucket that differs.
+    """
+    def keyed(rows, key_length):
+        return {tuple(row[:key_length]): tuple(row[key_length:]) for row in rows}
+
+    def stored(model, columns):
+        return db.session.execute(sa.select(*[getattr(model, name) for name in columns]))
+
+    live = keyed(db.session.execute(_aggregate(db.session.get_bind().dialect.name)), 4)
+    live_rollup = {}
+    for (period, _, currency, state), values in live.items():
+        previous = live_rollup.get((period, currency, state), (0,) * len(values))
+        live_rollup[(period, currency, state)] = tuple(a + b for a, b in zip(previous, values))
+
+    mismatches = []
+    for table, expected, actual in (
+        (summary.name, live, keyed(stored(InvoiceSummary, SUMMARY_COLUMNS), 4)),
+        (rollup.name, live_rollup, keyed(stored(PeriodSummary, ROLLUP_COLUMNS), 3)),
+    ):
+        mismatches += [(table, bucket, actual.get(bucket), expected.get(bucket))
+                       for bucket in sorted(expected.keys() | actual.keys())
+                       if actual.get(bucket) != expected.get(bucket)]
+    return mismatches
+
+
+def _buckets(invoice, values):
+    """(client_id, period) pairs for the given client_id and invoice_date values."""
+    client_ids, dates = values(invoice, 'client_id'), values(invoice, 'invoice_date')
+    return {(client_id, period_of(day)) for client_id in client_ids for day in dates
+            if client_id is not None and day is not None}
+
+
+def _old_values(invoice, attribute):
+    history = inspect(invoice).attrs[attribute].load_history()
+    return list(history.unchanged or ()) + list(history.deleted or ())
+
+
+def _current_values(invoice, attribute):
+    return [getattr(invoice, attribute)]
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_old_buckets(session, flush_context, instances):
+    # Old values are only available before the flush: an invoice that moves to
+    # another client or month also changes the bucket it leaves
+    buckets = session.info.setdefault('report_buckets', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Invoice):
+            buckets |= _buckets(obj, _old_values)
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_summary(session, flush_context):
+    # New invoices are added to their buckets; changed buckets are recomputed
+    # afterwards, which also covers a new invoice landing in a changed bucket
+    new_rows = [{name: getattr(obj, name) for name in INVOICE_KEYS + AMOUNTS}
+                for obj in session.new if isinstance(obj, Invoice)]
+    if new_rows:
+        add(new_rows, session.connection())
+    buckets = session.info.pop('report_buckets', set())
+    for obj in session.dirty:
+        if isinstance(obj, Invoice):
+            buckets |= _buckets(obj, _current_values)
+    if buckets:
+        refresh(buckets, session.connection())
+
+
+DIMENSIONS = {
+    'period': ['period'],
+    'client': ['client_id'],
+    'currency': [],
+    'state': ['state'],
+}
+
+
+def breakdown(dimension, period_from=None, period_to=None, currency=None, state=None, client_id=None):
+    """Invoice count and summed amounts per `dimension` and currency, from the summary tables.
+
+    Amounts in different currencies are never added up; every row is for one
+    currency.  period_from/period_to are inclusive 'YYYY-MM' strings.
+    """
+    # Only the client breakdown and client filter need the per-client rows
+    model = InvoiceSummary if dimension == 'client' or client_id else PeriodSummary
+    columns = [getattr(model, name) for name in DIMENSIONS[dimension]] + [model.currency]
+    if dimension == 'client':
+        columns[1:1] = [Client.company_name, Client.first_name, Client.last_name]
+    query = db.session.query(
+        *columns,
+        sa.func.sum(model.invoice_count).label('invoice_count'),
+        *[sa.func.sum(getattr(model, name)).label(name) for name in AMOUNTS],
+    )
+    if dimension == 'client':
+        query = query.join(Client, Client.id == model.client_id)
+    if period_from:
+        query = query.filter(model.period >= period_from)
+    if period_to:
+        query = query.filter(model.period <= period_to)
+    if currency is not None:
+        query = query.filter(model.currency == currency)
+    if state:
+        query = query.filter(model.state == state)
+    if client_id:
+        query = query.filter(model.client_id == client_id)
+    return query.group_by(*columns).order_by(*columns).all()
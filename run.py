@@ -1,5 +1,6 @@
+from app import create_app
 
-from app import app  # Adjust this import based on your app structure
+app = create_app()
 
 if __name__ == "__main__":
-    app.run(debug=False)
\ No newline at end of file
+    app.run(debug=False)
@@ -0,0 +1,234 @@
+"""Full-text search over clients, invoices and service lines.
+
+On SQLite the searchable text is kept in an FTS5 table, search_index, with
+one document per client, invoice and service line.  The rowid encodes the
+source row (id * 4 + kind), so the triggers below can replace or delete a
+document by rowid instead of scanning the index.  Being triggers, they keep
+the index current for every writer: forms, API, bulk imports and plain SQL.
+
+The table and the triggers are created by the migration, and with the
+other tables by create_all() (benchmarks).  Alembic's batch mode recreates
+tables on SQLite, which drops their triggers, so a migration that alters
+client, invoice or invoice_service must create them again afterwards.
+rebuild() refills the index from scratch.  Other databases fall back to
+unranked LIKE queries.
+"""
+import re
+
+import sqlalchemy as sa
+from markupsafe import Markup, escape
+from sqlalchemy import event
+
+from models import db, Client, Invoice, InvoiceService
+
+TABLE = 'search_index'
+KINDS = {'client': 1, 'invoice': 2, 'service': 3}
+PER_PAGE = 20
+# Queries with more matches are listed newest first instead of by relevance:
+# bm25 needs the number of documents containing each word, which for a word
+# in half the database means reading half the index
+RANK_LIMIT = 1000
+MAX_TERMS = 10
+MARK = ('\x02', '\x03')  # Around the matched words in snippets, see snippet_html()
+
+
+def _join(*expressions):
+    return " || ' ' || ".join(f"coalesce({expression}, '')" for expression in expressions)
+
+
+# kind -> (source table, title, body, columns whose updates change the document);
+# {row} is NEW or OLD in the triggers and the table itself when filling the index
+DOCUMENTS = {
+    'client': ('client', _join('{row}.company_name', '{row}.first_name', '{row}.last_name'),
+               _join('{row}.vat_number', '{row}.email', '{row}.phone', '{row}.street', '{row}.postal_code',
+                     '{row}.city', '{row}.state', '{row}.country'),
+               ['company_name', 'first_name', 'last_name', 'vat_number', 'email', 'phone', 'street',
+                'postal_code', 'city', 'state', 'country']),
+    'invoice': ('invoice', _join('{row}.invoice_number', '{row}.invoice_id'), "''",
+                ['invoice_number', 'invoice_id']),
+    'service': ('invoice_service', _join('{row}.service'), "''", ['service']),
+}
+
+
+def _insert_document(kind, row):
+    table, title, body, _ = DOCUMENTS[kind]
+    return (f"INSERT INTO {TABLE} (rowid, kind, title, body) "
+            f"VALUES ({row}.id * 4 + {KINDS[kind]}, '{kind}', {title.format(row=row)}, {body.format(row=row)})")
+
+
+def _delete_document(kind, row):
+    return f"DELETE FROM {TABLE} WHERE rowid = {row}.id * 4 + {KINDS[kind]}"
+
+
+def trigger_statements():
+    statements = []
+    for kind, (table, _, _, columns) in DOCUMENTS.items():
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS {TABLE}_{kind}_insert AFTER INSERT ON {table} BEGIN "
+            f"{_insert_document(kind, 'new')}; END",
+            f"CREATE TRIGGER IF NOT EXISTS {TABLE}_{kind}_update AFTER UPDATE OF {', '.join(columns)} ON {table} "
+            f"BEGIN {_delete_document(kind, 'old')}; {_insert_document(kind, 'new')}; END",
+            f"CREATE TRIGGER IF NOT EXISTS {TABLE}_{kind}_delete AFTER DELETE ON {table} BEGIN "
+            f"{_delete_document(kind, 'old')}; END",
+        ]
+    return statements
+
+
+def fill_statements():
+    """INSERT ... SELECT statements that index every existing row."""
+    return [f"INSERT INTO {TABLE} (rowid, kind, title, body) "
+            f"SELECT id * 4 + {KINDS[kind]}, '{kind}', {title.format(row=table)}, {body.format(row=table)} FROM {table}"
+            for kind, (table, title, body, _) in DOCUMENTS.items()]
+
+
+def create(connection):
+    """Create and fill the index table and its triggers (SQLite only)."""
+    # prefix: also index 2- and 3-letter prefixes, so "Mül"* is an index lookup
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5(kind UNINDEXED, title, body, "
+        f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+    # Default ranking: a match in the title counts ten times one in the body
+    connection.exec_driver_sql(f"INSERT INTO {TABLE} ({TABLE}, rank) VALUES ('rank', 'bm25(0.0, 10.0, 1.0)')")
+    for statement in fill_statements() + trigger_statements():
+        connection.exec_driver_sql(statement)
+
+
+def create_triggers(connection):
+    for statement in trigger_statements():
+        connection.exec_driver_sql(statement)
+
+
+def rebuild(connection=None):
+    """Replace every document with the current clients, invoices and service lines."""
+    conn = connection or db.session.connection()
+    conn.exec_driver_sql(f"DELETE FROM {TABLE}")
+    for statement in fill_statements():
+        conn.exec_driver_sql(statement)
+    conn.exec_driver_sql(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")  # Merge the index segments
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_index(metadata, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    if sa.inspect(connection).has_table(TABLE):
+        create_triggers(connection)
+    else:
+        create(connection)
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_index(metadata, connection, **kw):
+    # drop_all() does not know the table; without this a reset would keep stale documents
+    if connection.dialect.name == 'sqlite':
+        connection.exec_driver_sql(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+def match_expression(query, prefix=False):
+    """FTS5 query for the words in `query`, which must all match.
+
+    With `prefix` the last word may be the beginning of a word, as while
+    typing.  The words are quoted, so FTS5 operators and punctuation in the
+    user's input are searched as text instead of being parsed.
+    """
+    words = [f'"{word}"' for word in re.findall(r'\w+', query)[:MAX_TERMS]]
+    if words and prefix:
+        words[-1] += '*'
+    return ' '.join(words)
+
+
+def snippet_html(text):
+    """Escape a snippet and wrap the matched words in <mark>."""
+    return Markup(str(escape(text)).replace(MARK[0], '<mark>').replace(MARK[1], '</mark>'))
+
+
+def snippet_text(text):
+    return text.replace(MARK[0], '').replace(MARK[1], '')
+
+
+def _fts_matches(conn, query, kind, offset, limit):
+    # The kind is part of the rowid; a filter on the kind column would have
+    # FTS5 intersect the matches with every document of that kind
+    where = f"{TABLE} MATCH ?" + (f" AND rowid % 4 = {KINDS[kind]}" if kind else '')
+    # Whole words if they match anything, otherwise the last word as a prefix.
+    # Prefixes longer than the prefix index make FTS5 collect every matching
+    # document first, whole words are read lazily, newest first
+    match = match_expression(query)
+    if not conn.exec_driver_sql(f"SELECT 1 FROM {TABLE} WHERE {where} LIMIT 1", (match,)).scalar():
+        match = match_expression(query, prefix=True)
+    many = conn.exec_driver_sql(f"SELECT 1 FROM {TABLE} WHERE {where} LIMIT 1 OFFSET ?",
+                                (match, RANK_LIMIT)).scalar()
+    return conn.exec_driver_sql(
+        f"SELECT rowid, kind, snippet({TABLE}, -1, ?, ?, '…', 12) FROM {TABLE} "
+        f"WHERE {where} ORDER BY {'rowid DESC' if many else 'rank, rowid DESC'} LIMIT ? OFFSET ?",
+        (*MARK, match, limit, offset)).all()
+
+
+def _like_matches(conn, query, kind, offset, limit):
+    """Unranked fallback for databases without FTS5: newest matches first."""
+    pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+    def matching(model, kind_name, columns):
+        return (sa.select((model.id * 4 + KINDS[kind_name]).label('rowid'), sa.literal(kind_name).label('kind'),
+                          columns[0].label('snippet'))
+                .where(sa.or_(*[column.ilike(pattern, escape='\\') for column in columns])))
+
+    selects = {
+        'client': matching(Client, 'client', [Client.company_name, Client.first_name, Client.last_name,
+                                              Client.email, Client.street, Client.city]),
+        'invoice': matching(Invoice, 'invoice', [Invoice.invoice_number, Invoice.invoice_id]),
+        'service': matching(InvoiceService, 'service', [InvoiceService.service]),
+    }
+    union = sa.union_all(*[select for name, select in selects.items() if not kind or name == kind]).subquery()
+    return conn.execute(sa.select(union).order_by(union.c.rowid.desc()).limit(limit).offset(offset)).all()
+
+
+def search(query, kind=None, page=1, per_page=PER_PAGE):
+    """Best matches for `query`, optionally of one kind; returns (results, has_more).
+
+    Every result is a dict with kind, id, snippet, and the invoice and client
+    it belongs to (invoice_id, invoice_number, invoice_date, client_id,
+    client_name; None where they do not apply).
+    """
+    if kind and kind not in KINDS:
+        raise ValueError(f"Unknown kind: {kind}")
+    conn = db.session.connection()
+    offset = (page - 1) * per_page
+    if conn.dialect.name == 'sqlite':
+        rows = _fts_matches(conn, query, kind, offset, per_page + 1) if match_expression(query) else []
+    else:
+        rows = _like_matches(conn, query.strip(), kind, offset, per_page + 1) if query.strip() else []
+    has_more = len(rows) > per_page
+    results = [{'kind': kind_name, 'id': rowid // 4, 'snippet': snippet or ''}
+               for rowid, kind_name, snippet in rows[:per_page]]
+    _add_context(results)
+    return results, has_more
+
+
+def _add_context(results):
+    """Fill in the invoice and client of every result with one query per kind."""
+    ids = {kind: {result['id'] for result in results if result['kind'] == kind} for kind in KINDS}
+    service_invoices = dict(db.session.execute(
+        sa.select(InvoiceService.id, InvoiceService.invoice_id).where(InvoiceService.id.in_(ids['service'])))
+        .all()) if ids['service'] else {}
+    invoice_ids = ids['invoice'] | set(service_invoices.values())
+    invoices = {row.id: row for row in db.session.execute(
+        sa.select(Invoice.id, Invoice.invoice_number, Invoice.invoice_date, Invoice.client_id)
+        .where(Invoice.id.in_(invoice_ids)))} if invoice_ids else {}
+    client_ids = ids['client'] | {row.client_id for row in invoices.values()}
+    clients = {row.id: row for row in db.session.execute(
+        sa.select(Client.id, Client.company_name, Client.first_name, Client.last_name)
+        .where(Client.id.in_(client_ids)))} if client_ids else {}
+
+    for result in results:
+        invoice_id = {'invoice': result['id'], 'service': service_invoices.get(result['id'])}.get(result['kind'])
+        invoice = invoices.get(invoice_id)
+        client = clients.get(result['id'] if result['kind'] == 'client' else invoice and invoice.client_id)
+        result.update({
+            'invoice_id': invoice and invoice.id,
+            'invoice_number': invoice and invoice.invoice_number,
+            'invoice_date': invoice and invoice.invoice_date,
+            'client_id': client and client.id,
+            'client_name': client and (client.company_name
+                                       or f"{client.first_name or ''} {client.last_name or ''}".strip()),
+        })
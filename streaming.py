@@ -0,0 +1,57 @@
+"""Build ZIP archives on the fly for streamed downloads.
+
+zipfile writes to any object with write() and tell(); without seek() it falls
+back to data descriptors, so every member can be flushed to the client as
+soon as it is written and the whole archive is never held in memory.
+"""
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _Sink:
+    """Write-only file object that collects bytes until they are drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+        self.pending = 0  # Bytes written since the last drain()
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        self.pending += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+def iter_zip(entries, compression=zipfile.ZIP_DEFLATED):
+    """Yield a ZIP archive chunk by chunk.
+
+    `entries` is an iterable of (name, data) pairs where data is either bytes
+    or an iterable of byte chunks (written as it is produced).
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=compression) as archive:
+        for name, data in entries:
+            if isinstance(data, (bytes, bytearray)):
+                archive.writestr(name, data)
+            else:
+                with archive.open(name, 'w', force_zip64=True) as member:
+                    for chunk in data:
+                        member.write(chunk)
+                        if sink.pending >= CHUNK_SIZE:
+                            yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
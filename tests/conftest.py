@@ -0,0 +1,38 @@
+"""Fixtures: the app on a scratch SQLite file, with its archive attached.
+
+    python -m pytest -q
+"""
+import base64
+import os
+import tempfile
+
+import pytest
+
+# Read when app is imported; a file, not :memory:, so the archive is attached next to it
+DIRECTORY = tempfile.mkdtemp(prefix='simple_invoice_tests-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(DIRECTORY, 'invoicing.db')
+
+from app import create_app, db  # noqa: E402
+from benchmarks.seed import reset  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """The app with empty tables, inside an app context."""
+    app = create_app()
+    with app.app_context():
+        reset()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope='session')
+def auth_headers():
+    config = create_app().config
+    credentials = f"{config['USERNAME']}:{config['PASSWORD']}".encode()
+    return {'Authorization': 'Basic ' + base64.b64encode(credentials).decode()}
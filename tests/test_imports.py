@@ -0,0 +1,27 @@
+from datetime import date
+
+import archive
+import imports
+from benchmarks.seed import seed
+from models import db, Invoice
+
+
+def record(invoice_id):
+    return {'invoice_id': invoice_id, 'invoice_number': '900001', 'invoice_date': '2024-05-01',
+            'client_id': 1, 'state': 'Draft'}, [{'service': 'Work', 'unit_cost': '100', 'quantity': '2'}]
+
+
+def test_archived_invoice_ids_are_not_reused(app):
+    seed(clients=1, invoices=3, lines_per_invoice=1)
+    Invoice.query.filter_by(id=1).update({'state': archive.STATE, 'invoice_date': date(2000, 1, 1)})
+    db.session.commit()
+    assert archive.archive_invoices(date(2001, 1, 1)) == 1
+
+    report = imports.import_invoices([
+        ('item 0', *record('SEED000000001')),  # Archived
+        ('item 1', *record('SEED000000002')),  # Live
+        ('item 2', *record('NEW1')),
+    ])
+    assert report.imported == 1
+    assert report.errors == [('item 0', "Invoice SEED000000001 already exists."),
+                             ('item 1', "Invoice SEED000000002 already exists.")]
@@ -0,0 +1,21 @@
+from benchmarks.seed import seed
+
+
+def test_flash_shown_on_conditional_get(client, auth_headers):
+    seed(clients=1, invoices=1, lines_per_invoice=1)
+    first = client.get('/print_invoice/1')
+    assert first.status_code == 200
+    assert client.get('/print_invoice/1', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    sent = client.post('/print_invoice/1/send', data={'format': 'html'}, headers=auth_headers)
+    assert sent.status_code == 302
+
+    # The browser revalidates its copy, which has no message
+    response = client.get('/print_invoice/1', headers={
+        'If-None-Match': first.headers['ETag'], 'If-Modified-Since': first.headers['Last-Modified']})
+    assert response.status_code == 200
+    assert b'The invoice will be sent to client1@example.com.' in response.data
+    assert response.cache_control.no_store
+
+    # Shown once; afterwards the cached page is unchanged
+    assert client.get('/print_invoice/1', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
@@ -0,0 +1,25 @@
+"""No route may issue more SQL statements on more data (see benchmarks/query_counts.py)."""
+import pytest
+
+from app import create_app
+from benchmarks.query_counts import ROUTES, SIZES, count_statements
+from benchmarks.seed import reset, seed
+
+
+@pytest.fixture(scope='module')
+def counts(auth_headers):
+    """{size: {url: statements}} for every size in SIZES."""
+    app = create_app()
+    counts = {}
+    for size, volumes in SIZES.items():
+        with app.app_context():
+            reset()
+            seed(**volumes)
+            client = app.test_client()
+            counts[size] = {url: count_statements(client, url, auth_headers) for url in ROUTES}
+    return counts
+
+
+@pytest.mark.parametrize('url', ROUTES)
+def test_statements_do_not_grow_with_the_data(counts, url):
+    assert counts['large'][url] <= counts['small'][url]
@@ -0,0 +1,32 @@
+import os
+
+from render_cache import RenderCache
+
+
+def files(directory):
+    return sorted(os.path.relpath(os.path.join(root, name), directory)
+                  for root, dirs, names in os.walk(directory) for name in names)
+
+
+def test_newer_version_replaces_the_file(tmp_path):
+    cache = RenderCache(directory=str(tmp_path))
+    cache.set((1, 'default', 'en', 'v1'), 'first')
+    cache.set((1, 'default', 'en', 'v2'), 'second')
+    cache.set((1, 'default', 'fr', 'v2'), 'deuxième')
+    assert len(files(tmp_path)) == 2
+
+    # A new process reads the files
+    cache = RenderCache(directory=str(tmp_path))
+    assert cache.get((1, 'default', 'en', 'v1')) is None
+    assert cache.get((1, 'default', 'en', 'v2')) == 'second'
+    assert cache.get((1, 'default', 'fr', 'v2')) == 'deuxième'
+
+
+def test_invalidate_removes_only_the_given_invoices(tmp_path):
+    cache = RenderCache(directory=str(tmp_path))
+    cache.set((1, 'default', 'en', 'v1'), 'one')
+    cache.set((2, 'default', 'en', 'v1'), 'two')
+    cache.invalidate(1)
+    assert cache.get((1, 'default', 'en', 'v1')) is None
+    assert RenderCache(directory=str(tmp_path)).get((2, 'default', 'en', 'v1')) == 'two'
+    assert files(tmp_path) == [os.path.join('2', os.listdir(tmp_path / '2')[0])]
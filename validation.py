@@ -0,0 +1,124 @@
+"""Validation rules for invoice data, shared by the invoice form and the importers."""
+import math
+from datetime import datetime
+
+TRUE_VALUES = {'on', 'true', '1', 'yes', 'y'}
+CLIENT_FIELDS = ['company_name', 'vat_number', 'vat_percentage', 'street', 'city', 'state', 'postal_code',
+                 'country', 'first_name', 'last_name', 'email', 'phone', 'currency', 'language', 'payment_terms',
+                 'payment_days']
+
+
+class ValidationError(ValueError):
+    """Invalid invoice data; the message is meant for the user."""
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in TRUE_VALUES
+
+
+def _blank(value):
+    return value is None or str(value).strip() == ''
+
+
+def _to_float(value):
+    # float() also accepts 'nan' and 'inf', which no amount or percentage can be
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(value)
+    return number
+
+
+def _to_date(value):
+    if hasattr(value, 'year'):
+        return value
+    return datetime.strptime(str(value).strip(), '%Y-%m-%d').date()
+
+
+def clean_invoice(data, lines):
+    """Validate invoice fields and service lines like the invoice form does.
+
+    `data` is a mapping with invoice_id, invoice_number, invoice_date,
+    client_id, state and optionally due_date, discount, apply_vat,
+    vat_percentage and currency; `lines` is an iterable of mappings with
+    service, unit_cost and quantity.  Returns (invoice_fields, service_lines)
+    with typed values, or raises ValidationError.
+    """
+    required = ['invoice_id', 'invoice_number', 'invoice_date', 'client_id', 'state']
+    if any(_blank(data.get(field)) for field in required):
+        raise ValidationError("Please fill in all required fields.")
+
+    try:
+        invoice_date = _to_date(data['invoice_date'])
+        due_date = None if _blank(data.get('due_date')) else _to_date(data['due_date'])
+    except ValueError:
+        raise ValidationError("Invalid date format. Please use YYYY-MM-DD.")
+    if due_date is not None and due_date < invoice_date:
+        raise ValidationError("The due date cannot be before the invoice date.")
+
+    try:
+        client_id = int(data['client_id'])
+    except (TypeError, ValueError, OverflowError):
+        raise ValidationError("Invalid client.")
+
+    try:
+        discount = _to_float(data.get('discount') or 0)
+        vat_percentage = _to_float(data.get('vat_percentage') or 0)
+    except (TypeError, ValueError):
+        raise ValidationError("Invalid discount or VAT percentage. Please enter valid numbers.")
+
+    services = []
+    for line in lines:
+        service, unit_cost, quantity = line.get('service'), line.get('unit_cost'), line.get('quantity')
+        if _blank(service) or _blank(unit_cost) or _blank(quantity):
+            raise ValidationError("Please fill in all service details.")
+        try:
+            unit_cost = _to_float(unit_cost)
+            quantity = int(quantity)
+        except (TypeError, ValueError, OverflowError):
+            raise ValidationError("Invalid unit cost or quantity. Please enter valid numbers.")
+        services.append({'service': str(service), 'unit_cost': unit_cost, 'quantity': quantity})
+
+    fields = {
+        'invoice_id': str(data['invoice_id']).strip(),
+        'invoice_number': str(data['invoice_number']).strip(),
+        'invoice_date': invoice_date,
+        'client_id': client_id,
+        'state': str(data['state']).strip(),
+        'due_date': due_date,  # None: from the client's payment days, see aging.py
+        'discount': discount,
+        'apply_vat': _to_bool(data.get('apply_vat')),
+        'vat_percentage': vat_percentage,
+        'currency': data.get('currency'),
+    }
+    return fields, services
+
+
+def clean_client(data):
+    """Validate client fields; like the client form, every field is optional.
+
+    Only the fields present in `data` are returned, so the result can be used
+    for partial updates.  Raises ValidationError.
+    """
+    unknown = set(data) - set(CLIENT_FIELDS)
+    if unknown:
+        raise ValidationError(f"Unknown client fields: {', '.join(sorted(unknown))}.")
+    fields = {}
+    for name, value in data.items():
+        if name == 'vat_percentage':
+            try:
+                value = None if _blank(value) else _to_float(value)
+            except (TypeError, ValueError):
+                raise ValidationError("Invalid VAT percentage. Please enter a valid number.")
+        elif name == 'payment_days':
+            try:
+                value = None if _blank(value) else int(value)
+                if value is not None and value < 0:
+                    raise ValueError(value)
+            except (TypeError, ValueError, OverflowError):
+                raise ValidationError("Invalid payment days. Please enter a whole number of days.")
+        elif value is not None:
+            value = str(value).strip()
+        fields[name] = value
+    return fields
@@ -0,0 +1,17 @@
+"""Entry point for production WSGI servers and the flask command.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    flask --app wsgi db upgrade
+
+With gunicorn's preload_app (see gunicorn.conf.py) this module is imported
+once in the master process: the app, its translations and personas and the
+compiled templates are loaded before the workers are forked, and the
+workers share those memory pages instead of loading their own copies.
+"""
+from app import create_app
+
+app = create_app()
+
+# Compile every template now rather than on the first request of each worker
+for name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(name)